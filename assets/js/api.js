@@ -63,7 +63,13 @@ export function getApiMode() {
   return mode;
 }
 
+// Gli URL restituiti dal backend ("/api/...") vanno risolti sulla base API configurata
+function assetUrl(path) {
+  return path && path.startsWith("/api/") ? REMOTE_BASE + path.slice(4) : path;
+}
+
 export const api = {
+  assetUrl,
   health: () => exec("/health", {}, () => localApi.health()),
   getPresets: () => exec("/presets", {}, () => localApi.getPresets()),
   getReportSettings: () => exec("/report-settings", {}, () => localApi.getReportSettings()),
@@ -6,8 +6,13 @@
  * - FORCE_LOCAL_DB:
  *   - true  => forza archivio locale browser
  *   - false => usa API se disponibile
+ * - SYNC_API_BASE_URL:
+ *   - vuoto => archivio locale solo nel browser
+ *   - esempio => "https://tuo-backend.onrender.com/api": all'avvio in modalità locale
+ *     invia le modifiche locali e scarica quelle del server (in conflitto vince il server)
  */
 window.APP_CONFIG = window.APP_CONFIG || {
   API_BASE_URL: "",
   FORCE_LOCAL_DB: true,
+  SYNC_API_BASE_URL: "",
 };
@@ -79,6 +79,39 @@ function nowIso() {
   return new Date().toISOString();
 }
 
+function newUid() {
+  if (globalThis.crypto?.randomUUID) return globalThis.crypto.randomUUID();
+  return "xxxxxxxx-xxxx-4xxx-yxxx-xxxxxxxxxxxx".replace(/[xy]/g, (c) => {
+    const r = (Math.random() * 16) | 0;
+    return (c === "x" ? r : (r & 0x3) | 0x8).toString(16);
+  });
+}
+
+// Archivi creati prima della sincronizzazione: uid alle righe, tutto da inviare al server
+function ensureSyncFields(data) {
+  if (!data.sync || typeof data.sync !== "object") data.sync = {};
+  data.sync.last_seq = Number(data.sync.last_seq || 0);
+  if (!Array.isArray(data.sync.deleted)) data.sync.deleted = [];
+
+  const patientUids = new Map();
+  data.patients.forEach((p) => {
+    if (!p.uid) {
+      p.uid = newUid();
+      p.change_seq = null;
+      p.dirty = true;
+    }
+    patientUids.set(Number(p.id), p.uid);
+  });
+  data.exams.forEach((e) => {
+    if (!e.patient_uid) e.patient_uid = patientUids.get(Number(e.patient_id)) || null;
+    if (!e.uid) {
+      e.uid = newUid();
+      e.change_seq = null;
+      e.dirty = true;
+    }
+  });
+}
+
 function loadStore() {
   try {
     const raw = localStorage.getItem(STORAGE_KEY);
@@ -90,9 +123,10 @@ function loadStore() {
     if (!data.counters || typeof data.counters !== "object") data.counters = { patient: 0, exam: 0 };
     data.counters.patient = Number(data.counters.patient || 0);
     data.counters.exam = Number(data.counters.exam || 0);
+    ensureSyncFields(data);
     return data;
   } catch {
-    const init = { patients: [], exams: [], counters: { patient: 0, exam: 0 } };
+    const init = { patients: [], exams: [], counters: { patient: 0, exam: 0 }, sync: { last_seq: 0, deleted: [] } };
     localStorage.setItem(STORAGE_KEY, JSON.stringify(init));
     return init;
   }
@@ -135,7 +169,8 @@ function loadReportSettings() {
 }
 
 function saveReportSettingsData(payload = {}) {
-  const merged = normalizeReportSettings(payload);
+  // Campi assenti (es. logo non modificato) restano quelli salvati
+  const merged = normalizeReportSettings({ ...loadReportSettings(), ...payload });
   localStorage.setItem(REPORT_SETTINGS_KEY, JSON.stringify(merged));
   return merged;
 }
@@ -311,6 +346,9 @@ function toPatientOut(p) {
     notes: p.notes || null,
     created_at: p.created_at || nowIso(),
     updated_at: p.updated_at || nowIso(),
+    uid: p.uid || newUid(),
+    change_seq: p.change_seq ?? null,
+    dirty: !!p.dirty,
   };
 }
 
@@ -349,6 +387,10 @@ function toExamOut(e) {
     interpretation_summary: e.interpretation_summary || null,
     interpretation: e.interpretation || interpretExam(e),
     created_at: e.created_at || nowIso(),
+    uid: e.uid || newUid(),
+    patient_uid: e.patient_uid || null,
+    change_seq: e.change_seq ?? null,
+    dirty: !!e.dirty,
   });
 }
 
@@ -418,6 +460,7 @@ export const localApi = {
       notes: payload.notes || null,
       created_at: now,
       updated_at: now,
+      dirty: true,
     });
 
     db.patients.push(row);
@@ -438,7 +481,10 @@ export const localApi = {
       id: cur.id,
       birth_date: payload.birth_date !== undefined ? toDateString(payload.birth_date) : cur.birth_date,
       sex: payload.sex ? (payload.sex === "F" ? "F" : "M") : cur.sex,
+      uid: cur.uid,
+      change_seq: cur.change_seq,
       updated_at: nowIso(),
+      dirty: true,
     });
 
     db.patients[idx] = merged;
@@ -449,6 +495,11 @@ export const localApi = {
   async deletePatient(id) {
     const db = loadStore();
     const pid = Number(id);
+    const row = db.patients.find((p) => Number(p.id) === pid);
+    // Gli esami del paziente li cancella il server insieme al paziente
+    if (row && row.change_seq !== null) {
+      db.sync.deleted.push({ entity: "patient", uid: row.uid, base_seq: row.change_seq });
+    }
     db.patients = db.patients.filter((p) => Number(p.id) !== pid);
     db.exams = db.exams.filter((e) => Number(e.patient_id) !== pid);
     saveStore(db);
@@ -488,6 +539,8 @@ export const localApi = {
       interpretation,
       interpretation_summary: interpretation.summary,
       created_at: now,
+      patient_uid: patient.uid,
+      dirty: true,
     });
 
     db.exams.push(row);
@@ -518,12 +571,182 @@ export const localApi = {
 
   async deleteExam(id) {
     const db = loadStore();
+    const row = db.exams.find((e) => Number(e.id) === Number(id));
+    if (row && row.change_seq !== null) {
+      db.sync.deleted.push({ entity: "exam", uid: row.uid, base_seq: row.change_seq });
+    }
     db.exams = db.exams.filter((e) => Number(e.id) !== Number(id));
     saveStore(db);
     return null;
   },
 };
 
+const SYNC_BATCH_SIZE = 500;
+const SYNC_PAGE_SIZE = 500;
+
+const PATIENT_SYNC_FIELDS = ["surname", "name", "birth_date", "sex", "fiscal_code", "phone", "email", "notes"];
+const EXAM_SYNC_FIELDS = [
+  "exam_date", "requester_doctor", "acceptance_number", "curve_mode", "pregnant_mode", "glucose_load_g",
+  "glyc_unit", "ins_unit", "glyc_times", "ins_times", "glyc_refs", "ins_refs", "methodology", "notes",
+];
+
+function pick(row, fields) {
+  return Object.fromEntries(fields.map((k) => [k, row[k] ?? null]).filter(([, v]) => v !== null));
+}
+
+// Valori allineati ai tempi: vuoto -> null (prelievo senza valore), numeri normalizzati.
+// Un testo non numerico è inviato com'è: il server rifiuta l'esame ("invalid") e la copia locale resta intatta.
+function syncValues(values) {
+  const out = (values || []).map((raw) => {
+    const text = raw === null || raw === undefined ? "" : String(raw).trim();
+    if (text === "") return null;
+    const n = Number(text.replace(",", "."));
+    return Number.isFinite(n) ? n : raw;
+  });
+  while (out.length && out[out.length - 1] === null) out.pop();
+  return out;
+}
+
+function examSyncPayload(e) {
+  return {
+    ...pick(e, EXAM_SYNC_FIELDS),
+    pregnant_mode: !!e.pregnant_mode,
+    glyc_values: syncValues(e.glyc_values),
+    ins_values: syncValues(e.ins_values),
+    uid: e.uid,
+    patient_uid: e.patient_uid,
+    base_seq: e.change_seq,
+  };
+}
+
+async function syncRequest(baseUrl, path, opts = {}) {
+  const res = await fetch(baseUrl + path, { headers: { "Content-Type": "application/json" }, ...opts });
+  const data = await res.json().catch(() => ({}));
+  if (!res.ok) throw new Error(data.detail ? JSON.stringify(data.detail) : `Errore sincronizzazione (${res.status})`);
+  return data;
+}
+
+function chunks(rows, size) {
+  const out = [];
+  for (let i = 0; i < rows.length; i += size) out.push(rows.slice(i, i + size));
+  return out;
+}
+
+function applyPushResult(db, result) {
+  const byUid = (entity) => (entity === "patient" ? db.patients : db.exams);
+  result.applied.forEach((a) => {
+    if (a.action === "deleted") {
+      db.sync.deleted = db.sync.deleted.filter((d) => d.uid !== a.uid);
+      return;
+    }
+    const row = byUid(a.entity).find((r) => r.uid === a.uid);
+    if (row) {
+      row.change_seq = a.change_seq;
+      row.dirty = false;
+    }
+  });
+  // Conflitti: vince il server. La sua versione arriva con il pull; se la riga è stata
+  // cancellata sul server (o il paziente dell'esame non esiste più) si scarta la copia locale.
+  // Le righe rifiutate come non valide restano locali e da inviare: si correggono e si riprova.
+  const invalid = [];
+  result.conflicts.forEach((c) => {
+    if (c.reason === "invalid") {
+      invalid.push(c);
+      return;
+    }
+    db.sync.deleted = db.sync.deleted.filter((d) => d.uid !== c.uid);
+    if (c.reason === "changed") {
+      const row = byUid(c.entity).find((r) => r.uid === c.uid);
+      if (row) row.dirty = false;
+    } else if (c.entity === "patient") {
+      const row = db.patients.find((p) => p.uid === c.uid);
+      db.patients = db.patients.filter((p) => p.uid !== c.uid);
+      if (row) db.exams = db.exams.filter((e) => Number(e.patient_id) !== Number(row.id));
+    } else {
+      const row = db.exams.find((e) => e.uid === c.uid);
+      // Paziente non ancora sul server (es. rifiutato come non valido): l'esame resta in attesa
+      if (c.reason === "patient_missing" && row && db.patients.some((p) => p.uid === row.patient_uid)) return;
+      db.exams = db.exams.filter((e) => e.uid !== c.uid);
+    }
+  });
+  return invalid;
+}
+
+function applyChanges(db, changes) {
+  changes.patients.forEach((p) => {
+    const cur = db.patients.find((r) => r.uid === p.uid);
+    const row = toPatientOut({ ...p, id: cur ? cur.id : ++db.counters.patient, dirty: false });
+    if (cur) db.patients[db.patients.indexOf(cur)] = row;
+    else db.patients.push(row);
+  });
+  changes.exams.forEach((e) => {
+    const cur = db.exams.find((r) => r.uid === e.uid);
+    const patient = db.patients.find((p) => p.uid === e.patient_uid);
+    const row = toExamOut({ ...e, id: cur ? cur.id : ++db.counters.exam, dirty: false });
+    row.patient_id = patient ? patient.id : null; // risolto a fine pull se il paziente arriva dopo
+    if (cur) db.exams[db.exams.indexOf(cur)] = row;
+    else db.exams.push(row);
+  });
+  changes.deleted.forEach((d) => {
+    if (d.entity === "exam") {
+      db.exams = db.exams.filter((e) => e.uid !== d.uid);
+    } else {
+      db.patients = db.patients.filter((p) => p.uid !== d.uid);
+      db.exams = db.exams.filter((e) => e.patient_uid !== d.uid);
+    }
+  });
+  db.sync.last_seq = changes.until;
+}
+
+/**
+ * Sincronizza l'archivio locale con il backend (baseUrl = ".../api"):
+ * invia le modifiche locali (pazienti, esami, cancellazioni) e scarica quelle del server
+ * successive all'ultimo numero di sequenza ricevuto. In caso di conflitto vince il server.
+ */
+export async function syncLocalDatabase(baseUrl) {
+  const base = String(baseUrl || "").trim().replace(/\/$/, "");
+  const db = loadStore();
+
+  const patients = db.patients.filter((p) => p.dirty).map((p) => ({
+    ...pick(p, PATIENT_SYNC_FIELDS),
+    uid: p.uid,
+    base_seq: p.change_seq,
+  }));
+  const exams = db.exams.filter((e) => e.dirty && e.patient_uid).map(examSyncPayload);
+  const batches = [
+    ...chunks(patients, SYNC_BATCH_SIZE).map((rows) => ({ patients: rows })),
+    ...chunks(exams, SYNC_BATCH_SIZE).map((rows) => ({ exams: rows })),
+    ...chunks(db.sync.deleted, SYNC_BATCH_SIZE).map((rows) => ({ deleted: rows })),
+  ];
+  let pushed = 0;
+  let conflicts = 0;
+  const invalid = [];
+  for (const body of batches) {
+    const result = await syncRequest(base, "/sync/push", { method: "POST", body: JSON.stringify(body) });
+    invalid.push(...applyPushResult(db, result));
+    saveStore(db);
+    pushed += result.applied.length;
+    conflicts += result.conflicts.length;
+  }
+
+  let pulled = 0;
+  for (;;) {
+    const changes = await syncRequest(base, `/sync/changes?since=${db.sync.last_seq}&limit=${SYNC_PAGE_SIZE}`);
+    applyChanges(db, changes);
+    pulled += changes.patients.length + changes.exams.length + changes.deleted.length;
+    if (!changes.has_more) break;
+  }
+  db.exams.forEach((e) => {
+    if (e.patient_id === null) {
+      const patient = db.patients.find((p) => p.uid === e.patient_uid);
+      e.patient_id = patient ? patient.id : null;
+    }
+  });
+  db.exams = db.exams.filter((e) => e.patient_id !== null);
+  saveStore(db);
+  return { pushed, pulled, conflicts: conflicts - invalid.length, invalid, last_seq: db.sync.last_seq };
+}
+
 export function clearLocalDatabase() {
   localStorage.removeItem(STORAGE_KEY);
 }
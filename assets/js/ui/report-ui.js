@@ -9,8 +9,14 @@ const DEFAULT_REPORT_SETTINGS = {
   include_interpretation_pdf: true,
   merge_charts_pdf: true,
   header_logo_data_url: null,
+  header_logo_url: null,
+  header_logo_hash: null,
 };
 
+// Logo modificato (caricato o rimosso) e non ancora salvato: solo allora viaggia come data URL
+let logoChanged = false;
+const logoCache = new Map();
+
 function $(id) {
   return document.getElementById(id);
 }
@@ -59,9 +65,42 @@ function normalizeSettings(data) {
   s.include_interpretation_pdf = parseBool(s.include_interpretation_pdf, true);
   s.merge_charts_pdf = parseBool(s.merge_charts_pdf, true);
   s.header_logo_data_url = s.header_logo_data_url || null;
+  s.header_logo_url = s.header_logo_url || null;
   return s;
 }
 
+function logoSrc(settings, variant = "screen") {
+  if (settings.header_logo_data_url) return settings.header_logo_data_url;
+  if (!settings.header_logo_url) return null;
+  return api.assetUrl(`${settings.header_logo_url}&variant=${variant}`);
+}
+
+function blobToDataUrl(blob) {
+  return new Promise((resolve, reject) => {
+    const reader = new FileReader();
+    reader.onload = () => resolve(reader.result);
+    reader.onerror = () => reject(reader.error);
+    reader.readAsDataURL(blob);
+  });
+}
+
+async function logoDataUrl(settings) {
+  // jsPDF vuole il logo come data URL: variante di stampa scaricata una volta per hash
+  if (settings.header_logo_data_url || !settings.header_logo_url) return settings.header_logo_data_url || null;
+  const key = settings.header_logo_hash || settings.header_logo_url;
+  if (!logoCache.has(key)) {
+    try {
+      const res = await fetch(logoSrc(settings, "print"));
+      if (!res.ok) throw new Error(`Errore logo (${res.status})`);
+      logoCache.set(key, await blobToDataUrl(await res.blob()));
+    } catch (err) {
+      console.error(err);
+      return null;
+    }
+  }
+  return logoCache.get(key);
+}
+
 function setStatus(msg, ok = true) {
   const el = $("reportSettingsStatus");
   if (!el) return;
@@ -70,18 +109,18 @@ function setStatus(msg, ok = true) {
   el.classList.toggle("status-err", !ok);
 }
 
-function setLogoPreview(dataUrl) {
+function setLogoPreview(src) {
   const box = $("logoPreviewBox");
   if (!box) return;
 
-  if (!dataUrl) {
+  if (!src) {
     box.classList.add("muted");
     box.innerHTML = "Nessun logo impostato";
     return;
   }
 
   box.classList.remove("muted");
-  box.innerHTML = `<img src="${esc(dataUrl)}" alt="Logo intestazione" class="logo-preview-img" />`;
+  box.innerHTML = `<img src="${esc(src)}" alt="Logo intestazione" class="logo-preview-img" />`;
 }
 
 function applySettingsToForm(settings) {
@@ -91,7 +130,7 @@ function applySettingsToForm(settings) {
   if ($("header_line3")) $("header_line3").value = settings.header_line3 || "";
   if ($("include_interpretation_pdf")) $("include_interpretation_pdf").checked = !!settings.include_interpretation_pdf;
   if ($("merge_charts_pdf")) $("merge_charts_pdf").checked = !!settings.merge_charts_pdf;
-  setLogoPreview(settings.header_logo_data_url);
+  setLogoPreview(logoSrc(settings));
 }
 
 function getFormSettings() {
@@ -103,6 +142,8 @@ function getFormSettings() {
     include_interpretation_pdf: !!$("include_interpretation_pdf")?.checked,
     merge_charts_pdf: !!$("merge_charts_pdf")?.checked,
     header_logo_data_url: state.reportSettings?.header_logo_data_url || null,
+    header_logo_url: state.reportSettings?.header_logo_url || null,
+    header_logo_hash: state.reportSettings?.header_logo_hash || null,
   });
 }
 
@@ -121,9 +162,12 @@ async function loadReportSettings() {
 }
 
 async function saveReportSettings() {
-  const payload = getFormSettings();
+  const { header_logo_url, header_logo_hash, ...payload } = getFormSettings();
+  // Logo invariato: non si reinvia (il backend lo conserva)
+  if (!logoChanged) delete payload.header_logo_data_url;
   try {
     const saved = normalizeSettings(await api.saveReportSettings(payload));
+    logoChanged = false;
     state.reportSettings = saved;
     applySettingsToForm(saved);
     setStatus(`Impostazioni salvate (${nowIT()})`, true);
@@ -609,7 +653,7 @@ function chartImagesForReport(payload, settings) {
   return out;
 }
 
-export function generatePdf() {
+export async function generatePdf() {
   if (!state.selectedPatient) {
     alert("Seleziona un paziente prima di generare il PDF.");
     return;
@@ -624,8 +668,9 @@ export function generatePdf() {
   }
 
   const payload = state.lastPayload;
-  const settings = normalizeSettings({ ...state.reportSettings, ...getFormSettings() });
-  state.reportSettings = settings;
+  const formSettings = normalizeSettings({ ...state.reportSettings, ...getFormSettings() });
+  state.reportSettings = formSettings;
+  const settings = { ...formSettings, header_logo_data_url: await logoDataUrl(formSettings) };
 
   const meth = parseMethodologyField(payload);
 
@@ -804,6 +849,7 @@ function bindLogoUpload() {
     reader.onload = () => {
       const dataUrl = typeof reader.result === "string" ? reader.result : null;
       state.reportSettings = normalizeSettings({ ...state.reportSettings, header_logo_data_url: dataUrl });
+      logoChanged = true;
       setLogoPreview(dataUrl);
       setStatus("Logo caricato. Salva le impostazioni per renderlo predefinito.", true);
     };
@@ -814,7 +860,13 @@ function bindLogoUpload() {
   });
 
   $("btnRemoveLogo")?.addEventListener("click", () => {
-    state.reportSettings = normalizeSettings({ ...state.reportSettings, header_logo_data_url: null });
+    state.reportSettings = normalizeSettings({
+      ...state.reportSettings,
+      header_logo_data_url: null,
+      header_logo_url: null,
+      header_logo_hash: null,
+    });
+    logoChanged = true;
     if (fileInput) fileInput.value = "";
     setLogoPreview(null);
     setStatus("Logo rimosso. Salva le impostazioni per confermare.", true);
@@ -7,6 +7,41 @@ class Settings(BaseSettings):
     env: str = "development"
     debug: bool = True
     database_url: str = "sqlite:///./curve_lab.db"
+    async_database_url: str = ""  # vuoto = database_url con driver asyncio (aiosqlite/asyncpg)
+    read_database_url: str = ""  # vuoto = stesso DB; es. replica in sola lettura per le GET
+
+    # Pool connessioni (ignorati per SQLite in memoria)
+    db_pool_size: int = 10
+    db_max_overflow: int = 20
+    db_pool_recycle: int = 1800  # secondi
+    db_pool_pre_ping: bool = True
+
+    # PRAGMA applicati a ogni connessione SQLite
+    sqlite_journal_mode: str = "WAL"
+    sqlite_synchronous: str = "NORMAL"
+    sqlite_busy_timeout_ms: int = 5000
+    sqlite_mmap_size: int = 268_435_456  # 256 MiB
+    sqlite_cache_size_kib: int = 65_536  # 64 MiB
+
+    # Avvio: python -m app.serve esegue le migrazioni una volta e avvia WEB_CONCURRENCY worker uvicorn
+    host: str = "0.0.0.0"
+    port: int = 8000
+    web_concurrency: int = 0  # worker di app.serve; 0 = numero di CPU
+    run_migrations_on_startup: bool = True  # False nei worker di app.serve (migrazioni già eseguite)
+    cache_check_interval_ms: int = 1000  # ogni quanto un worker verifica se profilo/impostazioni sono cambiati altrove
+
+    reinterpret_on_startup: bool = True  # job di reinterpretazione in background all'avvio se servono
+    report_workers: int = 0  # processi di rendering PDF; 0 = numero di CPU
+    report_output_dir: str = "./reports"  # zip/PDF prodotti dai job di stampa massiva
+    report_output_ttl_hours: int = 24  # poi i file dei job sono eliminati; 0 = conservati
+    report_cache_dir: str = "./cache/reports"  # grafici/referti per esame, indirizzati per contenuto
+    report_cache_max_mb: int = 512  # oltre questa dimensione si eliminano i file usati meno di recente
+    fast_json: bool = False  # ORJSONResponse e serializzazione diretta delle GET principali (richiede orjson)
+    compress_responses: bool = False  # brotli (se installato) o gzip
+    compress_min_size: int = 1024  # byte: risposte più piccole non compresse
+    metrics_enabled: bool = True  # tempi, query per richiesta e sezioni su /api/metrics, header Server-Timing
+    slow_request_ms: int = 1000  # richieste più lente finiscono nel log con query e tempo DB; 0 = mai
+    profiling_enabled: bool = False  # profiler a campionamento su /api/profile (solo per diagnosi)
     cors_origins: str = "*"
 
     model_config = SettingsConfigDict(env_file="../.env", env_file_encoding="utf-8", extra="ignore")
@@ -0,0 +1,44 @@
+import base64
+import json
+from sqlalchemy import and_, or_
+
+
+def encode_cursor(values: list) -> str:
+    raw = json.dumps(values, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, types: tuple) -> list:
+    """Decodifica un cursore opaco e ne verifica i tipi; ValueError se malformato."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw.decode("utf-8"))
+    except Exception as exc:
+        raise ValueError("Cursore non valido") from exc
+    if (
+        not isinstance(values, list)
+        or len(values) != len(types)
+        or not all(isinstance(v, t) for v, t in zip(values, types))
+    ):
+        raise ValueError("Cursore non valido")
+    return values
+
+
+def seek_after(columns: list, values: list, descending: bool = False):
+    """
+    Condizione keyset "dopo (v1, v2, ...)" nell'ordinamento dato,
+    espansa in OR/AND così che l'indice composito possa servirla.
+    """
+    clauses = []
+    for i, col in enumerate(columns):
+        cmp = col < values[i] if descending else col > values[i]
+        clauses.append(and_(*[columns[j] == values[j] for j in range(i)], cmp))
+    return or_(*clauses)
+
+
+def page(rows: list, limit: int, key) -> tuple[list, str | None]:
+    """Taglia la riga sentinella (limit + 1) e calcola il cursore della pagina successiva."""
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(key(rows[-1]))
@@ -1,48 +1,279 @@
 import json
-from sqlalchemy.orm import Session
+from datetime import date
+from sqlalchemy import delete, insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, joinedload
 from .. import models, schemas
+from ..services import rollups, sync
+from ..services.curve_metrics import compute_metrics
+from ..services.interpretation import interpretation_columns
+from .cursors import decode_cursor, page, seek_after
 
 
-def create_exam(db: Session, payload: schemas.ExamCreate, interpretation: dict) -> models.Exam:
-    p = payload.model_dump()
-    exam = models.Exam(
-        patient_id=p["patient_id"],
-        exam_date=p["exam_date"],
-        requester_doctor=p.get("requester_doctor"),
-        acceptance_number=p.get("acceptance_number"),
-        curve_mode=p["curve_mode"],
-        pregnant_mode=1 if p["pregnant_mode"] else 0,
-        glucose_load_g=p["glucose_load_g"],
-        glyc_unit=p["glyc_unit"],
-        ins_unit=p["ins_unit"],
-        glyc_times_json=json.dumps(p["glyc_times"]),
-        ins_times_json=json.dumps(p["ins_times"]),
-        glyc_values_json=json.dumps(p["glyc_values"]),
-        ins_values_json=json.dumps(p["ins_values"]),
-        glyc_refs_json=json.dumps({k: v for k, v in p["glyc_refs"].items()}),
-        ins_refs_json=json.dumps({k: v for k, v in p["ins_refs"].items()}),
-        methodology=p.get("methodology"),
-        notes=p.get("notes"),
-        interpretation_summary=interpretation.get("summary"),
-        interpretation_details_json=json.dumps(interpretation),
-    )
-    db.add(exam)
-    db.commit()
-    db.refresh(exam)
-    return exam
-
-
-def list_exams(db: Session, patient_id: int | None = None, limit: int = 100):
-    q = db.query(models.Exam)
+SERIES = ("glyc", "ins")
+
+
+def _num(value):
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def build_points(series: str, times, values, refs) -> list[dict]:
+    """
+    Righe exam_points di una serie: un punto per tempo prelevato, più i range senza prelievo.
+
+    Un tempo ripetuto tiene il primo prelievo, come ExamSeries.at; i valori oltre i tempi
+    non hanno un punto (vedi discarded_samples).
+    """
+    rows: dict[int, dict] = {}
+    for pos, t in enumerate(times or []):
+        if int(t) in rows:
+            continue
+        rows[int(t)] = {
+            "series": series,
+            "time_min": int(t),
+            "position": pos,
+            "value": _num(values[pos]) if pos < len(values or []) else None,
+            "ref_min": None,
+            "ref_max": None,
+        }
+    for key, ref in (refs or {}).items():
+        try:
+            t = int(key)
+        except (TypeError, ValueError):
+            continue
+        if not isinstance(ref, dict):
+            continue
+        row = rows.setdefault(
+            t,
+            {"series": series, "time_min": t, "position": None, "value": None, "ref_min": None, "ref_max": None},
+        )
+        row["ref_min"] = _num(ref.get("min"))
+        row["ref_max"] = _num(ref.get("max"))
+    return list(rows.values())
+
+
+def discarded_samples(times, values) -> int:
+    """Prelievi che build_points non può rappresentare: tempi ripetuti e valori senza tempo."""
+    times = [int(t) for t in times or []]
+    return len(times) - len(set(times)) + max(0, len(values or []) - len(times))
+
+
+def points_to_series(points) -> dict:
+    """Ricostruisce times/values/refs per serie dalle righe exam_points."""
+    out = {}
+    for s in SERIES:
+        out[f"{s}_times"] = []
+        out[f"{s}_values"] = []
+        out[f"{s}_refs"] = {}
+
+    ordered = sorted(points, key=lambda p: (p.position is None, p.position or 0, p.time_min))
+    for p in ordered:
+        if p.position is not None:
+            out[f"{p.series}_times"].append(p.time_min)
+            out[f"{p.series}_values"].append(p.value)
+        # Range anche solo minimo o solo massimo, come nel JSON degli esami storici
+        if p.ref_min is not None or p.ref_max is not None:
+            out[f"{p.series}_refs"][str(p.time_min)] = {"min": p.ref_min, "max": p.ref_max}
+
+    # I valori mancanti possono essere solo in coda (payload con meno valori che tempi)
+    for s in SERIES:
+        values = out[f"{s}_values"]
+        while values and values[-1] is None:
+            values.pop()
+    return out
+
+
+def exam_values(p: dict, interpretation: dict, version: str | None = None, metrics: dict | None = None) -> dict:
+    """Valori colonna di Exam da un payload esame già validato (model_dump); metrics se già calcolati in blocco."""
+    return {
+        "patient_id": p["patient_id"],
+        "exam_date": p["exam_date"],
+        "requester_doctor": p.get("requester_doctor"),
+        "acceptance_number": p.get("acceptance_number"),
+        "curve_mode": p["curve_mode"],
+        "pregnant_mode": 1 if p["pregnant_mode"] else 0,
+        "glucose_load_g": p["glucose_load_g"],
+        "glyc_unit": p["glyc_unit"],
+        "ins_unit": p["ins_unit"],
+        "methodology": p.get("methodology"),
+        "notes": p.get("notes"),
+        "interpretation_summary": interpretation.get("summary"),
+        "interpretation_details_json": json.dumps(interpretation),
+        "interpretation_version": version,
+        **interpretation_columns(interpretation),
+        **(metrics if metrics is not None else compute_metrics([p])[0]),
+    }
+
+
+def exam_points(p: dict) -> list[dict]:
+    return [
+        point
+        for s in SERIES
+        for point in build_points(s, p[f"{s}_times"], p[f"{s}_values"], p[f"{s}_refs"])
+    ]
+
+
+def insert_exam(db: Session, data: dict, interpretation: dict, version: str | None = None):
+    """
+    Inserisce esame e punti con INSERT ... RETURNING (id, created_at), senza oggetti ORM né rilettura.
+    data è il payload già validato e completato con i range; IntegrityError se il paziente non esiste.
+    """
+    E = models.Exam.__table__
+    values = exam_values(data, interpretation, version)
+    values["change_seq"] = sync.next_seqs(db, 1)
+    row = db.execute(insert(E).values(values).returning(E.c.id, E.c.created_at)).one()
+    points = [{**point, "exam_id": row.id} for point in exam_points(data)]
+    if points:
+        db.execute(insert(models.ExamPoint.__table__), points)
+    rollups.apply(db, rollups.changes(added=[rollups.exam_key(values)]))
+    return row
+
+
+# Nome predefinito di PostgreSQL per la FK exams.patient_id; SQLite non riporta il nome del vincolo
+PATIENT_FK = "exams_patient_id_fkey"
+
+
+def is_missing_patient(exc: IntegrityError) -> bool:
+    """True solo se l'errore è la FK exams.patient_id (paziente inesistente); le altre violazioni no."""
+    orig = exc.orig
+    code = getattr(orig, "pgcode", None) or getattr(orig, "sqlstate", None)  # psycopg / asyncpg
+    if code is not None:
+        return code == "23503" and PATIENT_FK in str(orig)
+    # SQLite: l'unica FK verificabile in insert_exam è patient_id (i punti si riferiscono all'esame appena inserito)
+    return "FOREIGN KEY constraint failed" in str(orig)
+
+
+def create_exam(db: Session, data: dict, interpretation: dict, version: str | None = None):
+    """(id, created_at) del nuovo esame, None se il paziente non esiste."""
+    try:
+        row = insert_exam(db, data, interpretation, version)
+        db.commit()
+    except IntegrityError as exc:
+        db.rollback()
+        if is_missing_patient(exc):
+            return None
+        raise
+    return row
+
+
+def created_exam_out(row, data: dict, interpretation: dict) -> dict:
+    """ExamOut di un esame appena inserito: dal payload e dall'interpretazione in memoria, senza rileggerlo."""
+    return {
+        **{key: data[key] for key in schemas.ExamPayload.model_fields},
+        "id": row.id,
+        "interpretation_summary": interpretation.get("summary"),
+        "interpretation": interpretation,
+        "created_at": row.created_at,
+    }
+
+
+def interpretation_out(row) -> dict:
+    """Interpretazione salvata, con i codici strutturati dalle colonne (presenti anche per gli esami storici)."""
+    stored = json.loads(row.interpretation_details_json or "{}")
+    return {
+        "overall_status": stored.get("overall_status"),
+        "summary": stored.get("summary"),
+        "glycemic_class": row.glycemic_class,
+        "insulin_pattern": row.insulin_pattern,
+        "gdm": None if row.gdm is None else bool(row.gdm),
+        "details": stored.get("details"),
+    }
+
+
+def exam_out(row) -> dict:
+    """Campi di ExamOut dalla riga: validati da FastAPI, o serializzati direttamente con FAST_JSON."""
+    series = points_to_series(row.points)
+    return {
+        "patient_id": row.patient_id,
+        "exam_date": row.exam_date,
+        "requester_doctor": row.requester_doctor,
+        "acceptance_number": row.acceptance_number,
+        "curve_mode": row.curve_mode,
+        "pregnant_mode": bool(row.pregnant_mode),
+        "glucose_load_g": row.glucose_load_g,
+        "glyc_unit": row.glyc_unit,
+        "ins_unit": row.ins_unit,
+        **{key: series[key] for key in ("glyc_times", "ins_times", "glyc_values", "ins_values", "glyc_refs", "ins_refs")},
+        "methodology": row.methodology,
+        "notes": row.notes,
+        "id": row.id,
+        "interpretation_summary": row.interpretation_summary,
+        "interpretation": interpretation_out(row),
+        "created_at": row.created_at,
+    }
+
+
+def list_exams_stmt(
+    patient_id: int | None = None,
+    limit: int = 100,
+    cursor: str | None = None,
+    status: str | None = None,
+    glycemic_class: str | None = None,
+    insulin_pattern: str | None = None,
+    gdm: bool | None = None,
+):
+    """Pagina di esami dal più recente, (exam_date desc, id desc); una riga in più per il cursore."""
+    E = models.Exam
+    stmt = select(E)
     if patient_id:
-        q = q.filter(models.Exam.patient_id == patient_id)
-    return q.order_by(models.Exam.exam_date.desc(), models.Exam.id.desc()).limit(limit).all()
+        stmt = stmt.where(E.patient_id == patient_id)
+    if status:
+        stmt = stmt.where(E.overall_status == status)
+    if glycemic_class:
+        stmt = stmt.where(E.glycemic_class == glycemic_class)
+    if insulin_pattern:
+        stmt = stmt.where(E.insulin_pattern == insulin_pattern)
+    if gdm is not None:
+        stmt = stmt.where(E.gdm == (1 if gdm else 0))
+    if cursor:
+        last_date, last_id = decode_cursor(cursor, (str, int))
+        try:
+            last_date = date.fromisoformat(last_date)
+        except ValueError as exc:
+            raise ValueError("Cursore non valido") from exc
+        stmt = stmt.where(seek_after([E.exam_date, E.id], [last_date, last_id], descending=True))
+    return stmt.order_by(E.exam_date.desc(), E.id.desc()).limit(limit + 1)
+
+
+def exams_page(rows, limit: int):
+    return page(list(rows), limit, lambda r: [r.exam_date.isoformat(), r.id])
+
+
+def list_exams(db: Session, patient_id: int | None = None, limit: int = 100, cursor: str | None = None, **filters):
+    rows = db.scalars(list_exams_stmt(patient_id, limit, cursor, **filters)).all()
+    return exams_page(rows, limit)
+
+
+def get_exam_stmt(exam_id: int):
+    # Un solo esame: punti in JOIN nella stessa query (scalars(...).unique())
+    return select(models.Exam).options(joinedload(models.Exam.points)).where(models.Exam.id == exam_id)
 
 
 def get_exam(db: Session, exam_id: int):
-    return db.query(models.Exam).filter(models.Exam.id == exam_id).first()
+    return db.scalars(get_exam_stmt(exam_id)).unique().first()
+
+
+def remove_exam(db: Session, exam_id: int) -> bool:
+    """
+    Cancella l'esame con un DELETE ... RETURNING (punti per ON DELETE CASCADE), aggiornando
+    riepiloghi e cancellazioni da sincronizzare; False se non esiste. Il commit è del chiamante.
+    """
+    E = models.Exam
+    row = db.execute(
+        delete(E).where(E.id == exam_id).returning(*rollups.key_columns(), E.uid)
+    ).mappings().first()
+    if row is None:
+        return False
+    rollups.apply(db, rollups.changes(removed=[rollups.exam_key(row)]))
+    sync.record_deletions(db, "exam", [row["uid"]])
+    return True
 
 
-def delete_exam(db: Session, exam: models.Exam):
-    db.delete(exam)
-    db.commit()
+def delete_exam(db: Session, exam_id: int) -> bool:
+    found = remove_exam(db, exam_id)
+    if found:
+        db.commit()
+    return found
@@ -0,0 +1,34 @@
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from .exams import exams_page, get_exam_stmt, insert_exam, is_missing_patient, list_exams_stmt, remove_exam
+
+
+async def create_exam(db: AsyncSession, data: dict, interpretation: dict, version: str | None = None):
+    """(id, created_at) del nuovo esame, None se il paziente non esiste."""
+    try:
+        row = await db.run_sync(insert_exam, data, interpretation, version)
+        await db.commit()
+    except IntegrityError as exc:
+        await db.rollback()
+        if is_missing_patient(exc):
+            return None
+        raise
+    return row
+
+
+async def list_exams(
+    db: AsyncSession, patient_id: int | None = None, limit: int = 100, cursor: str | None = None, **filters
+):
+    rows = (await db.scalars(list_exams_stmt(patient_id, limit, cursor, **filters))).all()
+    return exams_page(rows, limit)
+
+
+async def get_exam(db: AsyncSession, exam_id: int):
+    return (await db.scalars(get_exam_stmt(exam_id))).unique().first()
+
+
+async def delete_exam(db: AsyncSession, exam_id: int) -> bool:
+    found = await db.run_sync(remove_exam, exam_id)
+    if found:
+        await db.commit()
+    return found
@@ -1,6 +1,8 @@
+from sqlalchemy import delete, select
 from sqlalchemy.orm import Session
-from sqlalchemy import or_
 from .. import models, schemas
+from ..services import patient_search, rollups, sync
+from .cursors import decode_cursor, page, seek_after
 
 
 def create_patient(db: Session, payload: schemas.PatientCreate) -> models.Patient:
@@ -11,18 +13,23 @@ def create_patient(db: Session, payload: schemas.PatientCreate) -> models.Patien
     return p
 
 
-def list_patients(db: Session, search: str = "", limit: int = 50):
-    q = db.query(models.Patient)
-    if search:
-        like = f"%{search}%"
-        q = q.filter(
-            or_(
-                models.Patient.surname.ilike(like),
-                models.Patient.name.ilike(like),
-                models.Patient.fiscal_code.ilike(like),
-            )
-        )
-    return q.order_by(models.Patient.surname.asc(), models.Patient.name.asc()).limit(limit).all()
+def list_patients_stmt(search_clauses: list, limit: int = 50, cursor: str | None = None):
+    """Pagina di pazienti ordinata per (cognome, nome, id); una riga in più per il cursore."""
+    stmt = select(models.Patient).where(*search_clauses)
+    keys = [models.Patient.surname, models.Patient.name, models.Patient.id]
+    if cursor:
+        stmt = stmt.where(seek_after(keys, decode_cursor(cursor, (str, str, int))))
+    return stmt.order_by(*[k.asc() for k in keys]).limit(limit + 1)
+
+
+def patients_page(rows, limit: int):
+    return page(list(rows), limit, lambda r: [r.surname, r.name, r.id])
+
+
+def list_patients(db: Session, search: str = "", limit: int = 50, cursor: str | None = None):
+    clauses = patient_search.filter_clauses(db, search) if search else []
+    rows = db.scalars(list_patients_stmt(clauses, limit, cursor)).all()
+    return patients_page(rows, limit)
 
 
 def get_patient(db: Session, patient_id: int):
@@ -38,6 +45,32 @@ def update_patient(db: Session, patient: models.Patient, payload: schemas.Patien
     return patient
 
 
-def delete_patient(db: Session, patient: models.Patient):
-    db.delete(patient)
-    db.commit()
+def remove_patient(db: Session, patient_id: int) -> bool:
+    """
+    Cancella paziente ed esami con DELETE ... RETURNING (punti per ON DELETE CASCADE): numero fisso di
+    query qualunque sia il numero di esami. Aggiorna riepiloghi, indice di ricerca e cancellazioni da
+    sincronizzare; False se il paziente non esiste. Il commit è del chiamante.
+    """
+    E, P = models.Exam, models.Patient
+    exams = db.execute(
+        delete(E).where(E.patient_id == patient_id).returning(*rollups.key_columns(), E.uid)
+    ).mappings().all()
+    uid = db.execute(delete(P).where(P.id == patient_id).returning(P.uid)).first()
+    if uid is None:
+        return False
+    rollups.apply(db, rollups.changes(removed=[rollups.exam_key(r) for r in exams]))
+    patient_search.unindex(db.connection(), patient_id)
+    sync.record_deletions(db, "exam", [r["uid"] for r in exams])
+    sync.record_deletions(db, "patient", [uid[0]])
+    return True
+
+
+def delete_patient(db: Session, patient_id: int) -> bool:
+    found = remove_patient(db, patient_id)
+    if found:
+        db.commit()
+    return found
+
+
+def search_patients(db: Session, query: str, limit: int = 20):
+    return patient_search.search_patients(db, query, limit=limit)
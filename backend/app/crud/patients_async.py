@@ -0,0 +1,40 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+from .. import models, schemas
+from ..services import patient_search
+from .patients import list_patients_stmt, patients_page, remove_patient
+
+
+async def create_patient(db: AsyncSession, payload: schemas.PatientCreate) -> models.Patient:
+    p = models.Patient(**payload.model_dump())
+    db.add(p)
+    await db.commit()
+    return p
+
+
+async def list_patients(db: AsyncSession, search: str = "", limit: int = 50, cursor: str | None = None):
+    clauses = await db.run_sync(patient_search.filter_clauses, search) if search else []
+    rows = (await db.scalars(list_patients_stmt(clauses, limit, cursor))).all()
+    return patients_page(rows, limit)
+
+
+async def get_patient(db: AsyncSession, patient_id: int):
+    return await db.get(models.Patient, patient_id)
+
+
+async def update_patient(db: AsyncSession, patient: models.Patient, payload: schemas.PatientUpdate):
+    data = payload.model_dump(exclude_unset=True)
+    for k, v in data.items():
+        setattr(patient, k, v)
+    await db.commit()
+    return patient
+
+
+async def delete_patient(db: AsyncSession, patient_id: int) -> bool:
+    found = await db.run_sync(remove_patient, patient_id)
+    if found:
+        await db.commit()
+    return found
+
+
+async def search_patients(db: AsyncSession, query: str, limit: int = 20):
+    return await db.run_sync(patient_search.search_patients, query, limit)
@@ -0,0 +1,204 @@
+"""Protocollo di sincronizzazione con i client offline (numerazione e tombstone: services/sync.py)."""
+from __future__ import annotations
+
+from typing import List
+
+from pydantic import BaseModel, ValidationError
+from sqlalchemy import select
+from sqlalchemy.orm import Session, selectinload
+
+from .. import models, schemas
+from ..services import rollups
+from ..services.batch_interpretation import interpret_exams_batch
+from ..services.curve_metrics import compute_metrics
+from ..services.exam_import import error_text
+from ..services.reference_profiles import apply_default_refs, get_active_snapshot, record_version
+from .exams import exam_out, exam_points, exam_values, remove_exam
+from .patients import remove_patient
+
+
+PATIENT_FIELDS = tuple(schemas.PatientBase.model_fields)
+
+
+def _patient_out(row: models.Patient) -> dict:
+    return {
+        **{k: getattr(row, k) for k in PATIENT_FIELDS},
+        "id": row.id,
+        "created_at": row.created_at,
+        "updated_at": row.updated_at,
+        "uid": row.uid,
+        "change_seq": row.change_seq,
+    }
+
+
+def _exam_out(row: models.Exam, patient_uid: str) -> dict:
+    return {**exam_out(row), "uid": row.uid, "patient_uid": patient_uid, "change_seq": row.change_seq}
+
+
+def changes(db: Session, since: int, limit: int) -> dict:
+    """Modifiche con numero > since, al massimo limit (pazienti, esami e cancellazioni insieme)."""
+    P, E, T = models.Patient, models.Exam, models.SyncTombstone
+    patients = db.scalars(select(P).where(P.change_seq > since).order_by(P.change_seq).limit(limit + 1)).all()
+    exams = db.execute(
+        select(E, P.uid)
+        .join(P, E.patient_id == P.id)
+        .options(selectinload(E.points))
+        .where(E.change_seq > since)
+        .order_by(E.change_seq)
+        .limit(limit + 1)
+    ).all()
+    deleted = db.scalars(select(T).where(T.seq > since).order_by(T.seq).limit(limit + 1)).all()
+
+    seqs = sorted([p.change_seq for p in patients] + [e.change_seq for e, _ in exams] + [t.seq for t in deleted])
+    has_more = len(seqs) > limit
+    until = seqs[min(limit, len(seqs)) - 1] if seqs else since
+    return {
+        "since": since,
+        "until": until,
+        "has_more": has_more,
+        "patients": [_patient_out(p) for p in patients if p.change_seq <= until],
+        "exams": [_exam_out(e, uid) for e, uid in exams if e.change_seq <= until],
+        "deleted": [{"entity": t.entity, "uid": t.uid, "seq": t.seq} for t in deleted if t.seq <= until],
+    }
+
+
+def _conflict(row, base_seq: int | None, tombstoned: bool) -> str | None:
+    if row is None:
+        return "deleted" if tombstoned else None
+    if base_seq != row.change_seq:
+        return "changed"
+    return None
+
+
+def _tombstoned(db: Session, entity: str, uids: List[str]) -> set:
+    T = models.SyncTombstone
+    return set(db.scalars(select(T.uid).where(T.entity == entity, T.uid.in_(uids))))
+
+
+def _validated(model: type[BaseModel], entity: str, raw_rows: List[dict], conflicts: List[dict]) -> list:
+    """
+    Righe valide del push; le altre diventano conflitti "invalid" con il motivo. Un uid
+    ripetuto vale una volta sola (la prima riga valida): le ripetizioni sono "invalid".
+    """
+    out = []
+    seen = set()
+    for raw in raw_rows:
+        uid = raw.get("uid")
+        try:
+            item = model.model_validate(raw)
+        except ValidationError as exc:
+            error = error_text(exc)
+        else:
+            if item.uid not in seen:
+                seen.add(item.uid)
+                out.append(item)
+                continue
+            error = "uid: ripetuto nel push, applicata solo la prima riga"
+        conflicts.append({"entity": entity, "uid": uid if isinstance(uid, str) else "", "reason": "invalid", "error": error})
+    return out
+
+
+def push(db: Session, payload: schemas.SyncPushIn) -> dict:
+    """Applica in un'unica transazione le modifiche senza conflitto; restituisce esiti e conflitti."""
+    P, E = models.Patient, models.Exam
+    applied: List[dict] = []
+    conflicts: List[dict] = []
+
+    def conflict(entity: str, uid: str, reason: str, row=None) -> None:
+        conflicts.append({"entity": entity, "uid": uid, "reason": reason, "server_seq": row.change_seq if row else None})
+
+    # Pazienti prima degli esami: un esame può riferirsi a un paziente dello stesso push
+    items = _validated(schemas.SyncPatientIn, "patient", payload.patients, conflicts)
+    uids = [p.uid for p in items]
+    rows = {p.uid: p for p in db.scalars(select(P).where(P.uid.in_(uids)))}
+    gone = _tombstoned(db, "patient", uids)
+    patients = []
+    for item in items:
+        row = rows.get(item.uid)
+        reason = _conflict(row, item.base_seq, item.uid in gone)
+        if reason:
+            conflict("patient", item.uid, reason, row)
+            continue
+        data = item.model_dump(include=set(PATIENT_FIELDS))
+        if row is None:
+            row = P(uid=item.uid, **data)
+            db.add(row)
+            patients.append(("created", row))
+        else:
+            for k, v in data.items():
+                setattr(row, k, v)
+            patients.append(("updated", row))
+    db.flush()
+    applied += [{"entity": "patient", "uid": r.uid, "action": a, "id": r.id, "change_seq": r.change_seq} for a, r in patients]
+
+    exams = _validated(schemas.SyncExamIn, "exam", payload.exams, conflicts)
+    if exams:
+        _push_exams(db, exams, applied, conflict)
+
+    for item in payload.deleted:
+        model = P if item.entity == "patient" else E
+        row = db.execute(select(model.id, model.change_seq).where(model.uid == item.uid)).first()
+        if row is not None and item.base_seq != row.change_seq:
+            conflict(item.entity, item.uid, "changed", row)
+            continue
+        # Già cancellato (anche da un altro client): l'esito per il client è lo stesso
+        if row is not None:
+            (remove_patient if model is P else remove_exam)(db, row.id)
+        applied.append({"entity": item.entity, "uid": item.uid, "action": "deleted", "id": row.id if row else None})
+
+    db.commit()
+    return {"applied": applied, "conflicts": conflicts}
+
+
+def _push_exams(db: Session, items: List[schemas.SyncExamIn], applied: List[dict], conflict) -> None:
+    P, E = models.Patient, models.Exam
+    uids = [e.uid for e in items]
+    rows = {
+        e.uid: e for e in db.scalars(select(E).options(selectinload(E.points)).where(E.uid.in_(uids)))
+    }
+    gone = _tombstoned(db, "exam", uids)
+    patient_ids = dict(db.execute(select(P.uid, P.id).where(P.uid.in_({e.patient_uid for e in items}))).all())
+    snap = get_active_snapshot(db)
+
+    accepted, datas = [], []
+    for item in items:
+        row = rows.get(item.uid)
+        reason = _conflict(row, item.base_seq, item.uid in gone)
+        if not reason and item.patient_uid not in patient_ids:
+            reason = "patient_missing"
+        if reason:
+            conflict("exam", item.uid, reason, row)
+            continue
+        data = item.model_dump(exclude={"uid", "base_seq", "patient_uid"})
+        data["patient_id"] = patient_ids[item.patient_uid]
+        accepted.append((item, row))
+        datas.append(apply_default_refs(data, snap.payload))
+    if not accepted:
+        return
+
+    record_version(db, snap)
+    delta = rollups.changes()
+    for (item, row), data, interp, metrics in zip(
+        accepted, datas, interpret_exams_batch(datas, snap.rules), compute_metrics(datas)
+    ):
+        values = exam_values(data, interp, snap.version, metrics)
+        points = [models.ExamPoint(**p) for p in exam_points(data)]
+        if row is None:
+            row = E(uid=item.uid, **values)
+            row.points = points
+            db.add(row)
+            action = "created"
+        else:
+            delta.subtract([rollups.exam_key(row)])
+            for k, v in values.items():
+                setattr(row, k, v)
+            row.points = points  # stessi (serie, tempo): SQLAlchemy li trasforma in UPDATE
+            action = "updated"
+        delta.update([rollups.exam_key(row)])
+        applied.append({"entity": "exam", "uid": item.uid, "action": action, "row": row})
+    rollups.apply(db, delta)
+    db.flush()
+    for a in applied:
+        row = a.pop("row", None)
+        if row is not None:
+            a.update(id=row.id, change_seq=row.change_seq)
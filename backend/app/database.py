@@ -1,4 +1,6 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import DeclarativeBase, sessionmaker
 from .config import settings
 
@@ -7,9 +9,94 @@ class Base(DeclarativeBase):
     pass
 
 
-engine = create_engine(settings.database_url, echo=False, future=True)
+# Driver asincrono per ciascun backend supportato
+ASYNC_DRIVERS = {"sqlite": "aiosqlite", "postgresql": "asyncpg"}
+
+
+def async_database_url(url: str) -> str:
+    """Stesso database di `url`, con il driver asyncio del backend (sqlite+aiosqlite, postgresql+asyncpg)."""
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    driver = ASYNC_DRIVERS.get(backend)
+    if driver is None:
+        return url
+    return parsed.set(drivername=f"{backend}+{driver}").render_as_string(hide_password=False)
+
+
+def _is_memory_sqlite(url: str) -> bool:
+    parsed = make_url(url)
+    return parsed.get_backend_name() == "sqlite" and parsed.database in (None, "", ":memory:")
+
+
+def _engine_kwargs(url: str) -> dict:
+    kwargs = {"echo": False, "pool_pre_ping": settings.db_pool_pre_ping}
+    if not _is_memory_sqlite(url):
+        kwargs.update(
+            pool_size=settings.db_pool_size,
+            max_overflow=settings.db_max_overflow,
+            pool_recycle=settings.db_pool_recycle,
+        )
+    if make_url(url).get_backend_name() == "sqlite":
+        # Timeout lato driver allineato a busy_timeout (secondi)
+        kwargs["connect_args"] = {"timeout": settings.sqlite_busy_timeout_ms / 1000}
+    return kwargs
+
+
+def _sqlite_pragmas(sync_engine: Engine, read_only: bool = False) -> None:
+    """PRAGMA di concorrenza/prestazioni su ogni nuova connessione SQLite."""
+    if sync_engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(sync_engine, "connect")
+    def _on_connect(dbapi_conn, connection_record):
+        cur = dbapi_conn.cursor()
+        try:
+            if not _is_memory_sqlite(str(sync_engine.url)):
+                cur.execute(f"PRAGMA journal_mode={settings.sqlite_journal_mode}")
+            cur.execute(f"PRAGMA synchronous={settings.sqlite_synchronous}")
+            cur.execute(f"PRAGMA busy_timeout={int(settings.sqlite_busy_timeout_ms)}")
+            # ON DELETE CASCADE di exams/exam_points e controllo del paziente all'inserimento esame
+            cur.execute("PRAGMA foreign_keys=ON")
+            cur.execute(f"PRAGMA mmap_size={int(settings.sqlite_mmap_size)}")
+            cur.execute(f"PRAGMA cache_size=-{int(settings.sqlite_cache_size_kib)}")
+            if read_only:
+                cur.execute("PRAGMA query_only=ON")
+        finally:
+            cur.close()
+
+
+def _make_engine(url: str, read_only: bool = False) -> Engine:
+    eng = create_engine(url, future=True, **_engine_kwargs(url))
+    _sqlite_pragmas(eng, read_only)
+    return eng
+
+
+def _make_async_engine(url: str, read_only: bool = False):
+    eng = create_async_engine(url, **_engine_kwargs(url))
+    _sqlite_pragmas(eng.sync_engine, read_only)
+    return eng
+
+
+_async_url = settings.async_database_url or async_database_url(settings.database_url)
+_read_url = settings.read_database_url or settings.database_url
+
+engine = _make_engine(settings.database_url)
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
 
+# Pool separato per le letture: le GET non contendono le connessioni delle scritture
+read_engine = _make_engine(_read_url, read_only=True)
+ReadSessionLocal = sessionmaker(bind=read_engine, autoflush=False, autocommit=False, future=True)
+
+async_engine = _make_async_engine(_async_url)
+async_read_engine = _make_async_engine(
+    async_database_url(settings.read_database_url) if settings.read_database_url else _async_url, read_only=True
+)
+# expire_on_commit=False: dopo il commit gli oggetti restano leggibili senza lazy-load (non ammesso in asyncio)
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False, class_=AsyncSession)
+AsyncReadSessionLocal = async_sessionmaker(
+    bind=async_read_engine, autoflush=False, expire_on_commit=False, class_=AsyncSession
+)
+
 
 def get_db():
     db = SessionLocal()
@@ -17,3 +104,21 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+def get_read_db():
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+async def get_async_read_db():
+    async with AsyncReadSessionLocal() as db:
+        yield db
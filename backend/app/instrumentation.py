@@ -0,0 +1,368 @@
+"""
+Strumentazione delle richieste (attiva con METRICS_ENABLED, default true).
+
+- InstrumentationMiddleware: durata ed esito di ogni richiesta per route (il template del
+  path, es. /api/exams/{exam_id}), header Server-Timing con tempo totale, tempo DB e
+  sezioni misurate; le richieste oltre SLOW_REQUEST_MS finiscono nel log con query e
+  tempo DB.
+- Hook SQLAlchemy su tutti gli engine (sincroni e asincroni): numero di query e tempo
+  DB per richiesta; le query fuori da una richiesta (job in background, migrazioni)
+  vanno sotto route="background".
+- Sezioni: @timed attorno a interpret_exam / interpret_exams_batch, decodifica del JSON
+  del body (InstrumentedRoute) e rendering della risposta JSON (responses.py).
+- render_metrics(): tutto nel formato testuale di Prometheus (GET /api/metrics).
+- sample_stacks(): profiler a campionamento in puro Python, stack di tutti i thread
+  nel formato "folded" di flamegraph.pl / speedscope (GET /api/profile, solo con
+  PROFILING_ENABLED=true).
+
+Le metriche sono per processo: con più worker ognuno espone le proprie.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextvars import ContextVar
+from functools import wraps
+from pathlib import Path
+from typing import Any, Callable, Dict, Tuple
+
+from fastapi import Request, Response
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .config import settings
+
+logger = logging.getLogger("curvelab")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+BACKGROUND = "background"
+UNMATCHED = "<unmatched>"
+
+# Chiamate in attesa (lock, coda, select): escluse dal profilo salvo include_idle
+_IDLE_FILES = ("threading.py", "selectors.py", "queue.py")
+
+
+class _Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Tuple[float, ...]) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class RequestStats:
+    """Contatori della richiesta in corso (ContextVar: visibile anche nel threadpool delle route sincrone)."""
+
+    __slots__ = ("queries", "db_seconds", "sections")
+
+    def __init__(self) -> None:
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.sections: Dict[str, list] = {}  # nome -> [chiamate, secondi]
+
+    def server_timing(self, elapsed: float) -> str:
+        parts = [f"app;dur={elapsed * 1000:.2f}", f'db;dur={self.db_seconds * 1000:.2f};desc="{self.queries} query"']
+        parts.extend(f"{name};dur={seconds * 1000:.2f}" for name, (_, seconds) in self.sections.items())
+        return ", ".join(parts)
+
+
+_current: ContextVar[RequestStats | None] = ContextVar("curvelab_request_stats", default=None)
+_lock = threading.Lock()
+_started = time.time()
+_in_progress = 0
+_requests: Counter = Counter()  # (method, route, status) -> richieste
+_durations: Dict[Tuple[str, str], _Histogram] = {}  # (method, route)
+_query_counts: Dict[str, _Histogram] = {}  # route -> query per richiesta
+_queries: Counter = Counter()  # route -> query
+_db_seconds: Counter = Counter()  # route -> secondi
+_section_calls: Counter = Counter()
+_section_seconds: Counter = Counter()
+
+
+def record_section(name: str, seconds: float) -> None:
+    stats = _current.get()
+    if stats is not None:
+        # Riportata nei totali a fine richiesta, senza lock per chiamata
+        section = stats.sections.get(name)
+        if section is None:
+            stats.sections[name] = [1, seconds]
+        else:
+            section[0] += 1
+            section[1] += seconds
+        return
+    with _lock:
+        _section_calls[name] += 1
+        _section_seconds[name] += seconds
+
+
+def timed(name: str) -> Callable:
+    """Decoratore: tempo e chiamate di `name` nelle metriche; senza metriche restituisce la funzione com'è."""
+
+    def decorate(fn: Callable) -> Callable:
+        if not settings.metrics_enabled:
+            return fn
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                record_section(name, time.perf_counter() - t0)
+
+        return wrapper
+
+    return decorate
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    # Un solo inizio per connessione: gli statement di una connessione non si sovrappongono
+    conn.info["curvelab_query_start"] = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    started = conn.info.pop("curvelab_query_start", None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    stats = _current.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_seconds += elapsed
+        return
+    with _lock:
+        _queries[BACKGROUND] += 1
+        _db_seconds[BACKGROUND] += elapsed
+
+
+def _handle_error(exception_context) -> None:
+    # Statement fallito: niente after_cursor_execute, l'inizio non resta sulla connessione
+    conn = exception_context.connection
+    if conn is not None:
+        conn.info.pop("curvelab_query_start", None)
+
+
+def install_query_hooks() -> None:
+    """Hook su tutti gli Engine (anche il sync_engine di quelli asincroni); idempotente."""
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(Engine, "handle_error", _handle_error)
+
+
+def _record_request(method: str, route: str, status: int, elapsed: float, stats: RequestStats) -> None:
+    with _lock:
+        _requests[(method, route, status)] += 1
+        hist = _durations.get((method, route))
+        if hist is None:
+            hist = _durations[(method, route)] = _Histogram(LATENCY_BUCKETS)
+        hist.observe(elapsed)
+        counts = _query_counts.get(route)
+        if counts is None:
+            counts = _query_counts[route] = _Histogram(QUERY_BUCKETS)
+        counts.observe(stats.queries)
+        _queries[route] += stats.queries
+        _db_seconds[route] += stats.db_seconds
+        for name, (calls, seconds) in stats.sections.items():
+            _section_calls[name] += calls
+            _section_seconds[name] += seconds
+
+
+class InstrumentationMiddleware:
+    """Middleware ASGI (il più esterno): tempi, query e Server-Timing per richiesta."""
+
+    def __init__(self, app: ASGIApp, slow_request_ms: int = 0) -> None:
+        self.app = app
+        self.slow_request_ms = slow_request_ms
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        global _in_progress
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _current.set(stats)
+        status = 500
+        t0 = time.perf_counter()
+
+        async def send_timed(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                MutableHeaders(scope=message).append("Server-Timing", stats.server_timing(time.perf_counter() - t0))
+            await send(message)
+
+        with _lock:
+            _in_progress += 1
+        try:
+            await self.app(scope, receive, send_timed)
+        finally:
+            elapsed = time.perf_counter() - t0
+            _current.reset(token)
+            # Route risolta dal router di FastAPI: template del path, non il path con gli id
+            route = getattr(scope.get("route"), "path", None) or UNMATCHED
+            _record_request(scope["method"], route, status, elapsed, stats)
+            with _lock:
+                _in_progress -= 1
+            if self.slow_request_ms and elapsed * 1000 >= self.slow_request_ms:
+                logger.warning(
+                    "Richiesta lenta: %s %s -> %s in %.0f ms (%d query, %.0f ms DB; %s)",
+                    scope["method"],
+                    scope["path"],
+                    status,
+                    elapsed * 1000,
+                    stats.queries,
+                    stats.db_seconds * 1000,
+                    ", ".join(f"{k} {v[1] * 1000:.1f} ms" for k, v in stats.sections.items()) or "nessuna sezione",
+                )
+
+
+class _TimedRequest(Request):
+    async def json(self) -> Any:
+        if not hasattr(self, "_json"):
+            body = await self.body()
+            t0 = time.perf_counter()
+            self._json = json.loads(body)
+            record_section("json_decode", time.perf_counter() - t0)
+        return self._json
+
+
+class InstrumentedRoute(APIRoute):
+    """Route che misura la decodifica del JSON del body (route_class dei router dell'API)."""
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+        if not settings.metrics_enabled:
+            return handler
+
+        async def timed_handler(request: Request) -> Response:
+            return await handler(_TimedRequest(request.scope, request.receive))
+
+        return timed_handler
+
+
+def _labels(**labels: Any) -> str:
+    def escape(value: Any) -> str:
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _histogram_lines(name: str, hist: _Histogram, **labels: Any) -> list[str]:
+    lines = []
+    cumulative = 0
+    for bound, count in zip((*hist.buckets, "+Inf"), hist.counts):
+        cumulative += count
+        lines.append(f"{name}_bucket{_labels(**labels, le=bound)} {cumulative}")
+    lines.append(f"{name}_sum{_labels(**labels)} {hist.sum}")
+    lines.append(f"{name}_count{_labels(**labels)} {hist.count}")
+    return lines
+
+
+def render_metrics() -> str:
+    """Metriche del processo nel formato testuale di Prometheus (0.0.4)."""
+    with _lock:
+        lines = [
+            "# HELP curvelab_process_start_time_seconds Avvio del processo (epoch).",
+            "# TYPE curvelab_process_start_time_seconds gauge",
+            f"curvelab_process_start_time_seconds {_started}",
+            "# HELP curvelab_http_requests_in_progress Richieste in corso.",
+            "# TYPE curvelab_http_requests_in_progress gauge",
+            f"curvelab_http_requests_in_progress {_in_progress}",
+            "# HELP curvelab_http_requests_total Richieste completate.",
+            "# TYPE curvelab_http_requests_total counter",
+        ]
+        for (method, route, status), n in sorted(_requests.items()):
+            lines.append(f"curvelab_http_requests_total{_labels(method=method, route=route, status=status)} {n}")
+        lines += [
+            "# HELP curvelab_http_request_duration_seconds Durata delle richieste.",
+            "# TYPE curvelab_http_request_duration_seconds histogram",
+        ]
+        for (method, route), hist in sorted(_durations.items()):
+            lines += _histogram_lines("curvelab_http_request_duration_seconds", hist, method=method, route=route)
+        lines += [
+            "# HELP curvelab_db_queries_per_request Query SQL per richiesta.",
+            "# TYPE curvelab_db_queries_per_request histogram",
+        ]
+        for route, hist in sorted(_query_counts.items()):
+            lines += _histogram_lines("curvelab_db_queries_per_request", hist, route=route)
+        lines += [
+            "# HELP curvelab_db_queries_total Query SQL eseguite.",
+            "# TYPE curvelab_db_queries_total counter",
+        ]
+        lines += [f"curvelab_db_queries_total{_labels(route=route)} {n}" for route, n in sorted(_queries.items())]
+        lines += [
+            "# HELP curvelab_db_query_seconds_total Tempo speso nelle query SQL.",
+            "# TYPE curvelab_db_query_seconds_total counter",
+        ]
+        lines += [f"curvelab_db_query_seconds_total{_labels(route=route)} {s}" for route, s in sorted(_db_seconds.items())]
+        lines += [
+            "# HELP curvelab_section_calls_total Esecuzioni delle sezioni misurate.",
+            "# TYPE curvelab_section_calls_total counter",
+        ]
+        lines += [f"curvelab_section_calls_total{_labels(section=k)} {n}" for k, n in sorted(_section_calls.items())]
+        lines += [
+            "# HELP curvelab_section_seconds_total Tempo nelle sezioni misurate (interpretazione, JSON).",
+            "# TYPE curvelab_section_seconds_total counter",
+        ]
+        lines += [f"curvelab_section_seconds_total{_labels(section=k)} {s}" for k, s in sorted(_section_seconds.items())]
+    return "\n".join(lines) + "\n"
+
+
+_profile_lock = threading.Lock()
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({Path(code.co_filename).name})"
+
+
+def sample_stacks(seconds: float, interval: float, include_idle: bool = False) -> Counter:
+    """
+    Campiona gli stack di tutti i thread del processo ogni `interval` secondi per `seconds`:
+    stack "thread;funzione (file);..." -> campioni. RuntimeError se è già in corso un profilo.
+    """
+    if not _profile_lock.acquire(blocking=False):
+        raise RuntimeError("Profilo già in corso")
+    try:
+        me = threading.get_ident()
+        samples: Counter = Counter()
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                if not include_idle and Path(frame.f_code.co_filename).name in _IDLE_FILES:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_name(frame))
+                    frame = frame.f_back
+                stack.append(names.get(ident, f"thread-{ident}"))
+                samples[";".join(reversed(stack))] += 1
+            time.sleep(interval)
+        return samples
+    finally:
+        _profile_lock.release()
+
+
+def folded(samples: Counter) -> str:
+    return "".join(f"{stack} {n}\n" for stack, n in samples.most_common())
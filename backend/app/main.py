@@ -1,3 +1,4 @@
+from contextlib import asynccontextmanager
 from pathlib import Path
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
@@ -5,14 +6,34 @@ from fastapi.responses import FileResponse
 from fastapi.staticfiles import StaticFiles
 
 from .config import settings
-from .database import Base, engine
-from .routers import patients, exams, presets, report_settings
+from .instrumentation import InstrumentationMiddleware, install_query_hooks
+from .migrations import run_migrations
+from .responses import CompressionMiddleware, default_response_class
+from .routers import analytics, monitoring, patients, exams, presets, reinterpretation, report_settings, reports, sync
+from .services.reinterpretation import resume_on_startup
+from .services.report_jobs import cleanup_on_startup, shutdown_pool
 
 
-# Auto-create tables at startup (for MVP)
-Base.metadata.create_all(bind=engine)
+# Schema + migrazioni dati all'avvio; con python -m app.serve girano una volta prima dei worker
+if settings.run_migrations_on_startup:
+    run_migrations()
 
-app = FastAPI(title=settings.app_name)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Job di stampa dei processi terminati e file scaduti
+    cleanup_on_startup()
+    if settings.reinterpret_on_startup:
+        # Riprende i job interrotti / riallinea gli esami al profilo attivo
+        resume_on_startup()
+    yield
+    shutdown_pool()
+
+
+app = FastAPI(title=settings.app_name, lifespan=lifespan, default_response_class=default_response_class())
+
+if settings.compress_responses:
+    app.add_middleware(CompressionMiddleware, minimum_size=settings.compress_min_size)
 
 app.add_middleware(
     CORSMiddleware,
@@ -20,12 +41,23 @@ app.add_middleware(
     allow_credentials=False,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-Cursor", "Server-Timing"],
 )
 
+if settings.metrics_enabled:
+    # Ultimo aggiunto = più esterno: misura anche CORS e compressione
+    install_query_hooks()
+    app.add_middleware(InstrumentationMiddleware, slow_request_ms=settings.slow_request_ms)
+
 app.include_router(patients.router, prefix="/api")
 app.include_router(exams.router, prefix="/api")
 app.include_router(presets.router, prefix="/api")
 app.include_router(report_settings.router, prefix="/api")
+app.include_router(reinterpretation.router, prefix="/api")
+app.include_router(reports.router, prefix="/api")
+app.include_router(analytics.router, prefix="/api")
+app.include_router(sync.router, prefix="/api")
+app.include_router(monitoring.router, prefix="/api")
 
 
 @app.get("/api/health")
@@ -0,0 +1,174 @@
+"""
+Migrazioni schema leggere e idempotenti (MVP, senza Alembic).
+
+- create_all per le tabelle nuove
+- ALTER TABLE ADD COLUMN / CREATE INDEX per colonne e indici aggiunti ai modelli
+- migrazioni dati nominate, registrate in schema_migrations ed eseguite una sola volta
+
+Uso manuale: python -m app.migrations
+"""
+from __future__ import annotations
+
+import json
+import logging
+from datetime import datetime
+from typing import Callable, List, Tuple
+
+from sqlalchemy import bindparam, exists, insert, inspect, select, text, update
+from sqlalchemy.engine import Connection, Engine
+
+from . import models
+from .crud.exams import SERIES, build_points, discarded_samples
+from .database import Base, engine
+from .services import (
+    analytics,
+    cache_versions,
+    patient_search,
+    reference_profiles,
+    reinterpretation,
+    report_settings,
+    rollups,
+    sync,
+)
+from .services.interpretation import interpretation_columns
+
+
+CHUNK_SIZE = 1000
+
+logger = logging.getLogger("curvelab.migrations")
+
+
+def _load_json(raw, fallback):
+    try:
+        v = json.loads(raw or "null")
+    except Exception:
+        return fallback
+    return v if isinstance(v, type(fallback)) else fallback
+
+
+def _sync_columns(conn: Connection) -> None:
+    """Aggiunge colonne e indici presenti nei modelli ma non ancora nel DB."""
+    insp = inspect(conn)
+    tables = set(insp.get_table_names())
+    for table in Base.metadata.sorted_tables:
+        if table.name not in tables:
+            continue
+        present = {c["name"] for c in insp.get_columns(table.name)}
+        for col in table.columns:
+            if col.name in present:
+                continue
+            col_type = col.type.compile(dialect=conn.dialect)
+            conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {col.name} {col_type}"))
+        indexes = {ix["name"] for ix in insp.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in indexes:
+                index.create(conn)
+
+
+def _backfill_exam_points(conn: Connection) -> None:
+    """Copia i punti curva dalle colonne *_json di exams nella tabella exam_points."""
+    exams = models.Exam.__table__
+    points = models.ExamPoint.__table__
+    legacy_cols = [exams.c[f"{s}_{kind}_json"] for s in SERIES for kind in ("times", "values", "refs")]
+
+    lossy: List[int] = []
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            select(exams.c.id, *legacy_cols)
+            .where(exams.c.id > last_id)
+            .where(~exists().where(points.c.exam_id == exams.c.id))
+            .order_by(exams.c.id)
+            .limit(CHUNK_SIZE)
+        ).mappings().all()
+        if not rows:
+            break
+
+        batch = []
+        for r in rows:
+            lost = 0
+            for s in SERIES:
+                times = _load_json(r[f"{s}_times_json"], [])
+                values = _load_json(r[f"{s}_values_json"], [])
+                lost += discarded_samples(times, values)
+                for point in build_points(s, times, values, _load_json(r[f"{s}_refs_json"], {})):
+                    point["exam_id"] = r["id"]
+                    batch.append(point)
+            if lost:
+                lossy.append(r["id"])
+        if batch:
+            conn.execute(insert(points), batch)
+        last_id = rows[-1]["id"]
+
+    if lossy:
+        # Le colonne *_json restano invariate: i prelievi scartati sono ancora recuperabili da lì
+        logger.warning(
+            "exam_points: %d esami con tempi ripetuti o valori senza tempo (tenuto il primo prelievo): %s",
+            len(lossy),
+            ", ".join(map(str, lossy)),
+        )
+
+
+def _backfill_interpretation_columns(conn: Connection) -> None:
+    """Esito e codici strutturati dal JSON di interpretazione degli esami già presenti."""
+    exams = models.Exam.__table__
+    columns = ("overall_status", "glycemic_class", "insulin_pattern", "gdm")
+    stmt = update(exams).where(exams.c.id == bindparam("_id")).values({c: bindparam(f"_{c}") for c in columns})
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            select(exams.c.id, exams.c.interpretation_details_json)
+            .where(exams.c.id > last_id)
+            .order_by(exams.c.id)
+            .limit(CHUNK_SIZE)
+        ).all()
+        if not rows:
+            break
+        params = [
+            {"_id": r.id, **{f"_{k}": v for k, v in interpretation_columns(_load_json(r[1], {})).items()}}
+            for r in rows
+        ]
+        conn.execute(stmt, params)
+        last_id = rows[-1].id
+
+
+MIGRATIONS: List[Tuple[str, Callable[[Connection], None]]] = [
+    ("0001_exam_points_backfill", _backfill_exam_points),
+    ("0002_patient_search_index", patient_search.install),
+    ("0003_report_logo_binary", report_settings.convert_legacy_logos),
+    ("0004_exam_curve_metrics", analytics.backfill_metrics),
+    ("0005_exam_rollups", rollups.rebuild),
+    ("0006_exam_interpretation_columns", _backfill_interpretation_columns),
+    # I riepiloghi leggono ora l'esito dalla colonna: ricostruiti dopo il backfill
+    ("0007_exam_rollups_status_column", rollups.rebuild),
+    ("0008_sync_sequence", sync.install),
+    ("0009_cache_versions", cache_versions.install),
+    # Righe predefinite create qui: le cache le leggono anche dal pool in sola lettura
+    ("0010_default_reference_profile", reference_profiles.install),
+    ("0011_default_report_settings", report_settings.install),
+    ("0012_legacy_interpretation_version", reinterpretation.stamp_legacy),
+    ("0013_reinterpretation_single_active_job", reinterpretation.install),
+]
+
+
+def run_migrations(bind: Engine = engine) -> List[str]:
+    """Porta lo schema allo stato dei modelli; restituisce le migrazioni dati applicate."""
+    Base.metadata.create_all(bind=bind)
+    applied_now: List[str] = []
+    with bind.begin() as conn:
+        _sync_columns(conn)
+        applied = set(conn.execute(select(models.SchemaMigration.name)).scalars())
+        for name, fn in MIGRATIONS:
+            if name in applied:
+                continue
+            fn(conn)
+            conn.execute(
+                insert(models.SchemaMigration.__table__).values(name=name, applied_at=datetime.utcnow())
+            )
+            applied_now.append(name)
+    return applied_now
+
+
+if __name__ == "__main__":
+    done = run_migrations()
+    print("Migrazioni applicate:", ", ".join(done) if done else "nessuna")
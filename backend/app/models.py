@@ -1,12 +1,21 @@
 from datetime import datetime, date
-from sqlalchemy import String, Integer, Date, DateTime, ForeignKey, Text
+from uuid import uuid4
+from sqlalchemy import String, Integer, Float, Date, DateTime, ForeignKey, Text, Index, LargeBinary
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from .database import Base
 
 
+def _new_uid() -> str:
+    return str(uuid4())
+
+
 class Patient(Base):
     __tablename__ = "patients"
+    __table_args__ = (
+        Index("ix_patients_surname_name_id", "surname", "name", "id"),
+        Index("ix_patients_surname_key_name_id", "surname_key", "name", "id"),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
     surname: Mapped[str] = mapped_column(String(100), index=True)
@@ -18,14 +27,29 @@ class Patient(Base):
     email: Mapped[str | None] = mapped_column(String(120), nullable=True)
     notes: Mapped[str | None] = mapped_column(Text, nullable=True)
 
+    # Chiavi di ricerca normalizzate (services/patient_search.py)
+    surname_key: Mapped[str | None] = mapped_column(String(100), nullable=True)
+    fiscal_code_key: Mapped[str | None] = mapped_column(String(32), nullable=True, index=True)
+    search_text: Mapped[str | None] = mapped_column(Text, nullable=True)
+
+    # Sincronizzazione con i client offline (services/sync.py)
+    uid: Mapped[str | None] = mapped_column(String(36), nullable=True, unique=True, index=True, default=_new_uid)
+    change_seq: Mapped[int | None] = mapped_column(Integer, nullable=True, index=True)
+
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
     updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
-    exams = relationship("Exam", back_populates="patient", cascade="all, delete-orphan")
+    # passive_deletes: figli cancellati dal DB (ON DELETE CASCADE), senza caricarli
+    exams = relationship("Exam", back_populates="patient", cascade="all, delete-orphan", passive_deletes=True)
 
 
 class Exam(Base):
     __tablename__ = "exams"
+    __table_args__ = (
+        Index("ix_exams_date_id", "exam_date", "id"),
+        Index("ix_exams_patient_date_id", "patient_id", "exam_date", "id"),
+        Index("ix_exams_status_date_id", "overall_status", "exam_date", "id"),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
     patient_id: Mapped[int] = mapped_column(Integer, ForeignKey("patients.id", ondelete="CASCADE"), index=True)
@@ -41,6 +65,7 @@ class Exam(Base):
     glyc_unit: Mapped[str] = mapped_column(String(20), default="mg/dL")
     ins_unit: Mapped[str] = mapped_column(String(20), default="µUI/mL")
 
+    # Colonne legacy: i punti sono in exam_points, restano solo per il backfill (app/migrations.py)
     glyc_times_json: Mapped[str] = mapped_column(Text, default="[]")
     ins_times_json: Mapped[str] = mapped_column(Text, default="[]")
     glyc_values_json: Mapped[str] = mapped_column(Text, default="[]")
@@ -52,16 +77,79 @@ class Exam(Base):
     notes: Mapped[str | None] = mapped_column(Text, nullable=True)
     interpretation_summary: Mapped[str | None] = mapped_column(Text, nullable=True)
     interpretation_details_json: Mapped[str] = mapped_column(Text, default="{}")
+    # Versione del profilo di riferimento (ActiveProfile.version) che ha prodotto l'interpretazione
+    interpretation_version: Mapped[str | None] = mapped_column(String(64), nullable=True, index=True)
+    # Esito e codici dell'interpretazione (services/interpretation.py), per filtri e statistiche senza JSON
+    overall_status: Mapped[str | None] = mapped_column(String(10), nullable=True)  # normal | warning | danger
+    glycemic_class: Mapped[str | None] = mapped_column(String(20), nullable=True, index=True)  # GLYCEMIC_CLASSES
+    insulin_pattern: Mapped[str | None] = mapped_column(String(20), nullable=True, index=True)  # INSULIN_PATTERNS
+    gdm: Mapped[int | None] = mapped_column(Integer, nullable=True, index=True)  # 0/1, solo in gravidanza
+
+    # Indici della curva (services/curve_metrics.py), calcolati al salvataggio; mg/dL e µU/mL
+    glyc_auc: Mapped[float | None] = mapped_column(Float, nullable=True, index=True)
+    glyc_iauc: Mapped[float | None] = mapped_column(Float, nullable=True, index=True)
+    ins_auc: Mapped[float | None] = mapped_column(Float, nullable=True, index=True)
+    ins_iauc: Mapped[float | None] = mapped_column(Float, nullable=True, index=True)
+    matsuda_index: Mapped[float | None] = mapped_column(Float, nullable=True, index=True)
+    homa_ir: Mapped[float | None] = mapped_column(Float, nullable=True, index=True)
+    insulinogenic_index: Mapped[float | None] = mapped_column(Float, nullable=True, index=True)
+
+    uid: Mapped[str | None] = mapped_column(String(36), nullable=True, unique=True, index=True, default=_new_uid)
+    change_seq: Mapped[int | None] = mapped_column(Integer, nullable=True, index=True)
 
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
 
     patient = relationship("Patient", back_populates="exams")
+    points = relationship("ExamPoint", back_populates="exam", cascade="all, delete-orphan", passive_deletes=True)
+
+
+class ExamPoint(Base):
+    __tablename__ = "exam_points"
+    __table_args__ = (Index("ix_exam_points_series_time_value", "series", "time_min", "value"),)
+
+    exam_id: Mapped[int] = mapped_column(Integer, ForeignKey("exams.id", ondelete="CASCADE"), primary_key=True)
+    series: Mapped[str] = mapped_column(String(4), primary_key=True)  # glyc | ins
+    time_min: Mapped[int] = mapped_column(Integer, primary_key=True)
+
+    position: Mapped[int | None] = mapped_column(Integer, nullable=True)  # NULL = solo range, tempo non prelevato
+    value: Mapped[float | None] = mapped_column(Float, nullable=True)
+    ref_min: Mapped[float | None] = mapped_column(Float, nullable=True)
+    ref_max: Mapped[float | None] = mapped_column(Float, nullable=True)
+
+    exam = relationship("Exam", back_populates="points")
+
+
+class ExamRollupDaily(Base):
+    """Conteggio esami per giorno e chiave (services/rollups.py); '' = valore assente."""
+
+    __tablename__ = "exam_rollup_daily"
+
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    overall_status: Mapped[str] = mapped_column(String(20), primary_key=True)
+    curve_mode: Mapped[str] = mapped_column(String(20), primary_key=True)
+    requester_doctor: Mapped[str] = mapped_column(String(150), primary_key=True)
+    pregnant_mode: Mapped[int] = mapped_column(Integer, primary_key=True)
+    exam_count: Mapped[int] = mapped_column(Integer, default=0)
+
+
+class ExamRollupMonthly(Base):
+    """Come ExamRollupDaily, per mese (month = primo giorno del mese)."""
+
+    __tablename__ = "exam_rollup_monthly"
+
+    month: Mapped[date] = mapped_column(Date, primary_key=True)
+    overall_status: Mapped[str] = mapped_column(String(20), primary_key=True)
+    curve_mode: Mapped[str] = mapped_column(String(20), primary_key=True)
+    requester_doctor: Mapped[str] = mapped_column(String(150), primary_key=True)
+    pregnant_mode: Mapped[int] = mapped_column(Integer, primary_key=True)
+    exam_count: Mapped[int] = mapped_column(Integer, default=0)
 
 
 class ReportSettings(Base):
     __tablename__ = "report_settings"
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    singleton_key: Mapped[str | None] = mapped_column(String(20), nullable=True, unique=True, index=True)
     report_title: Mapped[str] = mapped_column(
         String(180),
         default="Referto Curva da Carico Orale di Glucosio",
@@ -78,7 +166,8 @@ class ReportSettings(Base):
         String(180),
         default="Tel 0761 304260 - www.polispecialisticoviterbo.it",
     )
-    header_logo_data_url: Mapped[str | None] = mapped_column(Text, nullable=True)
+    header_logo_data_url: Mapped[str | None] = mapped_column(Text, nullable=True)  # legacy, convertito in report_logos
+    header_logo_sha256: Mapped[str | None] = mapped_column(String(64), nullable=True)
 
     include_interpretation_default: Mapped[int] = mapped_column(Integer, default=1)
     merge_charts_default: Mapped[int] = mapped_column(Integer, default=1)
@@ -86,6 +175,20 @@ class ReportSettings(Base):
     updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 
+class ReportLogo(Base):
+    """Logo di intestazione decodificato: una riga per variante (original | screen | print)."""
+
+    __tablename__ = "report_logos"
+
+    sha256: Mapped[str] = mapped_column(String(64), primary_key=True)  # hash dell'immagine originale
+    variant: Mapped[str] = mapped_column(String(20), primary_key=True)
+    media_type: Mapped[str] = mapped_column(String(60))
+    width: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    height: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    data: Mapped[bytes] = mapped_column(LargeBinary)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+
 class ReferenceProfile(Base):
     __tablename__ = "reference_profiles"
 
@@ -97,6 +200,8 @@ class ReferenceProfile(Base):
     pregnant_glyc_refs_json: Mapped[str] = mapped_column(Text, default="{}")
     ins_refs_json: Mapped[str] = mapped_column(Text, default="{}")
     sources_json: Mapped[str] = mapped_column(Text, default="[]")
+    # Regole di interpretazione (vedi services.interpretation_rules); NULL = DEFAULT_RULES
+    rules_json: Mapped[str | None] = mapped_column(Text, nullable=True)
 
     method_glyc: Mapped[str | None] = mapped_column(Text, nullable=True)
     method_ins: Mapped[str | None] = mapped_column(Text, nullable=True)
@@ -104,3 +209,91 @@ class ReferenceProfile(Base):
 
     updated_on: Mapped[date] = mapped_column(Date, default=date.today)
     is_active: Mapped[int] = mapped_column(Integer, default=1)
+
+
+class ReferenceProfileVersion(Base):
+    """Payload di ogni versione di profilo usata per interpretare esami (per riconoscere i range ereditati)."""
+
+    __tablename__ = "reference_profile_versions"
+
+    version: Mapped[str] = mapped_column(String(64), primary_key=True)
+    profile_id: Mapped[int] = mapped_column(Integer)
+    payload_json: Mapped[str] = mapped_column(Text, default="{}")
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+
+class ReinterpretationJob(Base):
+    __tablename__ = "reinterpretation_jobs"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    target_version: Mapped[str] = mapped_column(String(64))
+    status: Mapped[str] = mapped_column(String(20), default="pending", index=True)  # pending | running | done | failed
+    total: Mapped[int] = mapped_column(Integer, default=0)
+    processed: Mapped[int] = mapped_column(Integer, default=0)
+    changed: Mapped[int] = mapped_column(Integer, default=0)
+    last_exam_id: Mapped[int] = mapped_column(Integer, default=0)  # ripresa dopo un riavvio
+    include_legacy: Mapped[int] = mapped_column(Integer, default=0)  # 0/1: anche gli esami "legacy"
+    error: Mapped[str | None] = mapped_column(Text, nullable=True)
+    # Processo che lo esegue (host:pid) e ultimo segno di vita: con più worker un solo processo per job
+    worker: Mapped[str | None] = mapped_column(String(80), nullable=True)
+    heartbeat_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    started_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    finished_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+
+
+class ReportJob(Base):
+    __tablename__ = "report_jobs"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    status: Mapped[str] = mapped_column(String(20), default="pending", index=True)  # pending | running | done | failed
+    format: Mapped[str] = mapped_column(String(8), default="zip")  # zip | pdf (unico PDF)
+    exam_ids_json: Mapped[str] = mapped_column(Text, default="[]")
+    options_json: Mapped[str] = mapped_column(Text, default="{}")
+    total: Mapped[int] = mapped_column(Integer, default=0)
+    done: Mapped[int] = mapped_column(Integer, default=0)
+    output_path: Mapped[str | None] = mapped_column(Text, nullable=True)
+    error: Mapped[str | None] = mapped_column(Text, nullable=True)
+    # Processo che esegue il thread del job (host:pid) e ultimo segno di vita (services/report_jobs.py)
+    worker: Mapped[str | None] = mapped_column(String(80), nullable=True)
+    heartbeat_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    finished_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+
+
+class SyncState(Base):
+    """Contatore globale delle modifiche (una sola riga, id=1): ogni scrittura prende il numero successivo."""
+
+    __tablename__ = "sync_state"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    last_seq: Mapped[int] = mapped_column(Integer, default=0)
+
+
+class SyncTombstone(Base):
+    """Paziente o esame cancellato, perché i client lo rimuovano al prossimo sync."""
+
+    __tablename__ = "sync_tombstones"
+
+    seq: Mapped[int] = mapped_column(Integer, primary_key=True)
+    entity: Mapped[str] = mapped_column(String(10))  # patient | exam
+    uid: Mapped[str] = mapped_column(String(36), index=True)
+    deleted_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+
+class CacheVersion(Base):
+    """Versione dei dati di una cache in-process (profilo attivo, impostazioni referto), una riga per cache."""
+
+    __tablename__ = "cache_versions"
+
+    name: Mapped[str] = mapped_column(String(40), primary_key=True)
+    version: Mapped[int] = mapped_column(Integer, default=0)
+
+
+class SchemaMigration(Base):
+    __tablename__ = "schema_migrations"
+
+    name: Mapped[str] = mapped_column(String(120), primary_key=True)
+    applied_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
@@ -0,0 +1,143 @@
+"""
+Percorso veloce per le risposte JSON e compressione (entrambi opt-in da config).
+
+- FAST_JSON=true (richiede orjson): ORJSONResponse come classe di risposta predefinita;
+  le GET più usate (dettaglio/lista esami, lista/ricerca pazienti) serializzano
+  direttamente i dati letti dal DB, che hanno già i tipi dello schema, senza
+  ri-validarli col response_model.
+- Il rendering del JSON (json.dumps / orjson.dumps) è una sezione misurata delle
+  metriche (json_encode, vedi instrumentation.py).
+- COMPRESS_RESPONSES=true: brotli se il client lo accetta e il modulo brotli è
+  installato, altrimenti gzip; solo sopra COMPRESS_MIN_SIZE byte e mai per
+  contenuti già compressi (immagini, PDF, zip, Arrow).
+"""
+from __future__ import annotations
+
+import time
+from typing import Any, Iterable
+
+from fastapi.responses import JSONResponse, ORJSONResponse
+from pydantic import BaseModel
+from starlette.datastructures import Headers
+from starlette.middleware.gzip import GZipResponder, IdentityResponder
+from starlette.responses import Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .config import settings
+from .instrumentation import record_section
+
+try:
+    import orjson
+except ImportError:  # dipendenza opzionale
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # dipendenza opzionale
+    brotli = None
+
+
+UNCOMPRESSED_TYPES = (
+    "text/event-stream",
+    "image/",
+    "application/pdf",
+    "application/zip",
+    "application/vnd.apache.arrow",
+)
+
+
+class TimedJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        t0 = time.perf_counter()
+        body = super().render(content)
+        record_section("json_encode", time.perf_counter() - t0)
+        return body
+
+
+class TimedORJSONResponse(ORJSONResponse):
+    def render(self, content: Any) -> bytes:
+        t0 = time.perf_counter()
+        body = super().render(content)
+        record_section("json_encode", time.perf_counter() - t0)
+        return body
+
+
+def fast_json_enabled() -> bool:
+    return settings.fast_json and orjson is not None
+
+
+def default_response_class() -> type[Response]:
+    if fast_json_enabled():
+        return TimedORJSONResponse if settings.metrics_enabled else ORJSONResponse
+    return TimedJSONResponse if settings.metrics_enabled else JSONResponse
+
+
+def row_dict(row: Any, schema: type[BaseModel]) -> dict:
+    """Campi dello schema letti dalla riga ORM, senza validazione."""
+    return {name: getattr(row, name) for name in schema.model_fields}
+
+
+def rows_dicts(rows: Iterable[Any], schema: type[BaseModel]) -> list[dict]:
+    names = list(schema.model_fields)
+    return [{name: getattr(row, name) for name in names} for row in rows]
+
+
+def respond(content: Any, response: Response | None = None, status_code: int = 200):
+    """
+    Con FAST_JSON: ORJSONResponse già pronta (FastAPI non valida il response_model),
+    con gli header impostati sulla Response iniettata nella route.
+    Senza: restituisce il contenuto, validato e serializzato da FastAPI come sempre.
+    """
+    if not fast_json_enabled():
+        return content
+    headers = dict(response.headers) if response is not None else None
+    return default_response_class()(content, status_code=status_code, headers=headers)
+
+
+class _SkipCompressed:
+    async def send_with_compression(self, message: Message) -> None:
+        await super().send_with_compression(message)
+        if message["type"] == "http.response.start":
+            content_type = Headers(raw=message["headers"]).get("content-type", "")
+            self.content_type_is_excluded |= content_type.startswith(UNCOMPRESSED_TYPES)
+
+
+class _GZipResponder(_SkipCompressed, GZipResponder):
+    pass
+
+
+class _BrotliResponder(_SkipCompressed, IdentityResponder):
+    content_encoding = "br"
+
+    def __init__(self, app: ASGIApp, minimum_size: int, quality: int) -> None:
+        super().__init__(app, minimum_size)
+        self.compressor = brotli.Compressor(quality=quality)
+
+    def apply_compression(self, body: bytes, *, more_body: bool) -> bytes:
+        out = self.compressor.process(body)
+        # Nei flussi (export) si svuota il buffer a ogni blocco per non trattenere righe
+        return out + (self.compressor.flush() if more_body else self.compressor.finish())
+
+
+class CompressionMiddleware:
+    """Come GZipMiddleware di Starlette, con brotli e l'esclusione dei contenuti già compressi."""
+
+    def __init__(self, app: ASGIApp, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 5) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        accept = Headers(scope=scope).get("Accept-Encoding", "")
+        if brotli is not None and "br" in accept:
+            responder = _BrotliResponder(self.app, self.minimum_size, self.brotli_quality)
+        elif "gzip" in accept:
+            responder = _GZipResponder(self.app, self.minimum_size, compresslevel=self.gzip_level)
+        else:
+            responder = IdentityResponder(self.app, self.minimum_size)
+        await responder(scope, receive, send)
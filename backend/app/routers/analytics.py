@@ -0,0 +1,72 @@
+from datetime import date
+from typing import Literal
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .. import schemas
+from ..crud import patients_async as crud_patients
+from ..database import get_async_read_db
+from ..instrumentation import InstrumentedRoute
+from ..services import analytics, cohort
+
+
+router = APIRouter(prefix="/analytics", tags=["analytics"], route_class=InstrumentedRoute)
+
+
+def _csv_param(raw: str, allowed, name: str) -> list[str]:
+    items = [x.strip() for x in raw.split(",") if x.strip()]
+    bad = [x for x in items if x not in allowed]
+    if bad:
+        raise HTTPException(status_code=400, detail=f"{name} non valido: {', '.join(bad)} (ammessi: {', '.join(allowed)})")
+    return list(dict.fromkeys(items))
+
+
+@router.get("/cohort", response_model=schemas.CohortStats)
+async def cohort_stats(
+    group_by: str = Query("", description=f"Campi separati da virgola tra: {', '.join(cohort.GROUP_FIELDS)}"),
+    bucket: Literal["day", "week", "month", "quarter", "year"] = Query("month"),
+    percentiles: str = Query(
+        ",".join(map(str, cohort.DEFAULT_PERCENTILES)),
+        description="Es. 25,50,75,90; vuoto = solo conteggi, senza la query sui valori (molto più veloce)",
+    ),
+    series: Literal["glyc", "ins"] | None = Query(default=None),
+    date_from: date | None = Query(default=None),
+    date_to: date | None = Query(default=None),
+    curve_mode: Literal["glyc", "ins", "combined"] | None = Query(default=None),
+    pregnant_mode: bool | None = Query(default=None),
+    requester_doctor: str | None = Query(default=None),
+    status: Literal["normal", "warning", "danger"] | None = Query(default=None),
+    db: AsyncSession = Depends(get_async_read_db),
+):
+    fields = _csv_param(group_by, cohort.GROUP_FIELDS, "group_by")
+    try:
+        pcts = sorted({int(p) for p in percentiles.split(",") if p.strip()})
+    except ValueError:
+        raise HTTPException(status_code=400, detail="percentiles: interi tra 1 e 100 separati da virgola")
+    if any(p < 1 or p > 100 for p in pcts):
+        raise HTTPException(status_code=400, detail="percentiles: interi tra 1 e 100 separati da virgola")
+    dialect = db.get_bind().dialect.name
+    if dialect not in ("sqlite", "postgresql"):
+        raise HTTPException(status_code=501, detail="Statistiche di coorte disponibili solo su SQLite e PostgreSQL")
+
+    counts, points = cohort.cohort_query(
+        dialect, fields, bucket, pcts, series,
+        date_from=date_from, date_to=date_to, curve_mode=curve_mode, pregnant_mode=pregnant_mode,
+        requester_doctor=requester_doctor, status=status,
+    )
+    count_rows = (await db.execute(counts)).mappings().all()
+    point_rows = (await db.execute(points)).mappings().all() if pcts else []
+    return {
+        "group_by": fields,
+        "bucket": bucket if "bucket" in fields else None,
+        "groups": cohort.build_groups(count_rows, point_rows, fields, pcts),
+    }
+
+
+@router.get("/patients/{patient_id}", response_model=schemas.PatientAnalytics)
+async def patient_analytics(patient_id: int, db: AsyncSession = Depends(get_async_read_db)):
+    if not await crud_patients.get_patient(db, patient_id):
+        raise HTTPException(status_code=404, detail="Paziente non trovato")
+    rows = (await db.execute(analytics.patient_exams_stmt(patient_id))).all()
+    return analytics.patient_analytics(rows, patient_id)
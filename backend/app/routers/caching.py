@@ -0,0 +1,7 @@
+from fastapi import Request
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """True se If-None-Match contiene l'ETag (o "*"): si può rispondere 304."""
+    header = request.headers.get("if-none-match", "")
+    return header.strip() == "*" or etag in [x.strip() for x in header.split(",")]
@@ -2,11 +2,12 @@ from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
 
 from ..database import get_db
+from ..instrumentation import InstrumentedRoute
 from .. import schemas
 from ..crud import catalog as crud
 
 
-router = APIRouter(prefix="/catalog", tags=["catalog"])
+router = APIRouter(prefix="/catalog", tags=["catalog"], route_class=InstrumentedRoute)
 
 
 @router.get("", response_model=list[schemas.CatalogItemOut])
@@ -1,81 +1,119 @@
-import json
-from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy.orm import Session
-from ..database import get_db
+from datetime import date
+from typing import Literal
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from ..database import get_async_db, get_async_read_db
+from ..instrumentation import InstrumentedRoute
 from .. import schemas
-from ..crud import exams as crud_exams
-from ..crud import patients as crud_patients
+from ..crud import exams_async as crud_exams
+from ..crud.exams import created_exam_out, exam_out
 from ..services.interpretation import interpret_exam
+from ..services import exam_export, exam_import
+from ..services.batch_interpretation import interpret_exams_batch
+from ..services.reference_profiles import apply_default_refs, get_active_snapshot, record_version
+from ..responses import respond, rows_dicts
 
 
-router = APIRouter(prefix="/exams", tags=["exams"])
-
-
-def _row_to_out(row):
-    interpretation = json.loads(row.interpretation_details_json or "{}")
-    return schemas.ExamOut(
-        id=row.id,
-        patient_id=row.patient_id,
-        exam_date=row.exam_date,
-        requester_doctor=row.requester_doctor,
-        acceptance_number=row.acceptance_number,
-        curve_mode=row.curve_mode,
-        pregnant_mode=bool(row.pregnant_mode),
-        glucose_load_g=row.glucose_load_g,
-        glyc_unit=row.glyc_unit,
-        ins_unit=row.ins_unit,
-        glyc_times=json.loads(row.glyc_times_json or "[]"),
-        ins_times=json.loads(row.ins_times_json or "[]"),
-        glyc_values=json.loads(row.glyc_values_json or "[]"),
-        ins_values=json.loads(row.ins_values_json or "[]"),
-        glyc_refs=json.loads(row.glyc_refs_json or "{}"),
-        ins_refs=json.loads(row.ins_refs_json or "{}"),
-        methodology=row.methodology,
-        notes=row.notes,
-        interpretation_summary=row.interpretation_summary,
-        interpretation=schemas.InterpretationOut(**interpretation),
-        created_at=row.created_at,
-    )
+router = APIRouter(prefix="/exams", tags=["exams"], route_class=InstrumentedRoute)
 
 
 @router.post("/preview", response_model=schemas.InterpretationOut)
-def preview_interpretation(payload: schemas.ExamPayload):
-    interp = interpret_exam(payload.model_dump())
+async def preview_interpretation(payload: schemas.ExamPayload, db: AsyncSession = Depends(get_async_db)):
+    snap = await db.run_sync(get_active_snapshot)
+    interp = interpret_exam(apply_default_refs(payload.model_dump(), snap.payload), snap.rules)
     return schemas.InterpretationOut(**interp)
 
 
+@router.post("/preview/batch", response_model=list[schemas.InterpretationOut])
+async def preview_interpretation_batch(payloads: list[schemas.ExamPayload], db: AsyncSession = Depends(get_async_db)):
+    snap = await db.run_sync(get_active_snapshot)
+    # Calcolo CPU-bound su molti esami: fuori dall'event loop
+    results = await run_in_threadpool(
+        interpret_exams_batch, [apply_default_refs(p.model_dump(), snap.payload) for p in payloads], snap.rules
+    )
+    return [schemas.InterpretationOut(**r) for r in results]
+
+
 @router.post("", response_model=schemas.ExamOut, status_code=201)
-def create_exam(payload: schemas.ExamCreate, db: Session = Depends(get_db)):
-    patient = crud_patients.get_patient(db, payload.patient_id)
-    if not patient:
+async def create_exam(payload: schemas.ExamCreate, db: AsyncSession = Depends(get_async_db)):
+    snap = await db.run_sync(get_active_snapshot)
+    # I range ereditati dal profilo attivo vengono salvati con l'esame
+    data = apply_default_refs(payload.model_dump(), snap.payload)
+    interp = interpret_exam(data, snap.rules)
+    await db.run_sync(record_version, snap)
+    # Paziente verificato dalla foreign key dell'INSERT, senza SELECT preventiva
+    created = await crud_exams.create_exam(db, data, interp, snap.version)
+    if created is None:
         raise HTTPException(status_code=404, detail="Paziente non trovato")
+    return created_exam_out(created, data, interp)
+
+
+@router.post("/import", response_model=schemas.ExamImportReport)
+async def import_exams(
+    request: Request,
+    format: str | None = Query(default=None, pattern="^(ndjson|csv)$", description="Default dal Content-Type"),
+    db: AsyncSession = Depends(get_async_db),
+):
+    fmt = format or ("csv" if "csv" in request.headers.get("content-type", "") else "ndjson")
+    return await exam_import.import_exams(db, request.stream(), fmt)
+
 
-    interp = interpret_exam(payload.model_dump())
-    created = crud_exams.create_exam(db, payload, interp)
-    return _row_to_out(created)
+@router.get("/export")
+def export_exams(
+    format: Literal["ndjson", "csv", "arrow"] = Query(default="ndjson"),
+    date_from: date | None = Query(default=None),
+    date_to: date | None = Query(default=None),
+    curve_mode: Literal["glyc", "ins", "combined"] | None = Query(default=None),
+    status: Literal["normal", "warning", "danger"] | None = Query(default=None),
+):
+    if format == "arrow" and not exam_export.arrow_available():
+        raise HTTPException(status_code=501, detail="Formato arrow non disponibile: installare pyarrow")
+    stream = exam_export.export_exams(
+        format, date_from=date_from, date_to=date_to, curve_mode=curve_mode, status=status
+    )
+    ext = {"ndjson": "ndjson", "csv": "csv", "arrow": "arrows"}[format]
+    return StreamingResponse(
+        stream,
+        media_type=exam_export.MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="esami.{ext}"'},
+    )
 
 
 @router.get("", response_model=list[schemas.ExamListItem])
-def list_exams(
+async def list_exams(
+    response: Response,
     patient_id: int | None = Query(default=None),
     limit: int = Query(default=100, ge=1, le=500),
-    db: Session = Depends(get_db),
+    cursor: str | None = Query(default=None, description="Cursore X-Next-Cursor della pagina precedente"),
+    status: Literal["normal", "warning", "danger"] | None = Query(default=None),
+    glycemic_class: Literal["ngt", "igt", "dm", "iadpsg_ok", "gdm"] | None = Query(default=None),
+    insulin_pattern: Literal["ok", "delayed", "slow_return"] | None = Query(default=None),
+    gdm: bool | None = Query(default=None, description="Esami in gravidanza positivi (true) o negativi ai criteri IADPSG"),
+    db: AsyncSession = Depends(get_async_read_db),
 ):
-    rows = crud_exams.list_exams(db, patient_id=patient_id, limit=limit)
-    return rows
+    try:
+        rows, next_cursor = await crud_exams.list_exams(
+            db, patient_id=patient_id, limit=limit, cursor=cursor,
+            status=status, glycemic_class=glycemic_class, insulin_pattern=insulin_pattern, gdm=gdm,
+        )
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return respond(rows_dicts(rows, schemas.ExamListItem), response)
 
 
 @router.get("/{exam_id}", response_model=schemas.ExamOut)
-def get_exam(exam_id: int, db: Session = Depends(get_db)):
-    row = crud_exams.get_exam(db, exam_id)
+async def get_exam(exam_id: int, db: AsyncSession = Depends(get_async_read_db)):
+    row = await crud_exams.get_exam(db, exam_id)
     if not row:
         raise HTTPException(status_code=404, detail="Esame non trovato")
-    return _row_to_out(row)
+    return respond(exam_out(row))
 
 
 @router.delete("/{exam_id}", status_code=204)
-def delete_exam(exam_id: int, db: Session = Depends(get_db)):
-    row = crud_exams.get_exam(db, exam_id)
-    if not row:
+async def delete_exam(exam_id: int, db: AsyncSession = Depends(get_async_db)):
+    if not await crud_exams.delete_exam(db, exam_id):
         raise HTTPException(status_code=404, detail="Esame non trovato")
-    crud_exams.delete_exam(db, row)
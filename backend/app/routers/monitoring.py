@@ -0,0 +1,35 @@
+from fastapi import APIRouter, HTTPException, Query, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse
+
+from ..config import settings
+from ..instrumentation import InstrumentedRoute, folded, render_metrics, sample_stacks
+
+
+router = APIRouter(tags=["monitoring"], route_class=InstrumentedRoute)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+@router.get("/metrics")
+def metrics():
+    if not settings.metrics_enabled:
+        raise HTTPException(status_code=404, detail="Metriche disattivate (METRICS_ENABLED=false)")
+    return Response(render_metrics(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+
+@router.get("/profile", response_class=PlainTextResponse)
+async def profile(
+    seconds: float = Query(10, gt=0, le=120),
+    interval_ms: float = Query(10, ge=1, le=1000),
+    include_idle: bool = False,
+):
+    """Stack campionati di tutti i thread durante `seconds` (formato folded: flamegraph.pl, speedscope)."""
+    if not settings.profiling_enabled:
+        raise HTTPException(status_code=404, detail="Profiler disattivato (PROFILING_ENABLED=false)")
+    try:
+        # In un thread: l'event loop continua a servire le richieste che si stanno profilando
+        samples = await run_in_threadpool(sample_stacks, seconds, interval_ms / 1000, include_idle)
+    except RuntimeError as exc:
+        raise HTTPException(status_code=409, detail=str(exc))
+    return PlainTextResponse(folded(samples))
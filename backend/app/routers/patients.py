@@ -1,46 +1,63 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy.orm import Session
-from ..database import get_db
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+from ..database import get_async_db, get_async_read_db
+from ..instrumentation import InstrumentedRoute
 from .. import schemas
-from ..crud import patients as crud
+from ..crud import patients_async as crud
+from ..responses import respond, row_dict, rows_dicts
 
 
-router = APIRouter(prefix="/patients", tags=["patients"])
+router = APIRouter(prefix="/patients", tags=["patients"], route_class=InstrumentedRoute)
 
 
 @router.post("", response_model=schemas.PatientOut, status_code=201)
-def create_patient(payload: schemas.PatientCreate, db: Session = Depends(get_db)):
-    return crud.create_patient(db, payload)
+async def create_patient(payload: schemas.PatientCreate, db: AsyncSession = Depends(get_async_db)):
+    return await crud.create_patient(db, payload)
 
 
 @router.get("", response_model=list[schemas.PatientOut])
-def list_patients(
+async def list_patients(
+    response: Response,
     search: str = Query("", description="Ricerca per cognome/nome/codice fiscale"),
     limit: int = Query(50, ge=1, le=500),
-    db: Session = Depends(get_db),
+    cursor: str | None = Query(default=None, description="Cursore X-Next-Cursor della pagina precedente"),
+    db: AsyncSession = Depends(get_async_read_db),
 ):
-    return crud.list_patients(db, search=search, limit=limit)
+    try:
+        rows, next_cursor = await crud.list_patients(db, search=search, limit=limit, cursor=cursor)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return respond(rows_dicts(rows, schemas.PatientOut), response)
+
+
+@router.get("/search", response_model=list[schemas.PatientOut])
+async def search_patients(
+    q: str = Query("", description="Testo digitato: codice fiscale, inizio cognome o parte di nome/cognome"),
+    limit: int = Query(20, ge=1, le=100),
+    db: AsyncSession = Depends(get_async_read_db),
+):
+    return respond(rows_dicts(await crud.search_patients(db, q, limit=limit), schemas.PatientOut))
 
 
 @router.get("/{patient_id}", response_model=schemas.PatientOut)
-def get_patient(patient_id: int, db: Session = Depends(get_db)):
-    p = crud.get_patient(db, patient_id)
+async def get_patient(patient_id: int, db: AsyncSession = Depends(get_async_read_db)):
+    p = await crud.get_patient(db, patient_id)
     if not p:
         raise HTTPException(status_code=404, detail="Paziente non trovato")
-    return p
+    return respond(row_dict(p, schemas.PatientOut))
 
 
 @router.put("/{patient_id}", response_model=schemas.PatientOut)
-def update_patient(patient_id: int, payload: schemas.PatientUpdate, db: Session = Depends(get_db)):
-    p = crud.get_patient(db, patient_id)
+async def update_patient(patient_id: int, payload: schemas.PatientUpdate, db: AsyncSession = Depends(get_async_db)):
+    p = await crud.get_patient(db, patient_id)
     if not p:
         raise HTTPException(status_code=404, detail="Paziente non trovato")
-    return crud.update_patient(db, p, payload)
+    return await crud.update_patient(db, p, payload)
 
 
 @router.delete("/{patient_id}", status_code=204)
-def delete_patient(patient_id: int, db: Session = Depends(get_db)):
-    p = crud.get_patient(db, patient_id)
-    if not p:
+async def delete_patient(patient_id: int, db: AsyncSession = Depends(get_async_db)):
+    if not await crud.delete_patient(db, patient_id):
         raise HTTPException(status_code=404, detail="Paziente non trovato")
-    crud.delete_patient(db, p)
@@ -1,16 +1,22 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Request, Response
 from sqlalchemy.orm import Session
 
 from ..database import get_db
+from ..instrumentation import InstrumentedRoute
 from ..services.presets import get_presets_payload
-from ..services.reference_profiles import get_active_profile, row_to_payload
+from ..services.reference_profiles import get_active_snapshot
+from .caching import etag_matches
 
 
-router = APIRouter(prefix="/presets", tags=["presets"])
+router = APIRouter(prefix="/presets", tags=["presets"], route_class=InstrumentedRoute)
 
 
 @router.get("")
-def get_presets(db: Session = Depends(get_db)):
-    row = get_active_profile(db)
-    ref_payload = row_to_payload(row)
-    return get_presets_payload(ref_payload)
+def get_presets(request: Request, response: Response, db: Session = Depends(get_db)):
+    snap = get_active_snapshot(db)
+    etag = f'"{snap.version}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return get_presets_payload(snap.payload)
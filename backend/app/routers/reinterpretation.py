@@ -0,0 +1,41 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import Session
+
+from .. import models, schemas
+from ..database import get_db
+from ..instrumentation import InstrumentedRoute
+from ..services import reinterpretation
+from ..services.reference_profiles import get_active_snapshot
+
+
+router = APIRouter(prefix="/reinterpretation", tags=["reinterpretation"], route_class=InstrumentedRoute)
+
+
+@router.get("/status", response_model=schemas.ReinterpretationStatus)
+def get_status(db: Session = Depends(get_db)):
+    version = get_active_snapshot(db).version
+    return schemas.ReinterpretationStatus(
+        active_version=version,
+        stale_exams=reinterpretation.count_stale(db, version),
+        legacy_exams=reinterpretation.count_legacy(db),
+        job=reinterpretation.latest_job(db),
+    )
+
+
+@router.post("/jobs", response_model=schemas.ReinterpretationJobOut, status_code=202)
+def start_job(include_legacy: bool = False, db: Session = Depends(get_db)):
+    """include_legacy: anche gli esami interpretati prima del versionamento dei profili."""
+    job = reinterpretation.enqueue(db, include_legacy=include_legacy)
+    if job is None:
+        raise HTTPException(status_code=409, detail="Job appena concluso: ripetere la richiesta")
+    if include_legacy and not job.include_legacy:
+        raise HTTPException(status_code=409, detail=f"Job {job.id} in corso senza esami legacy: ripetere al termine")
+    return job
+
+
+@router.get("/jobs/{job_id}", response_model=schemas.ReinterpretationJobOut)
+def get_job(job_id: int, db: Session = Depends(get_db)):
+    job = db.get(models.ReinterpretationJob, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job non trovato")
+    return job
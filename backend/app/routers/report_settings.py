@@ -1,21 +1,43 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from sqlalchemy.orm import Session
 
 from ..database import get_db
+from ..instrumentation import InstrumentedRoute
 from .. import schemas
 from ..services import report_settings as report_srv
+from .caching import etag_matches
 
 
-router = APIRouter(prefix="/report-settings", tags=["report-settings"])
+router = APIRouter(prefix="/report-settings", tags=["report-settings"], route_class=InstrumentedRoute)
 
 
 @router.get("", response_model=schemas.ReportSettingsOut)
 def get_report_settings(db: Session = Depends(get_db)):
-    row = report_srv.get_or_create_settings(db)
-    return report_srv.row_to_payload(row)
+    return report_srv.current_payload(db)
 
 
 @router.put("", response_model=schemas.ReportSettingsOut)
 def update_report_settings(payload: schemas.ReportSettingsIn, db: Session = Depends(get_db)):
-    row = report_srv.update_settings(db, payload.model_dump())
-    return report_srv.row_to_payload(row)
+    return report_srv.update_from_payload(db, payload.model_dump(exclude_unset=True))
+
+
+@router.get("/logo")
+def get_logo(
+    request: Request,
+    variant: str = Query("original", pattern="^(original|screen|print)$"),
+    v: str | None = None,
+    db: Session = Depends(get_db),
+):
+    logo = report_srv.get_logo(db, report_srv.current_payload(db)["header_logo_hash"], variant)
+    if logo is None:
+        raise HTTPException(status_code=404, detail="Logo non impostato")
+    etag = f'"{logo.sha256}-{logo.variant}"'
+    # URL versionato con l'hash (?v=): il contenuto non cambia mai, il browser può tenerlo per sempre
+    cache_control = "public, max-age=31536000, immutable" if v == logo.sha256 else "no-cache"
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    # Il tipo dichiarato dal data URL può essere SVG: niente sniffing né script se aperto come pagina
+    headers["X-Content-Type-Options"] = "nosniff"
+    headers["Content-Security-Policy"] = "default-src 'none'; style-src 'unsafe-inline'; sandbox"
+    return Response(content=logo.data, media_type=logo.media_type, headers=headers)
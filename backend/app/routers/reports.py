@@ -0,0 +1,87 @@
+from pathlib import Path
+
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from fastapi.responses import FileResponse
+from sqlalchemy.orm import Session
+
+from .. import models, schemas
+from ..database import get_db
+from ..instrumentation import InstrumentedRoute
+from ..services import report_cache, report_jobs
+from ..services.report_pdf import report_filename
+from .caching import etag_matches
+
+
+router = APIRouter(prefix="/reports", tags=["reports"], route_class=InstrumentedRoute)
+
+
+@router.post("/batch", response_model=schemas.ReportJobOut, status_code=202)
+def create_batch(payload: schemas.ReportBatchIn, db: Session = Depends(get_db)):
+    exam_ids = report_jobs.select_exam_ids(db, payload.exam_ids, payload.exam_date)
+    if not exam_ids:
+        raise HTTPException(status_code=404, detail="Nessun esame da stampare")
+    options = {"include_interpretation": payload.include_interpretation, "merge_charts": payload.merge_charts}
+    return report_jobs.enqueue(db, exam_ids, payload.format, options)
+
+
+def _get_job(db: Session, job_id: int) -> models.ReportJob:
+    job = db.get(models.ReportJob, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job non trovato")
+    return job
+
+
+@router.get("/jobs/{job_id}", response_model=schemas.ReportJobOut)
+def get_job(job_id: int, db: Session = Depends(get_db)):
+    return _get_job(db, job_id)
+
+
+@router.get("/jobs/{job_id}/download")
+def download_job(job_id: int, db: Session = Depends(get_db)):
+    job = _get_job(db, job_id)
+    if job.status != "done":
+        raise HTTPException(status_code=409, detail="Job non ancora completato")
+    if not job.output_path or not Path(job.output_path).is_file():
+        raise HTTPException(status_code=410, detail="File del job eliminato (REPORT_OUTPUT_TTL_HOURS): ripetere la stampa")
+    media_type = "application/zip" if job.format == "zip" else "application/pdf"
+    return FileResponse(job.output_path, media_type=media_type, filename=f"referti-{job.id}.{job.format}")
+
+
+def _assets(db: Session, exam_id: int) -> report_cache.ExamAssets:
+    assets = report_cache.exam_assets(db, exam_id)
+    if assets is None:
+        raise HTTPException(status_code=404, detail="Esame non trovato")
+    return assets
+
+
+def _cached(request: Request, path: Path, key: str, filename: str | None = None):
+    etag = f'"{key}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    media_type = report_cache.MEDIA_TYPES[path.suffix[1:]]
+    return FileResponse(path, media_type=media_type, headers=headers, filename=filename, content_disposition_type="inline")
+
+
+@router.get("/exams/{exam_id}")
+def exam_report(exam_id: int, request: Request, db: Session = Depends(get_db)):
+    assets = _assets(db, exam_id)
+    path, key = report_cache.report_json_file(assets, request.url.path.rstrip("/"))
+    return _cached(request, path, key)
+
+
+@router.get("/exams/{exam_id}/pdf")
+def exam_report_pdf(exam_id: int, request: Request, db: Session = Depends(get_db)):
+    assets = _assets(db, exam_id)
+    path, key = report_cache.report_pdf_file(db, assets)
+    return _cached(request, path, key, filename=report_filename(assets.report))
+
+
+@router.get("/exams/{exam_id}/charts/{kind}.{fmt}")
+def exam_report_chart(exam_id: int, kind: str, fmt: str, request: Request, db: Session = Depends(get_db)):
+    if fmt not in ("png", "svg"):
+        raise HTTPException(status_code=404, detail="Formato non supportato (png, svg)")
+    found = report_cache.chart_file(_assets(db, exam_id), kind, fmt)
+    if found is None:
+        raise HTTPException(status_code=404, detail="Grafico non disponibile per questo esame")
+    return _cached(request, *found)
@@ -0,0 +1,24 @@
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.orm import Session
+
+from .. import schemas
+from ..database import get_db
+from ..instrumentation import InstrumentedRoute
+from ..crud import sync as crud
+
+
+router = APIRouter(prefix="/sync", tags=["sync"], route_class=InstrumentedRoute)
+
+
+@router.get("/changes", response_model=schemas.SyncChanges)
+def get_changes(
+    since: int = Query(default=0, ge=0),
+    limit: int = Query(default=500, ge=1, le=2000),
+    db: Session = Depends(get_db),
+):
+    return crud.changes(db, since, limit)
+
+
+@router.post("/push", response_model=schemas.SyncPushResult)
+def push(payload: schemas.SyncPushIn, db: Session = Depends(get_db)):
+    return crud.push(db, payload)
@@ -1,6 +1,6 @@
 from datetime import date, datetime
 from typing import Dict, List, Literal, Optional, Any
-from pydantic import BaseModel, Field, ConfigDict
+from pydantic import BaseModel, Field, ConfigDict, model_validator
 
 
 class PatientBase(BaseModel):
@@ -57,8 +57,9 @@ class ExamPayload(BaseModel):
 
     glyc_times: List[int] = Field(default_factory=list)
     ins_times: List[int] = Field(default_factory=list)
-    glyc_values: List[float] = Field(default_factory=list)
-    ins_values: List[float] = Field(default_factory=list)
+    # Allineati per posizione ai tempi: None = prelievo senza valore
+    glyc_values: List[Optional[float]] = Field(default_factory=list)
+    ins_values: List[Optional[float]] = Field(default_factory=list)
 
     glyc_refs: Dict[str, RefRange] = Field(default_factory=dict)
     ins_refs: Dict[str, RefRange] = Field(default_factory=dict)
@@ -70,14 +71,65 @@ class ExamPayload(BaseModel):
 class InterpretationOut(BaseModel):
     overall_status: Literal["normal", "warning", "danger"]
     summary: str
+    glycemic_class: Optional[Literal["ngt", "igt", "dm", "iadpsg_ok", "gdm"]] = None
+    insulin_pattern: Optional[Literal["ok", "delayed", "slow_return"]] = None
+    gdm: Optional[bool] = None
     details: Dict[str, Any]
 
 
 class ExamCreate(ExamPayload):
-    pass
+    @model_validator(mode="after")
+    def _normalize_series(self):
+        # Ogni punto è salvato per (serie, tempo): come per gli esami storici, di un tempo
+        # ripetuto resta il primo prelievo e i valori senza tempo sono scartati
+        for series in ("glyc", "ins"):
+            times = getattr(self, f"{series}_times")
+            values = getattr(self, f"{series}_values")
+            first: Dict[int, int] = {}
+            for pos, t in enumerate(times):
+                first.setdefault(t, pos)
+            if len(first) == len(times) and len(values) <= len(times):
+                continue
+            setattr(self, f"{series}_times", list(first))
+            setattr(self, f"{series}_values", [values[pos] for pos in first.values() if pos < len(values)])
+        return self
+
+
+class ExamImportRow(ExamCreate):
+    """Riga di import massivo: il paziente si indica per id o per codice fiscale."""
+
+    patient_id: Optional[int] = None
+    fiscal_code: Optional[str] = Field(default=None, max_length=32)
+
+    @model_validator(mode="after")
+    def _check_patient_ref(self):
+        if self.patient_id is None and not self.fiscal_code:
+            raise ValueError("Indicare patient_id o fiscal_code")
+        return self
+
+
+class ExamImportError(BaseModel):
+    line: int
+    error: str
+
+
+class ExamImportReport(BaseModel):
+    imported: int
+    failed: int
+    errors: List[ExamImportError]
+
+
+class StoredRefRange(BaseModel):
+    """Range di un esame salvato: gli esami storici possono averne un solo estremo."""
+
+    min: Optional[float] = None
+    max: Optional[float] = None
 
 
 class ExamOut(ExamPayload):
+    glyc_refs: Dict[str, StoredRefRange] = Field(default_factory=dict)
+    ins_refs: Dict[str, StoredRefRange] = Field(default_factory=dict)
+
     id: int
     interpretation_summary: Optional[str] = None
     interpretation: InterpretationOut
@@ -92,20 +144,206 @@ class ExamListItem(BaseModel):
     exam_date: date
     curve_mode: str
     interpretation_summary: Optional[str] = None
+    overall_status: Optional[str] = None
+    glycemic_class: Optional[str] = None
+    insulin_pattern: Optional[str] = None
+    created_at: datetime
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class ExamMetrics(BaseModel):
+    exam_id: int
+    exam_date: date
+    curve_mode: str
+    pregnant_mode: bool
+    glyc_auc: Optional[float] = None
+    glyc_iauc: Optional[float] = None
+    ins_auc: Optional[float] = None
+    ins_iauc: Optional[float] = None
+    matsuda_index: Optional[float] = None
+    homa_ir: Optional[float] = None
+    insulinogenic_index: Optional[float] = None
+
+
+class MetricTrend(BaseModel):
+    n: int
+    first: Optional[float] = None
+    last: Optional[float] = None
+    change: Optional[float] = None
+    slope_per_year: Optional[float] = None
+
+
+class PatientAnalytics(BaseModel):
+    patient_id: int
+    exams: List[ExamMetrics]
+    trend: Dict[str, MetricTrend]
+
+
+class CohortPoint(BaseModel):
+    series: str
+    time_min: int
+    n: int
+    mean: float
+    percentiles: Dict[str, Optional[float]]
+
+
+class CohortGroup(BaseModel):
+    key: Dict[str, Any]
+    count: int
+    by_status: Dict[str, int]
+    abnormal_rate: Optional[float] = None
+    points: List[CohortPoint]
+
+
+class CohortStats(BaseModel):
+    group_by: List[str]
+    bucket: Optional[str] = None
+    groups: List[CohortGroup]
+
+
+class ReinterpretationJobOut(BaseModel):
+    id: int
+    target_version: str
+    status: Literal["pending", "running", "done", "failed"]
+    total: int
+    processed: int
+    changed: int
+    include_legacy: bool = False
+    error: Optional[str] = None
     created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
 
     model_config = ConfigDict(from_attributes=True)
 
 
-class ReportSettingsIn(BaseModel):
+class ReinterpretationStatus(BaseModel):
+    active_version: str
+    stale_exams: int
+    legacy_exams: int = 0
+    job: Optional[ReinterpretationJobOut] = None
+
+
+class ReportBatchIn(BaseModel):
+    """Esami da stampare: lista di id e/o tutti gli esami di una data."""
+
+    exam_ids: Optional[List[int]] = Field(default=None, max_length=5000)
+    exam_date: Optional[date] = None
+    format: Literal["zip", "pdf"] = "zip"
+    include_interpretation: Optional[bool] = None  # default dalle impostazioni referto
+    merge_charts: Optional[bool] = None
+
+    @model_validator(mode="after")
+    def _check_selection(self):
+        if not self.exam_ids and self.exam_date is None:
+            raise ValueError("Indicare exam_ids o exam_date")
+        return self
+
+
+class ReportJobOut(BaseModel):
+    id: int
+    status: Literal["pending", "running", "done", "failed"]
+    format: Literal["zip", "pdf"]
+    total: int
+    done: int
+    error: Optional[str] = None
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class ReportSettingsBase(BaseModel):
     report_title: str = Field(default="Referto Curva da Carico Orale di Glucosio", max_length=180)
     header_line1: str = Field(default="Centro Polispecialistico Giovanni Paolo I srl", max_length=180)
     header_line2: str = Field(default="Via Ignazio Garbini, 25 - 01100 Viterbo", max_length=180)
     header_line3: str = Field(default="Tel 0761 304260 - www.polispecialisticoviterbo.it", max_length=180)
-    header_logo_data_url: Optional[str] = None
     include_interpretation_default: bool = True
     merge_charts_default: bool = True
 
 
-class ReportSettingsOut(ReportSettingsIn):
+class ReportSettingsIn(ReportSettingsBase):
+    # Nuovo logo come data URL; null lo rimuove, campo assente lo lascia invariato
+    header_logo_data_url: Optional[str] = None
+
+
+class ReportSettingsOut(ReportSettingsBase):
+    header_logo_url: Optional[str] = None
+    header_logo_hash: Optional[str] = None
     updated_at: Optional[str] = None
+
+
+class SyncPatientIn(PatientBase):
+    uid: str = Field(min_length=1, max_length=36)
+    base_seq: Optional[int] = None  # change_seq su cui si basa la modifica; None = paziente nuovo
+
+
+class SyncPatientOut(PatientOut):
+    uid: str
+    change_seq: int
+
+
+class SyncExamIn(ExamCreate):
+    """Esame dal client: il paziente si indica per uid (anche se creato nello stesso push)."""
+
+    patient_id: Optional[int] = None
+    uid: str = Field(min_length=1, max_length=36)
+    base_seq: Optional[int] = None
+    patient_uid: str = Field(min_length=1, max_length=36)
+
+
+class SyncExamOut(ExamOut):
+    uid: str
+    patient_uid: str
+    change_seq: int
+
+
+class SyncDeleteIn(BaseModel):
+    entity: Literal["patient", "exam"]
+    uid: str = Field(min_length=1, max_length=36)
+    base_seq: Optional[int] = None
+
+
+class SyncDeletion(BaseModel):
+    entity: Literal["patient", "exam"]
+    uid: str
+    seq: int
+
+
+class SyncChanges(BaseModel):
+    since: int
+    until: int  # da passare come since alla richiesta successiva
+    has_more: bool
+    patients: List[SyncPatientOut]
+    exams: List[SyncExamOut]
+    deleted: List[SyncDeletion]
+
+
+class SyncPushIn(BaseModel):
+    # Pazienti (SyncPatientIn) ed esami (SyncExamIn) sono validati uno per uno in crud/sync.py:
+    # una riga non valida diventa un conflitto "invalid" invece di rifiutare tutto il push
+    patients: List[Dict[str, Any]] = Field(default_factory=list, max_length=1000)
+    exams: List[Dict[str, Any]] = Field(default_factory=list, max_length=1000)
+    deleted: List[SyncDeleteIn] = Field(default_factory=list, max_length=1000)
+
+
+class SyncApplied(BaseModel):
+    entity: Literal["patient", "exam"]
+    uid: str
+    action: Literal["created", "updated", "deleted"]
+    id: Optional[int] = None
+    change_seq: Optional[int] = None
+
+
+class SyncConflict(BaseModel):
+    entity: Literal["patient", "exam"]
+    uid: str
+    reason: Literal["changed", "deleted", "patient_missing", "invalid"]
+    server_seq: Optional[int] = None  # versione attuale sul server (arriva col prossimo /sync/changes)
+    error: Optional[str] = None  # solo per "invalid": campi non validi e motivo
+
+
+class SyncPushResult(BaseModel):
+    applied: List[SyncApplied]
+    conflicts: List[SyncConflict]
@@ -0,0 +1,70 @@
+"""
+Avvio di produzione: migrazioni una sola volta, poi un pool di worker uvicorn.
+
+    cd backend && python -m app.serve [--workers N] [--host 0.0.0.0] [--port 8000]
+                                      [--log-level info] [--no-access-log]
+
+Le migrazioni (create_all, colonne nuove, migrazioni dati) girano in questo processo prima
+di avviare i worker, che partono con RUN_MIGRATIONS_ON_STARTUP=false: nessuna corsa sul DDL.
+Worker: --workers, altrimenti WEB_CONCURRENCY, altrimenti uno per CPU disponibile; uvicorn
+li riavvia se terminano. Il pool di rendering PDF di ogni worker, se REPORT_WORKERS non è
+impostato, ha CPU/worker processi, così in totale resta circa uno per CPU.
+
+Ogni worker ha le proprie cache (profilo attivo, impostazioni referto), riallineate tramite
+la tabella cache_versions (services/cache_versions.py), e le proprie metriche su /api/metrics.
+I job di reinterpretazione sono eseguiti da un solo processo alla volta (lease su DB); i job
+di stampa massiva restano nel worker che li ha ricevuti. Con SQLite le scritture dei worker
+si serializzano sul lock del database (WAL, busy_timeout): le letture scalano con i core,
+le scritture no.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+
+import uvicorn
+
+from .config import settings
+from .migrations import run_migrations
+
+
+def cpu_count() -> int:
+    """CPU utilizzabili dal processo (affinità), altrimenti quelle della macchina."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # Windows, macOS
+        return os.cpu_count() or 1
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=settings.web_concurrency or cpu_count())
+    parser.add_argument("--host", default=settings.host)
+    parser.add_argument("--port", type=int, default=settings.port)
+    parser.add_argument("--log-level", default="info")
+    parser.add_argument("--no-access-log", action="store_true")
+    args = parser.parse_args()
+    workers = max(1, args.workers)
+
+    done = run_migrations()
+    print("Migrazioni applicate:", ", ".join(done) if done else "nessuna", flush=True)
+
+    # I worker sono processi nuovi (spawn) ed ereditano l'ambiente; con un solo worker
+    # l'app è importata in questo processo, dove settings esiste già
+    os.environ["RUN_MIGRATIONS_ON_STARTUP"] = "false"
+    settings.run_migrations_on_startup = False
+    if "REPORT_WORKERS" not in os.environ and not settings.report_workers:
+        os.environ["REPORT_WORKERS"] = str(max(1, cpu_count() // workers))
+
+    uvicorn.run(
+        "app.main:app",
+        host=args.host,
+        port=args.port,
+        workers=workers,
+        log_level=args.log_level,
+        access_log=not args.no_access_log,
+    )
+
+
+if __name__ == "__main__":
+    main()
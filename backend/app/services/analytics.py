@@ -0,0 +1,111 @@
+"""
+Analisi longitudinale degli indici della curva (AUC, iAUC, Matsuda, HOMA-IR, indice insulinogenico).
+
+Gli indici sono colonne di exams calcolate al salvataggio (services/curve_metrics.py):
+qui si leggono e si calcola l'andamento nel tempo, per tutti gli indici insieme.
+"""
+from __future__ import annotations
+
+from typing import List
+
+import numpy as np
+from sqlalchemy import bindparam, select, update
+from sqlalchemy.engine import Connection
+
+from .. import models
+from ..crud.exams import points_to_series
+from .curve_metrics import METRICS, compute_metrics
+
+
+CHUNK_SIZE = 1000
+DAYS_PER_YEAR = 365.25
+
+
+def patient_exams_stmt(patient_id: int):
+    e = models.Exam
+    return (
+        select(e.id, e.exam_date, e.curve_mode, e.pregnant_mode, *(getattr(e, m) for m in METRICS))
+        .where(e.patient_id == patient_id)
+        .order_by(e.exam_date, e.id)
+    )
+
+
+def trend(days: np.ndarray, values: np.ndarray) -> dict:
+    """
+    Andamento di ogni indice (colonne di values, NaN = non calcolabile) rispetto ai giorni:
+    primo/ultimo valore, variazione e pendenza ai minimi quadrati per anno.
+    """
+    if not len(values):
+        return {m: {"n": 0, "first": None, "last": None, "change": None, "slope_per_year": None} for m in METRICS}
+    valid = ~np.isnan(values)
+    n = valid.sum(axis=0)
+    x = np.where(valid, days[:, None], 0.0)
+    y = np.where(valid, values, 0.0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        x_mean = x.sum(axis=0) / n
+        y_mean = y.sum(axis=0) / n
+        dx = np.where(valid, x - x_mean, 0.0)
+        slope = (dx * np.where(valid, y - y_mean, 0.0)).sum(axis=0) / (dx**2).sum(axis=0) * DAYS_PER_YEAR
+    first_idx = valid.argmax(axis=0)
+    last_idx = len(values) - 1 - valid[::-1].argmax(axis=0)
+    cols = np.arange(values.shape[1])
+    first = values[first_idx, cols]
+    last = values[last_idx, cols]
+
+    def num(v):
+        return round(float(v), 4) if np.isfinite(v) else None
+
+    return {
+        m: {
+            "n": int(n[k]),
+            "first": num(first[k]) if n[k] else None,
+            "last": num(last[k]) if n[k] else None,
+            "change": num(last[k] - first[k]) if n[k] > 1 else None,
+            "slope_per_year": num(slope[k]) if n[k] > 1 else None,
+        }
+        for k, m in enumerate(METRICS)
+    }
+
+
+def patient_analytics(rows, patient_id: int) -> dict:
+    exams = [
+        {
+            "exam_id": r.id,
+            "exam_date": r.exam_date,
+            "curve_mode": r.curve_mode,
+            "pregnant_mode": bool(r.pregnant_mode),
+            **{m: getattr(r, m) for m in METRICS},
+        }
+        for r in rows
+    ]
+    values = np.array([[np.nan if e[m] is None else e[m] for m in METRICS] for e in exams], dtype=float)
+    values = values.reshape(len(exams), len(METRICS))
+    days = np.array([e["exam_date"].toordinal() for e in exams], dtype=float)
+    return {"patient_id": patient_id, "exams": exams, "trend": trend(days, values)}
+
+
+def backfill_metrics(conn: Connection) -> None:
+    """Migrazione: calcola gli indici per gli esami già presenti, a blocchi."""
+    exams = models.Exam.__table__
+    points = models.ExamPoint.__table__
+    stmt = update(exams).where(exams.c.id == bindparam("_id")).values({m: bindparam(f"_{m}") for m in METRICS})
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            select(exams.c.id, exams.c.curve_mode, exams.c.glyc_unit, exams.c.ins_unit)
+            .where(exams.c.id > last_id)
+            .order_by(exams.c.id)
+            .limit(CHUNK_SIZE)
+        ).all()
+        if not rows:
+            break
+        by_exam: dict[int, List] = {r.id: [] for r in rows}
+        for p in conn.execute(select(points).where(points.c.exam_id.in_(list(by_exam)))):
+            by_exam[p.exam_id].append(p)
+        datas = [
+            {**points_to_series(by_exam[r.id]), "curve_mode": r.curve_mode, "glyc_unit": r.glyc_unit, "ins_unit": r.ins_unit}
+            for r in rows
+        ]
+        params = [{"_id": r.id, **{f"_{k}": v for k, v in m.items()}} for r, m in zip(rows, compute_metrics(datas))]
+        conn.execute(stmt, params)
+        last_id = rows[-1].id
@@ -0,0 +1,312 @@
+from __future__ import annotations
+
+from itertools import chain, repeat
+from typing import Any, Dict, List, Sequence
+
+import numpy as np
+
+from ..instrumentation import timed
+from .interpretation import _TIME_KEYS, _bound, _to_float
+from .interpretation_rules import DEFAULT_PLAN, LEVELS, RulePlan
+
+
+# Stato per punto come indice in _STATUS; severità come interi (indici in LEVELS):
+# l'esito complessivo è il massimo dei contributi.
+_STATUS = np.array(["normal", "low", "high", "missing"], dtype=object)
+_NUMBER_TYPES = {float, int}
+# Range dei tempi senza riferimento (solo lettura): estremi (0, 0) come nella funzione scalare
+_NO_REF = {"min": 0, "max": 0}
+
+# Esiti come indici nelle tabelle del piano (0 = nessuna valutazione):
+# glicemia 1..len(bands) fasce, poi gravidanza negativa e positiva; insulina ok, ritardato, ritorno lento
+_INS_NONE, _INS_OK, _INS_DELAYED, _INS_SLOW = range(4)
+
+
+def _gly_outcomes(plan: RulePlan) -> tuple:
+    return (None, *plan.bands, plan.preg_negative, plan.preg_positive)
+
+
+def _ins_outcomes(plan: RulePlan) -> tuple:
+    return (None, plan.ins_ok, plan.ins_delayed, plan.ins_slow_return)
+
+
+def _levels(outcomes: tuple) -> np.ndarray:
+    return np.array([o.level if o is not None else 0 for o in outcomes], dtype=np.int8)
+
+
+def _floats(raw: list, kinds: set) -> tuple[np.ndarray, np.ndarray]:
+    """Valori convertiti come _to_float (non numerico => NaN) e maschera dei numerici; kinds: tipi in raw."""
+    if kinds <= _NUMBER_TYPES | {type(None)}:
+        # Payload validati: conversione in blocco (None => NaN); solo i NaN vanno distinti
+        values = np.array(raw, dtype=np.float64)
+        numeric = ~np.isnan(values)
+        for i in np.flatnonzero(~numeric).tolist():
+            numeric[i] = raw[i] is not None
+        return values, numeric
+    converted = [_to_float(v) for v in raw]
+    numeric = np.array([v is not None for v in converted], dtype=bool)
+    return np.array([np.nan if v is None else v for v in converted], dtype=np.float64), numeric
+
+
+def _bounds(refs: list, key: str) -> np.ndarray:
+    """Estremo key dei range per punto come _bound (assente o non numerico => 0)."""
+    try:
+        out = np.fromiter(map(dict.get, refs, repeat(key)), dtype=np.float64, count=len(refs))
+    except (TypeError, ValueError):
+        # Range che non sono dizionari o estremi non convertibili in blocco: uno alla volta
+        return np.array([_bound(ref.get(key)) if isinstance(ref, dict) else 0.0 for ref in refs], dtype=np.float64)
+    # La conversione in blocco rende None come NaN: per quei punti decide _bound
+    for i in np.flatnonzero(np.isnan(out)).tolist():
+        out[i] = _bound(refs[i].get(key))
+    return out
+
+
+class _Series:
+    """
+    Serie di N esami impacchettate in matrici (N, W) con padding: tempi, valori e range.
+    Stato per punto e severità per esame sono calcolati sulle matrici; in Python restano
+    la ricerca dei range e la costruzione delle righe.
+    """
+
+    def __init__(self, times_list: List[list], values_list: List[list], refs_list: List[dict]):
+        n = len(times_list)
+        self.times_list = times_list
+        self.n_times = np.fromiter(map(len, times_list), dtype=np.int64, count=n)
+        self.n_values = np.fromiter(map(len, values_list), dtype=np.int64, count=n)
+        width = max(int(self.n_times.max(initial=0)), int(self.n_values.max(initial=0)), 1)
+
+        # Range per tempo come nella funzione scalare: chiave stringa o intera, assente => (0, 0)
+        time_keys = _TIME_KEYS
+        flat_refs = [
+            refs.get((time_keys.get(t) if type(t) is int else None) or str(t)) or refs.get(t) or _NO_REF
+            for times, refs in zip(times_list, refs_list)
+            for t in times
+        ]
+        n_points = len(flat_refs)
+
+        # Riempimento in blocco dalle liste appiattite (maschere in ordine di riga)
+        cols = np.arange(width)
+        self.time_valid = cols[None, :] < self.n_times[:, None]
+        value_valid = cols[None, :] < self.n_values[:, None]
+        raw_values = list(chain.from_iterable(values_list))
+        kinds = set(map(type, raw_values))
+        flat_values, flat_numeric = _floats(raw_values, kinds)
+        self.times = np.zeros((n, width), dtype=np.int64)
+        self.times[self.time_valid] = np.fromiter(chain.from_iterable(times_list), dtype=np.int64, count=n_points)
+        self.values = np.zeros((n, width), dtype=np.float64)
+        self.values[value_valid] = flat_values
+        self.numeric = np.zeros((n, width), dtype=bool)
+        self.numeric[value_valid] = flat_numeric
+        # Per punto (in ordine di riga, un elemento per tempo): range ed esame di appartenenza
+        self.rmin = _bounds(flat_refs, "min")
+        self.rmax = _bounds(flat_refs, "max")
+        # Valori già float (o None) con un valore per tempo: nelle righe vanno gli oggetti del
+        # payload, come nella funzione scalare, senza riconvertirli dall'array
+        aligned = kinds <= {float, type(None)} and bool((self.n_values == self.n_times).all())
+        self.row_values = raw_values if aligned else None
+        self.owner = np.repeat(np.arange(n), self.n_times)
+        self.rows = np.arange(n)
+
+    def status(self) -> tuple[np.ndarray, np.ndarray]:
+        """Codici stato per punto (indici in _STATUS) e severità per esame (indici in LEVELS)."""
+        values = self.values[self.time_valid]
+        numeric = self.numeric[self.time_valid]
+        with np.errstate(invalid="ignore"):
+            low = numeric & (values < self.rmin)
+            high = numeric & ~low & (values > self.rmax)
+        codes = np.zeros(len(values), dtype=np.int8)
+        codes[low] = 1
+        codes[high] = 2
+        codes[~numeric] = 3
+        n = len(self.rows)
+        any_low = np.bincount(self.owner[low], minlength=n) > 0
+        any_high = np.bincount(self.owner[high], minlength=n) > 0
+        severity = np.where(any_high, 2, np.where(any_low, 1, 0)).astype(np.int8)
+        return codes, severity
+
+    def row_lists(self, codes: np.ndarray) -> List[List[Dict[str, Any]]]:
+        """Righe (tempo, valore, range, stato) di ogni esame, dagli array per punto."""
+        if self.row_values is not None:
+            values = self.row_values
+        else:
+            values = self.values[self.time_valid].astype(object)
+            values[~self.numeric[self.time_valid]] = None
+            values = values.tolist()
+        rows = [
+            {"time": t, "value": v, "ref": {"min": lo, "max": hi}, "status": status}
+            for t, v, lo, hi, status in zip(
+                chain.from_iterable(self.times_list),
+                values,
+                self.rmin.tolist(),
+                self.rmax.tolist(),
+                _STATUS[codes].tolist(),
+            )
+        ]
+        out: List[List[Dict[str, Any]]] = []
+        start = 0
+        for count in self.n_times.tolist():
+            out.append(rows[start : start + count])
+            start += count
+        return out
+
+    def first_index(self, t: int):
+        """Primo indice del tempo t (come list.index) e presenza del tempo."""
+        mask = self.time_valid & (self.times == t)
+        return mask.argmax(axis=1), mask.any(axis=1)
+
+    def pick(self, t: int):
+        """Valore al tempo t e maschera di disponibilità (tempo presente e valore numerico)."""
+        idx, has = self.first_index(t)
+        return self.values[self.rows, idx], has & self.numeric[self.rows, idx]
+
+
+def _glycemic_codes(gly: _Series, pregnant, plan: RulePlan) -> np.ndarray:
+    v, has = gly.pick(plan.gly_time)
+    positive = np.zeros(len(gly.rows), dtype=bool)
+    for t, threshold in plan.preg_checks:
+        vt, has_t = gly.pick(t)
+        with np.errstate(invalid="ignore"):
+            positive |= has_t & (vt >= threshold)
+
+    n_bands = len(plan.bands)
+    # Prima fascia con valore < below; NaN oltre l'ultimo limite, come nel confronto scalare
+    standard = 1 + np.searchsorted(np.array(plan.band_bounds, dtype=np.float64), v, side="right")
+    preg = np.where(positive, n_bands + 2, n_bands + 1)
+    codes = np.where(pregnant, preg, standard)
+    return np.where(has, codes, 0).astype(np.int8)
+
+
+def _insulin_codes(ins: _Series, active, plan: RulePlan) -> tuple[np.ndarray, np.ndarray]:
+    rows = ins.rows
+    values = ins.values
+    numeric = ins.numeric
+
+    # Picco come max() Python con confronto stretto: vince il primo massimo,
+    # e un NaN in prima posizione numerica non viene mai sostituito.
+    first_numeric = numeric.argmax(axis=1)
+    first_is_nan = np.isnan(values[rows, first_numeric])
+    comparable = numeric & ~np.isnan(values)
+    masked = np.where(comparable, values, -np.inf)
+    peak_val = masked.max(axis=1)
+    best = comparable & (values == peak_val[:, None])
+    peak_idx = np.where(first_is_nan, first_numeric, best.argmax(axis=1))
+
+    has_peak = active & (ins.n_times > 0) & (ins.n_values > 0) & numeric.any(axis=1)
+    has_peak &= ins.time_valid[rows, peak_idx]
+    peak_time = ins.times[rows, peak_idx]
+
+    v0, has_v0 = values[:, 0], numeric[:, 0]
+    idx_ret, has_ret = ins.first_index(plan.ins_return_time)
+    v_ret = values[rows, idx_ret]
+    has_v_ret = has_ret & numeric[rows, idx_ret]
+    limit = v0 * plan.ins_return_ratio
+
+    with np.errstate(invalid="ignore"):
+        ok = (peak_time <= plan.ins_peak_max_time) & (~has_v_ret | ~has_v0 | (v_ret <= limit))
+        delayed = ~ok & (peak_time > plan.ins_peak_max_time)
+        slow = ~ok & ~delayed & has_v_ret & has_v0 & (v_ret > limit)
+
+    codes = np.select([ok, delayed, slow], [_INS_OK, _INS_DELAYED, _INS_SLOW], _INS_NONE)
+    return np.where(has_peak, codes, _INS_NONE).astype(np.int8), peak_idx
+
+
+def _criteria_hits(gly: _Series, ins: _Series, pregnant, plan: RulePlan) -> np.ndarray:
+    """Matrice (N, criteri) dei criteri aggiuntivi soddisfatti."""
+    hits = np.zeros((len(gly.rows), len(plan.criteria)), dtype=bool)
+    for k, c in enumerate(plan.criteria):
+        v, has = (gly if c.series == "glyc" else ins).pick(c.time)
+        with np.errstate(invalid="ignore"):
+            hit = has & c.op(v, c.value)
+        if c.pregnant is not None:
+            hit &= pregnant == c.pregnant
+        hits[:, k] = hit
+    return hits
+
+
+@timed("interpret_exams_batch")
+def interpret_exams_batch(payloads: Sequence[Dict[str, Any]], plan: RulePlan = DEFAULT_PLAN) -> List[Dict[str, Any]]:
+    """
+    Versione vettoriale di interpret_exam su N esami, con lo stesso rule set compilato.
+    Restituisce gli stessi dizionari della funzione scalare, nello stesso ordine.
+    """
+    if not payloads:
+        return []
+
+    include_insulin = [
+        bool(p.get("include_insulin")) or p.get("curve_mode") == "combined" for p in payloads
+    ]
+
+    gly = _Series(
+        [p.get("glyc_times", []) or [] for p in payloads],
+        [p.get("glyc_values", []) or [] for p in payloads],
+        [p.get("glyc_refs", {}) or {} for p in payloads],
+    )
+    ins = _Series(
+        [(p.get("ins_times", []) or []) if inc else [] for p, inc in zip(payloads, include_insulin)],
+        [(p.get("ins_values", []) or []) if inc else [] for p, inc in zip(payloads, include_insulin)],
+        [(p.get("ins_refs", {}) or {}) if inc else {} for p, inc in zip(payloads, include_insulin)],
+    )
+    active = np.array(include_insulin, dtype=bool)
+    pregnant = np.array([bool(p.get("pregnant_mode", False)) for p in payloads], dtype=bool)
+
+    gly_outcomes = _gly_outcomes(plan)
+    ins_outcomes = _ins_outcomes(plan)
+    gly_status, gly_sev = gly.status()
+    ins_status, ins_sev = ins.status()
+    gly_codes = _glycemic_codes(gly, pregnant, plan)
+    ins_codes, peak_idx = _insulin_codes(ins, active, plan)
+    hits = _criteria_hits(gly, ins, pregnant, plan)
+    criteria_levels = np.array([c.level for c in plan.criteria], dtype=np.int8)
+
+    overall = np.maximum.reduce(
+        [
+            gly_sev,
+            ins_sev,
+            _levels(gly_outcomes)[gly_codes],
+            _levels(ins_outcomes)[ins_codes],
+            np.where(hits, criteria_levels, 0).max(axis=1, initial=0).astype(np.int8),
+        ]
+    )
+
+    # Da qui in poi un esame alla volta, su liste Python (non scalari numpy), con i testi di
+    # ogni esito risolti una volta per codice: esito complessivo, glicemia, insulina
+    level_texts = [(status, plan.summaries[level]) for level, status in enumerate(LEVELS)]
+    gly_texts = [(None, None, None)] + [
+        (o.message, o.code, o.code == "gdm" if o.code in ("gdm", "iadpsg_ok") else None) for o in gly_outcomes[1:]
+    ]
+    ins_texts = [(None, None)] + [(o.code, o.message) for o in ins_outcomes[1:]]
+    ins_results = [ins_texts[code] for code in ins_codes.tolist()]
+    # Picco ritardato: il messaggio cita il tempo del picco
+    delayed = np.flatnonzero(ins_codes == _INS_DELAYED)
+    for i, peak in zip(delayed.tolist(), peak_idx[delayed].tolist()):
+        pattern, message = ins_results[i]
+        ins_results[i] = (pattern, message.format(peak_time=ins.times_list[i][peak]))
+
+    out = [
+        {
+            "overall_status": overall_status,
+            "summary": summary,
+            "glycemic_class": gly_class,
+            "insulin_pattern": ins_pattern,
+            "gdm": gdm,
+            "details": {
+                "glycemic_rows": glycemic_rows,
+                "insulin_rows": insulin_rows,
+                "glycemic_interpretation": gly_message,
+                "insulin_interpretation": ins_diag,
+            },
+        }
+        for (overall_status, summary), (gly_message, gly_class, gdm), (ins_pattern, ins_diag), glycemic_rows, insulin_rows in zip(
+            map(level_texts.__getitem__, overall.tolist()),
+            map(gly_texts.__getitem__, gly_codes.tolist()),
+            ins_results,
+            gly.row_lists(gly_status),
+            ins.row_lists(ins_status),
+        )
+    ]
+    if plan.criteria:
+        for result, row_hits in zip(out, hits.tolist()):
+            result["details"]["criteria"] = [
+                {"code": c.code, "message": c.message} for c, hit in zip(plan.criteria, row_hits) if hit
+            ]
+    return out
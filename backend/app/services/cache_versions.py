@@ -0,0 +1,114 @@
+"""
+Cache in-process coerenti tra più processi (worker uvicorn): invalidazione tramite il DB.
+
+Ogni cache ha una riga in cache_versions. Una scrittura ORM sui modelli di una cache
+incrementa la versione nella stessa transazione (after_flush) e, dopo il commit, svuota
+subito la cache del processo che ha scritto. Gli altri processi confrontano la versione
+del valore in cache con quella del DB al massimo ogni CACHE_CHECK_INTERVAL_MS (0 = a ogni
+lettura): una modifica arriva a tutti i worker entro quell'intervallo, al costo di una
+lettura per chiave primaria per intervallo.
+
+Le scritture Core (update()/insert() fuori dall'ORM) sui modelli di una cache devono
+chiamare bump() nella propria transazione.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from typing import Callable, Dict, Generic, TypeVar
+
+from sqlalchemy import event, insert, select, update
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from .. import models
+from ..config import settings
+
+
+T = TypeVar("T")
+
+REFERENCE_PROFILE = "reference_profile"
+REPORT_SETTINGS = "report_settings"
+NAMES = (REFERENCE_PROFILE, REPORT_SETTINGS)
+
+_tracked: Dict[type, "VersionedCache"] = {}
+
+
+def current_version(db: Session | Connection, name: str) -> int:
+    table = models.CacheVersion.__table__
+    return db.execute(select(table.c.version).where(table.c.name == name)).scalar() or 0
+
+
+def bump(db: Session | Connection, name: str) -> None:
+    """Nuova versione di `name`: i processi ricostruiscono il valore alla prossima verifica."""
+    table = models.CacheVersion.__table__
+    if db.execute(update(table).where(table.c.name == name).values(version=table.c.version + 1)).rowcount == 0:
+        db.execute(insert(table).values(name=name, version=1))
+
+
+class VersionedCache(Generic[T]):
+    """Valore costruito da build(db), ricostruito quando cambia la versione `name` nel DB."""
+
+    def __init__(self, name: str, build: Callable[[Session], T], *tracked_models: type) -> None:
+        self.name = name
+        self._build = build
+        self._lock = threading.RLock()
+        self._value: T | None = None
+        self._version = -1
+        self._checked = 0.0
+        for model in tracked_models:
+            _tracked[model] = self
+
+    def get(self, db: Session) -> T:
+        interval = settings.cache_check_interval_ms / 1000
+        value = self._value
+        if value is not None and time.monotonic() - self._checked < interval:
+            return value
+        with self._lock:
+            now = time.monotonic()
+            if self._value is not None and now - self._checked < interval:
+                return self._value
+            # Versione letta prima dei dati: una scrittura nel mezzo costa al più una ricostruzione in più
+            version = current_version(db, self.name)
+            if self._value is None or version != self._version:
+                self._value = self._build(db)
+                self._version = version
+            self._checked = now
+            return self._value
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._value = None
+
+
+@event.listens_for(Session, "after_flush")
+def _bump_on_write(session, flush_context):
+    # In after_flush new/dirty/deleted mostrano ancora lo stato prima del flush
+    caches = {_tracked[type(o)] for o in (*session.new, *session.dirty, *session.deleted) if type(o) in _tracked}
+    if not caches:
+        return
+    pending = session.info.setdefault("cache_versions_changed", set())
+    conn = session.connection()
+    for cache in caches - pending:
+        bump(conn, cache.name)  # una volta per transazione
+    pending |= caches
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_on_commit(session):
+    for cache in session.info.pop("cache_versions_changed", ()):
+        cache.invalidate()
+
+
+@event.listens_for(Session, "after_rollback")
+def _reset_on_rollback(session):
+    session.info.pop("cache_versions_changed", None)
+
+
+def install(conn: Connection) -> None:
+    """Migrazione: una riga per cache, così bump() è sempre un UPDATE anche con più processi."""
+    table = models.CacheVersion.__table__
+    existing = set(conn.execute(select(table.c.name)).scalars())
+    missing = [{"name": name, "version": 0} for name in NAMES if name not in existing]
+    if missing:
+        conn.execute(insert(table), missing)
@@ -0,0 +1,207 @@
+"""
+Statistiche di coorte sull'archivio esami, calcolate interamente in SQL.
+
+Raggruppamento per qualsiasi combinazione di GROUP_FIELDS (bucket = periodo di
+exam_date: giorno, settimana, mese, trimestre, anno). Per ogni gruppo:
+- conteggio esami, esiti per overall_status e quota di esiti alterati, dalle tabelle
+  riassuntive (services/rollups.py: mensile se bucket e filtri di data lo permettono);
+- per ogni serie e tempo di prelievo: numero di valori, media e percentili
+  (nearest-rank, con row_number/count in finestra: stessa query su SQLite e PostgreSQL).
+"""
+from __future__ import annotations
+
+from datetime import date, timedelta
+from typing import List, Sequence
+
+from sqlalchemy import Integer, String, case, cast, func, select
+
+from .. import models
+from .rollups import DAILY, MONTHLY
+
+
+GROUP_FIELDS = ("bucket", "requester_doctor", "curve_mode", "pregnant_mode", "overall_status")
+BUCKETS = ("day", "week", "month", "quarter", "year")
+STATUSES = ("normal", "warning", "danger")
+DEFAULT_PERCENTILES = (25, 50, 75, 90)
+
+_PG_BUCKET = {"day": "YYYY-MM-DD", "week": 'IYYY-"W"IW', "month": "YYYY-MM", "quarter": 'YYYY-"Q"Q', "year": "YYYY"}
+_SQLITE_BUCKET = {"day": "%Y-%m-%d", "month": "%Y-%m", "year": "%Y"}
+
+
+def _sqlite_iso_week(d):
+    """Settimana ISO 8601 come IYYY-"W"IW di PostgreSQL: anno e numero dal giovedì della stessa settimana."""
+    thursday = func.date(d, "-3 days", "weekday 4")
+    week = (cast(func.strftime("%j", thursday), Integer) - 1) // 7 + 1
+    return func.strftime("%Y", thursday, type_=String) + "-W" + func.printf("%02d", week, type_=String)
+
+
+def bucket_expr(dialect: str, bucket: str, d=models.Exam.exam_date):
+    if dialect == "postgresql":
+        return func.to_char(d, _PG_BUCKET[bucket])
+    if bucket == "week":
+        return _sqlite_iso_week(d)
+    if bucket == "quarter":
+        quarter = (cast(func.strftime("%m", d), Integer) + 2) // 3
+        return func.strftime("%Y", d, type_=String) + "-Q" + cast(quarter, String)
+    return func.strftime(_SQLITE_BUCKET[bucket], d, type_=String)
+
+
+def _exam_columns() -> dict:
+    E = models.Exam
+    return {
+        "date": E.exam_date,
+        "requester_doctor": E.requester_doctor,
+        "curve_mode": E.curve_mode,
+        "pregnant_mode": E.pregnant_mode,
+        "overall_status": E.overall_status,
+    }
+
+
+def _rollup_columns(table) -> dict:
+    # Nelle tabelle riassuntive il valore assente è '': torna NULL come negli esami
+    return {
+        "date": table.c.month if table is MONTHLY else table.c.day,
+        "requester_doctor": func.nullif(table.c.requester_doctor, ""),
+        "curve_mode": table.c.curve_mode,
+        "pregnant_mode": table.c.pregnant_mode,
+        "overall_status": func.nullif(table.c.overall_status, ""),
+    }
+
+
+def _key_exprs(dialect: str, group_by: Sequence[str], bucket: str, cols: dict) -> dict:
+    return {name: bucket_expr(dialect, bucket, cols["date"]) if name == "bucket" else cols[name] for name in group_by}
+
+
+def _filters(cols: dict, date_from, date_to, curve_mode, pregnant_mode, requester_doctor, status) -> list:
+    out = []
+    if date_from:
+        out.append(cols["date"] >= date_from)
+    if date_to:
+        out.append(cols["date"] <= date_to)
+    if curve_mode:
+        out.append(cols["curve_mode"] == curve_mode)
+    if pregnant_mode is not None:
+        out.append(cols["pregnant_mode"] == (1 if pregnant_mode else 0))
+    if requester_doctor:
+        out.append(cols["requester_doctor"] == requester_doctor)
+    if status:
+        out.append(cols["overall_status"] == status)
+    return out
+
+
+def rollup_table(group_by: Sequence[str], bucket: str, date_from: date | None, date_to: date | None):
+    """Tabella mensile se né i gruppi né i filtri di data scendono sotto il mese, altrimenti giornaliera."""
+    by_month = "bucket" not in group_by or bucket in ("month", "quarter", "year")
+    aligned = (date_from is None or date_from.day == 1) and (date_to is None or (date_to + timedelta(days=1)).day == 1)
+    return MONTHLY if by_month and aligned else DAILY
+
+
+def counts_stmt(dialect: str, group_by: Sequence[str], bucket: str, table, filters: dict):
+    """Conteggi per gruppo ed esito, sommando le righe della tabella riassuntiva (DAILY o MONTHLY)."""
+    cols = _rollup_columns(table)
+    keys = _key_exprs(dialect, group_by, bucket, cols)
+    return (
+        select(
+            *(expr.label(name) for name, expr in keys.items()),
+            func.coalesce(func.sum(table.c.exam_count), 0).label("count"),
+            *(func.sum(case((table.c.overall_status == s, table.c.exam_count), else_=0)).label(s) for s in STATUSES),
+        )
+        .where(*_filters(cols, **filters))
+        .group_by(*keys.values())
+        .order_by(*keys.values())
+    )
+
+
+def points_stmt(dialect: str, group_by: Sequence[str], bucket: str, filters: dict, percentiles: Sequence[int], series: str | None):
+    E, P = models.Exam, models.ExamPoint
+    cols = _exam_columns()
+    keys = _key_exprs(dialect, group_by, bucket, cols)
+    partition = [*keys.values(), P.series, P.time_min]
+    ranked = (
+        select(
+            *(expr.label(name) for name, expr in keys.items()),
+            P.series,
+            P.time_min,
+            P.value,
+            func.row_number().over(partition_by=partition, order_by=P.value).label("rn"),
+            func.count().over(partition_by=partition).label("cnt"),
+        )
+        .join_from(E, P, P.exam_id == E.id)
+        .where(P.position.is_not(None), P.value.is_not(None), *_filters(cols, **filters))
+    )
+    if series:
+        ranked = ranked.where(P.series == series)
+    r = ranked.subquery()
+    cols = [r.c[name] for name in keys] + [r.c.series, r.c.time_min]
+    return (
+        select(
+            *cols,
+            func.count().label("n"),
+            func.avg(r.c.value).label("mean"),
+            # Percentile nearest-rank: il valore più piccolo con rango >= p% di n
+            *(func.min(case((r.c.rn * 100 >= p * r.c.cnt, r.c.value))).label(f"p{p}") for p in percentiles),
+        )
+        .group_by(*cols)
+        .order_by(*cols)
+    )
+
+
+def _key(row, group_by: Sequence[str]) -> tuple:
+    return tuple(bool(row[k]) if k == "pregnant_mode" else row[k] for k in group_by)
+
+
+def build_groups(count_rows, point_rows, group_by: Sequence[str], percentiles: Sequence[int]) -> List[dict]:
+    groups = {}
+    for row in count_rows:
+        key = _key(row, group_by)
+        by_status = {s: int(row[s] or 0) for s in STATUSES}
+        total = int(row["count"])
+        groups[key] = {
+            "key": dict(zip(group_by, key)),
+            "count": total,
+            "by_status": by_status,
+            "abnormal_rate": round((by_status["warning"] + by_status["danger"]) / total, 4) if total else None,
+            "points": [],
+        }
+    for row in point_rows:
+        group = groups.get(_key(row, group_by))
+        if group is None:
+            continue
+        group["points"].append(
+            {
+                "series": row["series"],
+                "time_min": row["time_min"],
+                "n": int(row["n"]),
+                "mean": round(float(row["mean"]), 3),
+                "percentiles": {f"p{p}": row[f"p{p}"] for p in percentiles},
+            }
+        )
+    return list(groups.values())
+
+
+def cohort_query(
+    dialect: str,
+    group_by: Sequence[str],
+    bucket: str = "month",
+    percentiles: Sequence[int] = DEFAULT_PERCENTILES,
+    series: str | None = None,
+    date_from: date | None = None,
+    date_to: date | None = None,
+    curve_mode: str | None = None,
+    pregnant_mode: bool | None = None,
+    requester_doctor: str | None = None,
+    status: str | None = None,
+):
+    """Le due query (conteggi, valori per tempo) per gli stessi gruppi e filtri."""
+    filters = {
+        "date_from": date_from,
+        "date_to": date_to,
+        "curve_mode": curve_mode,
+        "pregnant_mode": pregnant_mode,
+        "requester_doctor": requester_doctor,
+        "status": status,
+    }
+    return (
+        counts_stmt(dialect, group_by, bucket, rollup_table(group_by, bucket, date_from, date_to), filters),
+        points_stmt(dialect, group_by, bucket, filters, percentiles, series),
+    )
@@ -0,0 +1,113 @@
+"""
+Indici della curva da carico, calcolati in modo vettoriale su N esami alla volta.
+
+- AUC trapezoidale e AUC incrementale (sopra il basale a 0', metodo di Wolever:
+  l'area sotto il basale non conta, gli attraversamenti sono interpolati)
+  per glicemia e insulina;
+- indice di Matsuda: 10000 / sqrt(G0 * I0 * Gmedia * Imedia), medie sui prelievi fino a 120';
+- HOMA-IR: G0 * I0 / 405;
+- indice insulinogenico: (I30 - I0) / (G30 - G0).
+
+Valori convertiti in mg/dL e µU/mL prima del calcolo (le AUC sono in unità * minuti),
+così gli indici sono confrontabili tra esami con unità diverse. Un indice non
+calcolabile (prelievi mancanti, divisione per zero) è None.
+"""
+from __future__ import annotations
+
+from typing import Any, Dict, List, Sequence
+
+import numpy as np
+
+from .interpretation import _to_float
+
+
+METRICS = ("glyc_auc", "glyc_iauc", "ins_auc", "ins_iauc", "matsuda_index", "homa_ir", "insulinogenic_index")
+
+GLYC_TO_MG_DL = {"mg/dL": 1.0, "mmol/L": 18.016}
+INS_TO_UU_ML = {"µUI/mL": 1.0, "µU/mL": 1.0, "mU/L": 1.0, "pmol/L": 1 / 6.0}
+MATSUDA_MAX_TIME = 120
+
+
+class _Curves:
+    """Serie di N esami in matrici (N, W): tempi crescenti, solo prelievi con valore numerico in testa."""
+
+    def __init__(self, times_list: List[list], values_list: List[list], factors: Sequence[float]):
+        n = len(times_list)
+        width = max([len(t) for t in times_list] or [0]) or 1
+        times = np.full((n, width), np.inf)
+        values = np.full((n, width), np.nan)
+        for i, (ts, vs) in enumerate(zip(times_list, values_list)):
+            for j, t in enumerate(ts):
+                v = _to_float(vs[j]) if j < len(vs) else None
+                if v is not None:
+                    times[i, j] = float(t)
+                    values[i, j] = v * factors[i]
+        order = np.argsort(times, axis=1, kind="stable")
+        self.times = np.take_along_axis(times, order, axis=1)
+        self.values = np.take_along_axis(values, order, axis=1)
+        self.valid = np.isfinite(self.times) & ~np.isnan(self.values)
+
+    def at(self, t: int) -> np.ndarray:
+        """Valore al tempo t (NaN se non prelevato)."""
+        hit = self.valid & (self.times == t)
+        idx = hit.argmax(axis=1)
+        return np.where(hit.any(axis=1), self.values[np.arange(len(idx)), idx], np.nan)
+
+    def auc(self) -> tuple[np.ndarray, np.ndarray]:
+        """AUC totale e incrementale sopra il basale (valore a 0'); NaN con meno di due punti."""
+        seg = self.valid[:, :-1] & self.valid[:, 1:]
+        dt = np.where(seg, np.diff(np.where(self.valid, self.times, 0), axis=1), 0.0)
+        y0, y1 = self.values[:, :-1], self.values[:, 1:]
+        total = np.where(seg, (y0 + y1) / 2 * dt, 0.0).sum(axis=1)
+
+        base = self.at(0)[:, None]
+        d0, d1 = y0 - base, y1 - base
+        with np.errstate(invalid="ignore", divide="ignore"):
+            both = (d0 + d1) / 2 * dt
+            # Segmento che attraversa il basale: solo il triangolo sopra
+            cross = np.maximum(d0, d1) ** 2 / (np.abs(d0) + np.abs(d1)) * dt / 2
+            part = np.where((d0 >= 0) & (d1 >= 0), both, np.where((d0 > 0) | (d1 > 0), cross, 0.0))
+        incremental = np.where(seg, np.nan_to_num(part), 0.0).sum(axis=1)
+
+        enough = seg.any(axis=1)
+        total = np.where(enough, total, np.nan)
+        incremental = np.where(enough & ~np.isnan(base[:, 0]), incremental, np.nan)
+        return total, incremental
+
+    def mean_until(self, t_max: int) -> np.ndarray:
+        mask = self.valid & (self.times <= t_max)
+        count = mask.sum(axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(count > 0, np.where(mask, self.values, 0.0).sum(axis=1) / count, np.nan)
+
+
+def _clean(x: np.ndarray) -> List[float | None]:
+    return [round(float(v), 4) if np.isfinite(v) else None for v in x]
+
+
+def compute_metrics(payloads: Sequence[Dict[str, Any]]) -> List[Dict[str, float | None]]:
+    """Indici METRICS per ogni payload esame (times/values per serie, unità, curve_mode)."""
+    if not payloads:
+        return []
+    with_ins = [p.get("curve_mode") in ("ins", "combined") for p in payloads]
+    gly = _Curves(
+        [p.get("glyc_times") or [] for p in payloads],
+        [p.get("glyc_values") or [] for p in payloads],
+        [GLYC_TO_MG_DL.get(p.get("glyc_unit") or "mg/dL", 1.0) for p in payloads],
+    )
+    ins = _Curves(
+        [(p.get("ins_times") or []) if w else [] for p, w in zip(payloads, with_ins)],
+        [(p.get("ins_values") or []) if w else [] for p, w in zip(payloads, with_ins)],
+        [INS_TO_UU_ML.get(p.get("ins_unit") or "µUI/mL", 1.0) for p in payloads],
+    )
+
+    glyc_auc, glyc_iauc = gly.auc()
+    ins_auc, ins_iauc = ins.auc()
+    g0, i0, g30, i30 = gly.at(0), ins.at(0), gly.at(30), ins.at(30)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        matsuda = 10000 / np.sqrt(g0 * i0 * gly.mean_until(MATSUDA_MAX_TIME) * ins.mean_until(MATSUDA_MAX_TIME))
+        homa = g0 * i0 / 405
+        insulinogenic = (i30 - i0) / (g30 - g0)
+
+    columns = [_clean(c) for c in (glyc_auc, glyc_iauc, ins_auc, ins_iauc, matsuda, homa, insulinogenic)]
+    return [dict(zip(METRICS, row)) for row in zip(*columns)]
@@ -0,0 +1,164 @@
+"""
+Export massivo degli esami in streaming, un record per punto della curva.
+
+Gli esami sono letti con cursore lato server (yield_per) a blocchi di EXPORT_BATCH;
+per ogni blocco i punti sono caricati con una sola query. La memoria resta
+costante a prescindere dalla dimensione dell'archivio.
+
+Formati:
+- ndjson: un oggetto JSON per punto
+- csv: intestazione EXPORT_COLUMNS, una riga per punto
+- arrow: Arrow IPC stream (un record batch per blocco), leggibile da pandas con
+  pyarrow.ipc.open_stream(...).read_pandas(); richiede pyarrow (opzionale)
+"""
+from __future__ import annotations
+
+import csv
+import io
+import json
+from datetime import date
+from typing import Iterator, List
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from .. import models
+from ..database import ReadSessionLocal
+
+
+EXPORT_BATCH = 500
+FORMATS = ("ndjson", "csv", "arrow")
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+EXPORT_COLUMNS = (
+    "exam_id",
+    "patient_id",
+    "exam_date",
+    "curve_mode",
+    "pregnant_mode",
+    "overall_status",
+    "series",
+    "time_min",
+    "value",
+    "ref_min",
+    "ref_max",
+)
+
+
+def arrow_available() -> bool:
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def iter_point_batches(
+    db: Session,
+    date_from: date | None = None,
+    date_to: date | None = None,
+    curve_mode: str | None = None,
+    status: str | None = None,
+) -> Iterator[List[tuple]]:
+    """Blocchi di tuple EXPORT_COLUMNS, ordinati per esame, serie e posizione del prelievo."""
+    E, P = models.Exam, models.ExamPoint
+    stmt = select(E.id, E.patient_id, E.exam_date, E.curve_mode, E.pregnant_mode, E.overall_status)
+    if date_from:
+        stmt = stmt.where(E.exam_date >= date_from)
+    if date_to:
+        stmt = stmt.where(E.exam_date <= date_to)
+    if curve_mode:
+        stmt = stmt.where(E.curve_mode == curve_mode)
+    if status:
+        stmt = stmt.where(E.overall_status == status)
+    stmt = stmt.order_by(E.id).execution_options(yield_per=EXPORT_BATCH)
+
+    for part in db.execute(stmt).partitions():
+        exams = {}
+        for row in part:
+            exams[row.id] = (
+                row.id, row.patient_id, row.exam_date, row.curve_mode, bool(row.pregnant_mode), row.overall_status
+            )
+        if not exams:
+            continue
+        points = db.execute(
+            select(P.exam_id, P.series, P.time_min, P.value, P.ref_min, P.ref_max)
+            .where(P.exam_id.in_(list(exams)), P.position.is_not(None))
+            .order_by(P.exam_id, P.series, P.position)
+        )
+        rows = [exams[p.exam_id] + (p.series, p.time_min, p.value, p.ref_min, p.ref_max) for p in points]
+        if rows:
+            yield rows
+
+
+def _ndjson(batches) -> Iterator[bytes]:
+    for batch in batches:
+        lines = []
+        for rec in batch:
+            item = dict(zip(EXPORT_COLUMNS, rec))
+            item["exam_date"] = item["exam_date"].isoformat()
+            lines.append(json.dumps(item, ensure_ascii=False))
+        yield ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def _csv(batches) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(EXPORT_COLUMNS)
+    yield buffer.getvalue().encode("utf-8")
+    for batch in batches:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(batch)
+        yield buffer.getvalue().encode("utf-8")
+
+
+def _arrow(batches) -> Iterator[bytes]:
+    import pyarrow as pa
+
+    schema = pa.schema(
+        [
+            ("exam_id", pa.int64()),
+            ("patient_id", pa.int64()),
+            ("exam_date", pa.date32()),
+            ("curve_mode", pa.dictionary(pa.int8(), pa.string())),
+            ("pregnant_mode", pa.bool_()),
+            ("overall_status", pa.dictionary(pa.int8(), pa.string())),
+            ("series", pa.dictionary(pa.int8(), pa.string())),
+            ("time_min", pa.int32()),
+            ("value", pa.float64()),
+            ("ref_min", pa.float64()),
+            ("ref_max", pa.float64()),
+        ]
+    )
+    sink = io.BytesIO()
+    writer = pa.ipc.new_stream(sink, schema)
+
+    def drain() -> bytes:
+        data = sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+        return data
+
+    # Lo schema parte subito: il client riceve byte anche prima del primo blocco
+    yield drain()
+    for batch in batches:
+        columns = list(zip(*batch))
+        arrays = [pa.array(col, type=field.type) for col, field in zip(columns, schema)]
+        writer.write_batch(pa.record_batch(arrays, schema=schema))
+        yield drain()
+    writer.close()
+    yield drain()
+
+
+def export_exams(fmt: str, **filters) -> Iterator[bytes]:
+    """
+    Generatore sincrono per StreamingResponse (eseguito nel threadpool).
+    Apre una propria sessione di lettura: vive quanto lo stream, non quanto la richiesta.
+    """
+    encode = {"ndjson": _ndjson, "csv": _csv, "arrow": _arrow}[fmt]
+    with ReadSessionLocal() as db:
+        yield from encode(iter_point_batches(db, **filters))
@@ -0,0 +1,219 @@
+"""
+Import massivo di esami da NDJSON o CSV letto in streaming.
+
+Le righe vengono validate una per una e processate a blocchi: per ogni blocco
+i pazienti sono risolti con due query (id / codice fiscale), l'interpretazione
+è vettoriale (interpret_exams_batch) e gli inserimenti sono executemany in
+un'unica transazione. Gli errori sono riportati per numero di riga.
+
+CSV: una riga per esame, intestazione con i nomi dei campi di ExamImportRow.
+Le colonne *_times / *_values sono liste separate da ";" (es. "0;60;120", "90;;130"
+con il valore a 60' mancante), *_refs sono JSON opzionale; le celle vuote prendono il default.
+"""
+from __future__ import annotations
+
+import csv
+import json
+from typing import AsyncIterator, List, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+from pydantic import ValidationError
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .. import models, schemas
+from ..crud.exams import exam_points, exam_values
+from . import rollups, sync
+from .batch_interpretation import interpret_exams_batch
+from .curve_metrics import compute_metrics
+from .patient_search import fiscal_code_key
+from .reference_profiles import ActiveProfile, apply_default_refs, get_active_snapshot, record_version
+
+
+CHUNK_SIZE = 1000
+FORMATS = ("ndjson", "csv")
+CSV_LIST_COLUMNS = ("glyc_times", "glyc_values", "ins_times", "ins_values")
+CSV_JSON_COLUMNS = ("glyc_refs", "ins_refs")
+
+
+async def iter_lines(stream: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, str]]:
+    """Righe non vuote (numerate da 1) da un body in streaming, senza caricarlo tutto."""
+    buffer = b""
+    line_no = 0
+    async for chunk in stream:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for raw in lines:
+            line_no += 1
+            text = raw.decode("utf-8-sig" if line_no == 1 else "utf-8").strip()
+            if text:
+                yield line_no, text
+    if buffer.strip():
+        yield line_no + 1, buffer.decode("utf-8-sig" if line_no == 0 else "utf-8").strip()
+
+
+def error_text(exc: Exception) -> str:
+    """Messaggio compatto di un errore di validazione (campo: motivo; ...)."""
+    if isinstance(exc, ValidationError):
+        return "; ".join(
+            f"{'.'.join(str(x) for x in err['loc']) or 'riga'}: {err['msg']}" for err in exc.errors()
+        )
+    return str(exc)
+
+
+def _csv_record(header: List[str], line: str) -> dict:
+    cells = next(csv.reader([line]))
+    if len(cells) > len(header):
+        raise ValueError("Più colonne dell'intestazione")
+    record = {}
+    for key, cell in zip(header, cells):
+        cell = cell.strip()
+        if cell == "":
+            continue
+        if key in CSV_LIST_COLUMNS:
+            # Posizioni conservate: "90;;130" = valore mancante a metà (None), non due valori spostati
+            items = [x.strip() for x in cell.replace(",", ".").split(";")]
+            while items and not items[-1]:
+                items.pop()
+            record[key] = [x or None for x in items] if key.endswith("_values") else items
+        elif key in CSV_JSON_COLUMNS:
+            record[key] = json.loads(cell)
+        else:
+            record[key] = cell
+    return record
+
+
+class _Importer:
+    def __init__(self, db: AsyncSession):
+        self.db = db
+        self.imported = 0
+        self.errors: List[dict] = []
+        self.pending: List[Tuple[int, schemas.ExamImportRow]] = []
+        self.snap: ActiveProfile | None = None
+
+    def fail(self, line: int, error: str) -> None:
+        self.errors.append({"line": line, "error": error})
+
+    async def add(self, line: int, record: dict) -> None:
+        try:
+            row = schemas.ExamImportRow.model_validate(record)
+        except ValidationError as exc:
+            self.fail(line, error_text(exc))
+            return
+        self.pending.append((line, row))
+        if len(self.pending) >= CHUNK_SIZE:
+            await self.flush()
+
+    async def _resolve_patients(self) -> Tuple[set, dict, set]:
+        ids = {row.patient_id for _, row in self.pending if row.patient_id is not None}
+        codes = {fiscal_code_key(row.fiscal_code) for _, row in self.pending if row.patient_id is None}
+        codes.discard(None)
+
+        known = set()
+        if ids:
+            known = set((await self.db.scalars(select(models.Patient.id).where(models.Patient.id.in_(ids)))).all())
+
+        by_code: dict = {}
+        ambiguous: set = set()
+        if codes:
+            found = await self.db.execute(
+                select(models.Patient.fiscal_code_key, models.Patient.id).where(
+                    models.Patient.fiscal_code_key.in_(codes)
+                )
+            )
+            for code, pid in found:
+                if code in by_code:
+                    ambiguous.add(code)
+                by_code[code] = pid
+        return known, by_code, ambiguous
+
+    async def flush(self) -> None:
+        if not self.pending:
+            return
+        if self.snap is None:
+            self.snap = await self.db.run_sync(get_active_snapshot)
+
+        known, by_code, ambiguous = await self._resolve_patients()
+        lines: List[int] = []
+        datas: List[dict] = []
+        for line, row in self.pending:
+            data = row.model_dump(exclude={"fiscal_code"})
+            if row.patient_id is not None:
+                if row.patient_id not in known:
+                    self.fail(line, "Paziente non trovato")
+                    continue
+            else:
+                code = fiscal_code_key(row.fiscal_code)
+                if code in ambiguous:
+                    self.fail(line, "Codice fiscale associato a più pazienti")
+                    continue
+                if code not in by_code:
+                    self.fail(line, "Paziente non trovato")
+                    continue
+                data["patient_id"] = by_code[code]
+            lines.append(line)
+            datas.append(apply_default_refs(data, self.snap.payload))
+        self.pending = []
+        if not datas:
+            return
+
+        interpretations = await run_in_threadpool(interpret_exams_batch, datas, self.snap.rules)
+        metrics = await run_in_threadpool(compute_metrics, datas)
+        try:
+            await self.db.run_sync(record_version, self.snap)
+            # Insert Core multi-VALUES (non ORM bulk). Niente sort_by_parameter_order: su SQLite
+            # forzerebbe una INSERT per riga. L'ordine delle righe di RETURNING non è garantito:
+            # l'uid è assegnato qui e gli id sono ricondotti ai parametri tramite l'uid.
+            exams = models.Exam.__table__
+            values = [
+                exam_values(d, interp, self.snap.version, m) for d, interp, m in zip(datas, interpretations, metrics)
+            ]
+            # change_seq prenotati in blocco (nessun before_flush per gli insert Core)
+            seq = await self.db.run_sync(sync.next_seqs, len(values))
+            for i, v in enumerate(values):
+                v["uid"] = models._new_uid()
+                v["change_seq"] = seq + i
+            inserted = await self.db.execute(insert(exams).returning(exams.c.id, exams.c.uid), values)
+            id_by_uid = {uid: exam_id for exam_id, uid in inserted.all()}
+            exam_ids = [id_by_uid[v["uid"]] for v in values]
+            points = []
+            for exam_id, d in zip(exam_ids, datas):
+                for point in exam_points(d):
+                    point["exam_id"] = exam_id
+                    points.append(point)
+            if points:
+                await self.db.execute(insert(models.ExamPoint.__table__), points)
+            await self.db.run_sync(rollups.apply, rollups.changes(added=[rollups.exam_key(v) for v in values]))
+            await self.db.commit()
+        except Exception as exc:
+            await self.db.rollback()
+            for line in lines:
+                self.fail(line, f"Errore database: {exc.__class__.__name__}")
+            return
+        self.imported += len(datas)
+
+    def report(self) -> dict:
+        self.errors.sort(key=lambda e: e["line"])
+        return {"imported": self.imported, "failed": len(self.errors), "errors": self.errors}
+
+
+async def import_exams(db: AsyncSession, stream: AsyncIterator[bytes], fmt: str) -> dict:
+    importer = _Importer(db)
+    header: List[str] | None = None
+    async for line_no, line in iter_lines(stream):
+        try:
+            if fmt == "csv":
+                if header is None:
+                    header = [h.strip() for h in next(csv.reader([line]))]
+                    continue
+                record = _csv_record(header, line)
+            else:
+                record = json.loads(line)
+                if not isinstance(record, dict):
+                    raise ValueError("Atteso un oggetto JSON per riga")
+        except Exception as exc:
+            importer.fail(line_no, f"Riga non leggibile: {error_text(exc)}")
+            continue
+        await importer.add(line_no, record)
+    await importer.flush()
+    return importer.report()
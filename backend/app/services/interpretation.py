@@ -1,8 +1,33 @@
+from bisect import bisect_right
 from typing import Dict, List, Tuple, Any
 
+from ..instrumentation import timed
+from .interpretation_rules import (  # noqa: F401 (testi e codici riesportati)
+    DEFAULT_PLAN,
+    GLY_DIAG_DM,
+    GLY_DIAG_GDM,
+    GLY_DIAG_IADPSG_OK,
+    GLY_DIAG_IGT,
+    GLY_DIAG_NGT,
+    GLYCEMIC_CLASSES,
+    INS_DIAG_DELAYED,
+    INS_DIAG_OK,
+    INS_DIAG_SLOW_RETURN,
+    INSULIN_PATTERNS,
+    LEVELS,
+    SUMMARY_MAP,
+    RulePlan,
+)
+
 
 def _to_float(value: Any) -> float | None:
     """Converte in float gestendo None/stringhe vuote/virgola decimale."""
+    # Payload validati da pydantic (float) e range del profilo (int): nessun parsing
+    kind = type(value)
+    if kind is float:
+        return value
+    if kind is int:
+        return float(value)
     if value is None:
         return None
     if isinstance(value, str):
@@ -19,6 +44,87 @@ def _to_float(value: Any) -> float | None:
         return None
 
 
+# Chiavi dei range (stringhe nel JSON) per i tempi interi usuali, create una volta: la
+# ricerca per tempo non costruisce né ricalcola l'hash di una stringa nuova per ogni punto
+_TIME_KEYS = {t: str(t) for t in range(0, 601)}
+
+
+def _bound(value: Any) -> float:
+    """Estremo di un range; assente o non numerico => 0."""
+    if type(value) is int:  # range di default del profilo
+        return float(value)
+    v = _to_float(value)
+    return v if v is not None else 0.0
+
+
+class ExamSeries:
+    """
+    Una serie (glicemia o insulina) di un esame, convertita e valutata in un solo passaggio:
+    valori come float, righe con range e stato per tempo, severità, indice tempo -> primo
+    prelievo. Le regole leggono i valori per posizione, senza riconvertirli né cercare nelle
+    liste dei tempi.
+    """
+
+    __slots__ = ("times", "values", "index", "rows", "level")
+
+    def __init__(self, times: List[int], values: List[Any], refs: Dict[str, Dict[str, float]]):
+        converted = [v if type(v) is float else _to_float(v) for v in values]
+        n_values = len(converted)
+        get_ref = refs.get
+        time_keys = _TIME_KEYS
+        index: Dict[int, int] = {}
+        rows: List[Dict[str, Any]] = []
+        level = 0
+        for pos, t in enumerate(times):
+            if t not in index:
+                index[t] = pos
+            v = converted[pos] if pos < n_values else None
+            # Range per il tempo (chiave stringa o intera); assente => (0, 0)
+            key = time_keys.get(t) if type(t) is int else None
+            ref = get_ref(key or str(t)) or get_ref(t)
+            if type(ref) is dict:
+                rmin, rmax = ref.get("min"), ref.get("max")
+                kind = type(rmin)
+                if kind is int:
+                    rmin = float(rmin)
+                elif kind is not float:
+                    rmin = _bound(rmin)
+                kind = type(rmax)
+                if kind is int:
+                    rmax = float(rmax)
+                elif kind is not float:
+                    rmax = _bound(rmax)
+            elif isinstance(ref, dict):
+                rmin, rmax = _bound(ref.get("min")), _bound(ref.get("max"))
+            else:
+                rmin = rmax = 0.0
+            if v is None:
+                status = "missing"
+            elif v < rmin:
+                status = "low"
+                if level == 0:
+                    level = 1
+            elif v > rmax:
+                status = "high"
+                level = 2
+            else:
+                status = "normal"
+            rows.append({"time": t, "value": v, "ref": {"min": rmin, "max": rmax}, "status": status})
+        self.times = times
+        self.values = converted
+        self.index = index
+        self.rows = rows
+        self.level = level  # indice in LEVELS
+
+    def at(self, t: int) -> float | None:
+        """Valore al tempo t (primo prelievo se il tempo è ripetuto), None se assente o non numerico."""
+        pos = self.index.get(t)
+        return self.values[pos] if pos is not None and pos < len(self.values) else None
+
+
+_NO_SERIES = ExamSeries([], [], {})
+
+
 def evaluate_series(
     times: List[int],
     values: List[float],
@@ -28,142 +134,140 @@ def evaluate_series(
     Valuta una serie rispetto ai range di riferimento.
     - I valori mancanti/non numerici NON generano warning.
     """
-    rows: List[Dict[str, Any]] = []
-    severity = "normal"
-
-    for idx, t in enumerate(times):
-        raw_v = values[idx] if idx < len(values) else None
-        v = _to_float(raw_v)
-
-        ref = refs.get(str(t)) or refs.get(t) or {"min": 0, "max": 0}
-        rmin = _to_float(ref.get("min")) if isinstance(ref, dict) else None
-        rmax = _to_float(ref.get("max")) if isinstance(ref, dict) else None
-        rmin = rmin if rmin is not None else 0.0
-        rmax = rmax if rmax is not None else 0.0
-
-        if v is None:
-            status = "missing"
-        elif v < rmin:
-            status = "low"
-            if severity == "normal":
-                severity = "warning"
-        elif v > rmax:
-            status = "high"
-            if severity in ("normal", "warning"):
-                severity = "danger"
-        else:
-            status = "normal"
-
-        rows.append(
-            {
-                "time": t,
-                "value": v,
-                "ref": {"min": rmin, "max": rmax},
-                "status": status,
-            }
-        )
-
-    return rows, severity
-
+    series = ExamSeries(times, values, refs)
+    return series.rows, LEVELS[series.level]
 
-def interpret_exam(payload: Dict[str, Any]) -> Dict[str, Any]:
-    glyc_times = payload.get("glyc_times", []) or []
-    glyc_values = payload.get("glyc_values", []) or []
-    glyc_refs = payload.get("glyc_refs", {}) or {}
 
+@timed("interpret_exam")
+def interpret_exam(payload: Dict[str, Any], plan: RulePlan = DEFAULT_PLAN) -> Dict[str, Any]:
+    """Interpretazione di un esame con il rule set compilato del profilo attivo (services/interpretation_rules.py)."""
     # Insulina attiva solo se esplicitamente richiesta (flag) o modalità combinata
     include_insulin = bool(payload.get("include_insulin")) or payload.get("curve_mode") == "combined"
-
-    ins_times = payload.get("ins_times", []) if include_insulin else []
-    ins_values = payload.get("ins_values", []) if include_insulin else []
-    ins_refs = payload.get("ins_refs", {}) if include_insulin else {}
-
     pregnant = bool(payload.get("pregnant_mode", False))
 
-    glyc_rows, glyc_sev = evaluate_series(glyc_times, glyc_values, glyc_refs)
+    gly_series = ExamSeries(
+        payload.get("glyc_times", []) or [],
+        payload.get("glyc_values", []) or [],
+        payload.get("glyc_refs", {}) or {},
+    )
+    level = gly_series.level
     if include_insulin:
-        ins_rows, ins_sev = evaluate_series(ins_times, ins_values, ins_refs)
+        ins_series = ExamSeries(
+            payload.get("ins_times", []) or [],
+            payload.get("ins_values", []) or [],
+            payload.get("ins_refs", {}) or {},
+        )
+        level = max(level, ins_series.level)
     else:
-        ins_rows, ins_sev = [], "normal"
-
-    overall = "normal"
-    for sev in (glyc_sev, ins_sev):
-        if sev == "danger":
-            overall = "danger"
-            break
-        if sev == "warning" and overall == "normal":
-            overall = "warning"
-
-    def pick_gly(t: int) -> float | None:
-        if t not in glyc_times:
-            return None
-        idx = glyc_times.index(t)
-        raw = glyc_values[idx] if idx < len(glyc_values) else None
-        return _to_float(raw)
+        ins_series = _NO_SERIES
 
-    gly_diag = None
-    v120 = pick_gly(120)
-    if v120 is not None:
+    gly = None
+    v_gly = gly_series.at(plan.gly_time)
+    if v_gly is not None:
         if pregnant:
-            v0 = pick_gly(0)
-            v60 = pick_gly(60)
-            gdm = (v0 is not None and v0 >= 92) or (v60 is not None and v60 >= 180) or (v120 >= 153)
-
-            if gdm:
-                gly_diag = "Criteri IADPSG compatibili con diabete gestazionale (almeno un valore sopra soglia)."
-                if overall != "danger":
-                    overall = "danger"
-            else:
-                gly_diag = "Criteri IADPSG nei limiti."
+            positive = False
+            for t, threshold in plan.preg_checks:
+                v = gly_series.at(t)
+                if v is not None and v >= threshold:
+                    positive = True
+                    break
+            gly = plan.preg_positive if positive else plan.preg_negative
         else:
-            if v120 < 140:
-                gly_diag = "Tolleranza glucidica normale."
-            elif v120 < 200:
-                gly_diag = "Ridotta tolleranza al glucosio (IGT)."
-                if overall == "normal":
-                    overall = "warning"
-            else:
-                gly_diag = "Valore suggestivo di diabete mellito (da confermare clinicamente)."
-                overall = "danger"
+            gly = plan.bands[bisect_right(plan.band_bounds, v_gly)]
+        level = max(level, gly.level)
 
-    ins_diag = None
-    if include_insulin and ins_times and ins_values:
-        normalized = [_to_float(v) for v in ins_values]
-        numeric_pairs = [(i, v) for i, v in enumerate(normalized) if v is not None]
+    ins = ins_diag = None
+    ins_times, normalized = ins_series.times, ins_series.values
+    if ins_times and normalized:
+        # Primo massimo tra i valori numerici, come max() su (posizione, valore)
+        peak_idx = peak_val = None
+        for i, v in enumerate(normalized):
+            if v is not None and (peak_val is None or v > peak_val):
+                peak_idx, peak_val = i, v
 
-        if numeric_pairs:
-            peak_idx, peak_val = max(numeric_pairs, key=lambda x: x[1])
+        if peak_idx is not None:
             peak_time = ins_times[peak_idx] if peak_idx < len(ins_times) else None
 
-            v0 = normalized[0] if len(normalized) > 0 else None
-            idx120 = ins_times.index(120) if 120 in ins_times else -1
-            v120_ins = normalized[idx120] if idx120 >= 0 and idx120 < len(normalized) else None
+            v0 = normalized[0]
+            v_ret = ins_series.at(plan.ins_return_time)
+            ratio = plan.ins_return_ratio
+            returned = v_ret is None or v0 is None or v_ret <= v0 * ratio
+            slow = v_ret is not None and v0 is not None and v_ret > v0 * ratio
 
             if peak_time is not None:
-                if peak_time <= 60 and (v120_ins is None or v0 is None or v120_ins <= v0 * 3):
-                    ins_diag = "Pattern insulinemico nel range atteso."
-                elif peak_time > 60:
-                    ins_diag = f"Picco insulinemico ritardato (picco a {peak_time}'). Possibile insulino-resistenza."
-                    if overall == "normal":
-                        overall = "warning"
-                elif v120_ins is not None and v0 is not None and v120_ins > v0 * 3:
-                    ins_diag = "Ritorno lento verso il basale a 120'."
-                    if overall == "normal":
-                        overall = "warning"
-
-    summary_map = {
-        "normal": "Referto complessivamente nei limiti di riferimento.",
-        "warning": "Referto con alterazioni da correlare clinicamente.",
-        "danger": "Referto con alterazioni: necessaria valutazione medica.",
+                if peak_time <= plan.ins_peak_max_time and returned:
+                    ins = plan.ins_ok
+                elif peak_time > plan.ins_peak_max_time:
+                    ins = plan.ins_delayed
+                    ins_diag = ins.message.format(peak_time=peak_time)
+                elif slow:
+                    ins = plan.ins_slow_return
+            if ins is not None:
+                level = max(level, ins.level)
+                ins_diag = ins_diag or ins.message
+
+    criteria = []
+    for c in plan.criteria:
+        if c.pregnant is not None and c.pregnant != pregnant:
+            continue
+        v = (gly_series if c.series == "glyc" else ins_series).at(c.time)
+        if v is not None and c.op(v, c.value):
+            criteria.append({"code": c.code, "message": c.message})
+            level = max(level, c.level)
+
+    gly_class = gly.code if gly is not None else None
+    details = {
+        "glycemic_rows": gly_series.rows,
+        "insulin_rows": ins_series.rows if include_insulin else [],
+        "glycemic_interpretation": gly.message if gly is not None else None,
+        "insulin_interpretation": ins_diag,
+    }
+    if plan.criteria:
+        details["criteria"] = criteria
+    return {
+        "overall_status": LEVELS[level],
+        "summary": plan.summaries[level],
+        "glycemic_class": gly_class,
+        "insulin_pattern": ins.code if ins is not None else None,
+        "gdm": gly_class == "gdm" if gly_class in ("gdm", "iadpsg_ok") else None,
+        "details": details,
     }
 
+
+def legacy_codes(interpretation: Dict[str, Any]) -> Dict[str, Any]:
+    """Codici ricavati dai testi, per le interpretazioni salvate prima che esistessero."""
+    details = interpretation.get("details") or {}
+    gly_text = details.get("glycemic_interpretation")
+    ins_text = details.get("insulin_interpretation") or ""
+    gly_class = {
+        GLY_DIAG_NGT: "ngt",
+        GLY_DIAG_IGT: "igt",
+        GLY_DIAG_DM: "dm",
+        GLY_DIAG_IADPSG_OK: "iadpsg_ok",
+        GLY_DIAG_GDM: "gdm",
+    }.get(gly_text)
+    if ins_text == INS_DIAG_OK:
+        ins_pattern = "ok"
+    elif ins_text == INS_DIAG_SLOW_RETURN:
+        ins_pattern = "slow_return"
+    elif ins_text.startswith(INS_DIAG_DELAYED.split("{")[0]):
+        ins_pattern = "delayed"
+    else:
+        ins_pattern = None
+    return {
+        "glycemic_class": gly_class,
+        "insulin_pattern": ins_pattern,
+        "gdm": gly_class == "gdm" if gly_class in ("gdm", "iadpsg_ok") else None,
+    }
+
+
+def interpretation_columns(interpretation: Dict[str, Any]) -> Dict[str, Any]:
+    """Valori delle colonne strutturate di Exam (gdm come 0/1, come pregnant_mode)."""
+    codes = interpretation if "glycemic_class" in interpretation else legacy_codes(interpretation)
+    gdm = codes.get("gdm")
     return {
-        "overall_status": overall,
-        "summary": summary_map[overall],
-        "details": {
-            "glycemic_rows": glyc_rows,
-            "insulin_rows": ins_rows,
-            "glycemic_interpretation": gly_diag,
-            "insulin_interpretation": ins_diag if include_insulin else None,
-        },
+        "overall_status": interpretation.get("overall_status"),
+        "glycemic_class": codes.get("glycemic_class"),
+        "insulin_pattern": codes.get("insulin_pattern"),
+        "gdm": None if gdm is None else int(gdm),
     }
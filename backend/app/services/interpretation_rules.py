@@ -0,0 +1,247 @@
+"""
+Regole di interpretazione OGTT in forma dichiarativa (JSON del profilo di riferimento).
+
+Soglie, tempi, severità e testi non sono nel codice di interpret_exam: stanno in un
+rule set (DEFAULT_RULES, sovrascrivibile per chiave da ReferenceProfile.rules_json)
+compilato una volta per versione di profilo in un RulePlan di tuple e numeri. La
+valutazione di ogni esame (scalare in interpretation.py, vettoriale in
+batch_interpretation.py) legge solo il piano: nessun dizionario di configurazione
+né testo da comporre per esame, salvo il tempo del picco nel testo "ritardato".
+
+Formato (tutte le chiavi sono facoltative in rules_json, i dizionari si fondono coi default):
+
+- summaries: testo di sintesi per esito normal / warning / danger;
+- glycemic.time: tempo (min) della valutazione glicemica, senza valore non si valuta;
+- glycemic.bands: fasce sul valore a glycemic.time fuori gravidanza, in ordine; la prima
+  con valore < below (l'ultima senza below);
+- glycemic.pregnant: in gravidanza positivo se almeno un valore >= soglia ({tempo: soglia});
+- insulin: picco entro peak_max_time atteso, ritorno lento se il valore a return_time supera
+  return_ratio volte il primo valore; testi e severità di ok / delayed / slow_return;
+- criteria: criteri aggiuntivi del laboratorio su un singolo tempo, es. glicemia a 60' >= 155
+  (OMS 1 ora): {"code", "series": glyc|ins, "time", "op": >=|>|<=|<, "value",
+  "pregnant": true|false (assente = sempre), "severity", "message"}.
+
+Ogni esito ha code, severity (normal | warning | danger: l'esito complessivo è la più
+grave) e message. I code glicemici e insulinici sono quelli delle colonne di exams.
+"""
+from __future__ import annotations
+
+import copy
+import operator
+from typing import Any, Callable, Dict, NamedTuple, Tuple
+
+
+SUMMARY_MAP = {
+    "normal": "Referto complessivamente nei limiti di riferimento.",
+    "warning": "Referto con alterazioni da correlare clinicamente.",
+    "danger": "Referto con alterazioni: necessaria valutazione medica.",
+}
+
+GLY_DIAG_GDM = "Criteri IADPSG compatibili con diabete gestazionale (almeno un valore sopra soglia)."
+GLY_DIAG_IADPSG_OK = "Criteri IADPSG nei limiti."
+GLY_DIAG_NGT = "Tolleranza glucidica normale."
+GLY_DIAG_IGT = "Ridotta tolleranza al glucosio (IGT)."
+GLY_DIAG_DM = "Valore suggestivo di diabete mellito (da confermare clinicamente)."
+
+INS_DIAG_OK = "Pattern insulinemico nel range atteso."
+INS_DIAG_DELAYED = "Picco insulinemico ritardato (picco a {peak_time}'). Possibile insulino-resistenza."
+INS_DIAG_SLOW_RETURN = "Ritorno lento verso il basale a 120'."
+
+# Codici strutturati delle due valutazioni, salvati anche in colonne indicizzate di exams
+GLYCEMIC_CLASSES = ("ngt", "igt", "dm", "iadpsg_ok", "gdm")
+INSULIN_PATTERNS = ("ok", "delayed", "slow_return")
+
+LEVELS = ("normal", "warning", "danger")
+SERIES = ("glyc", "ins")
+OPERATORS: Dict[str, Callable[[Any, Any], Any]] = {
+    ">=": operator.ge,
+    ">": operator.gt,
+    "<=": operator.le,
+    "<": operator.lt,
+}
+
+DEFAULT_RULES: Dict[str, Any] = {
+    "summaries": dict(SUMMARY_MAP),
+    "glycemic": {
+        "time": 120,
+        "bands": [
+            {"below": 140, "code": "ngt", "severity": "normal", "message": GLY_DIAG_NGT},
+            {"below": 200, "code": "igt", "severity": "warning", "message": GLY_DIAG_IGT},
+            {"code": "dm", "severity": "danger", "message": GLY_DIAG_DM},
+        ],
+        "pregnant": {
+            "thresholds": {"0": 92, "60": 180, "120": 153},  # IADPSG
+            "positive": {"code": "gdm", "severity": "danger", "message": GLY_DIAG_GDM},
+            "negative": {"code": "iadpsg_ok", "severity": "normal", "message": GLY_DIAG_IADPSG_OK},
+        },
+    },
+    "insulin": {
+        "peak_max_time": 60,
+        "return_time": 120,
+        "return_ratio": 3,
+        "ok": {"code": "ok", "severity": "normal", "message": INS_DIAG_OK},
+        "delayed": {"code": "delayed", "severity": "warning", "message": INS_DIAG_DELAYED},
+        "slow_return": {"code": "slow_return", "severity": "warning", "message": INS_DIAG_SLOW_RETURN},
+    },
+    "criteria": [],
+}
+
+
+class Outcome(NamedTuple):
+    code: str
+    level: int  # indice in LEVELS
+    message: str
+
+
+class Criterion(NamedTuple):
+    code: str
+    series: str
+    time: int
+    op: Callable[[Any, Any], Any]  # funziona anche su array numpy
+    value: float
+    pregnant: bool | None
+    level: int
+    message: str
+
+
+class RulePlan(NamedTuple):
+    """Rule set compilato: solo tuple e numeri, condiviso in sola lettura."""
+
+    summaries: Tuple[str, str, str]
+    gly_time: int
+    band_bounds: Tuple[float, ...]  # limiti superiori esclusi, crescenti (bisect_right / searchsorted)
+    bands: Tuple[Outcome, ...]  # len(band_bounds) + 1
+    preg_checks: Tuple[Tuple[int, float], ...]
+    preg_positive: Outcome
+    preg_negative: Outcome
+    ins_peak_max_time: int
+    ins_return_time: int
+    ins_return_ratio: float
+    ins_ok: Outcome
+    ins_delayed: Outcome
+    ins_slow_return: Outcome
+    criteria: Tuple[Criterion, ...]
+
+
+def _merge(base: Any, override: Any) -> Any:
+    if isinstance(base, dict) and isinstance(override, dict):
+        out = dict(base)
+        for key, value in override.items():
+            out[key] = _merge(base.get(key), value) if key in base else value
+        return out
+    return copy.deepcopy(override)
+
+
+def _obj(value: Any, where: str) -> Dict[str, Any]:
+    if not isinstance(value, dict):
+        raise ValueError(f"{where}: atteso un oggetto")
+    return value
+
+
+def _level(severity: Any, where: str) -> int:
+    if severity not in LEVELS:
+        raise ValueError(f"{where}: severity deve essere una di {', '.join(LEVELS)}")
+    return LEVELS.index(severity)
+
+
+def _outcome(spec: Any, where: str, codes: Tuple[str, ...] | None = None) -> Outcome:
+    code = _obj(spec, where).get("code")
+    if codes is not None and code not in codes:
+        raise ValueError(f"{where}: code deve essere uno di {', '.join(codes)}")
+    message = spec.get("message")
+    if not isinstance(message, str):
+        raise ValueError(f"{where}: message mancante")
+    return Outcome(str(code), _level(spec.get("severity"), where), message)
+
+
+def _number(value: Any, where: str) -> float:
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError(f"{where}: atteso un numero")
+    return float(value)
+
+
+def _time(value: Any, where: str) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{where}: tempo non valido") from None
+
+
+def compile_rules(rules: Dict[str, Any] | None = None) -> RulePlan:
+    """Compila DEFAULT_RULES fuse con `rules`; ValueError con la chiave errata se il rule set non è valido."""
+    if rules is not None and not isinstance(rules, dict):
+        raise ValueError("Il rule set deve essere un oggetto JSON")
+    r = _merge(DEFAULT_RULES, rules or {})
+
+    summaries = _obj(r.get("summaries"), "summaries")
+    if any(not isinstance(summaries.get(level), str) for level in LEVELS):
+        raise ValueError("summaries: testo mancante per normal, warning o danger")
+
+    gly = _obj(r.get("glycemic"), "glycemic")
+    bands_spec = gly.get("bands")
+    if not isinstance(bands_spec, list) or not bands_spec:
+        raise ValueError("glycemic.bands: almeno una fascia")
+    bounds = tuple(_number(_obj(b, f"glycemic.bands[{i}]").get("below"), f"glycemic.bands[{i}].below") for i, b in enumerate(bands_spec[:-1]))
+    if list(bounds) != sorted(bounds):
+        raise ValueError("glycemic.bands: limiti below non crescenti")
+    bands = tuple(_outcome(b, f"glycemic.bands[{i}]", GLYCEMIC_CLASSES) for i, b in enumerate(bands_spec))
+
+    preg = _obj(gly.get("pregnant"), "glycemic.pregnant")
+    thresholds = _obj(preg.get("thresholds") or {}, "glycemic.pregnant.thresholds")
+    preg_checks = tuple(
+        sorted(
+            (_time(t, "glycemic.pregnant.thresholds"), _number(v, f"glycemic.pregnant.thresholds.{t}"))
+            for t, v in thresholds.items()
+        )
+    )
+
+    ins = _obj(r.get("insulin"), "insulin")
+    criteria = []
+    for i, c in enumerate(r.get("criteria") or []):
+        where = f"criteria[{i}]"
+        if _obj(c, where).get("series") not in SERIES:
+            raise ValueError(f"{where}.series: glyc o ins")
+        if c.get("op", ">=") not in OPERATORS:
+            raise ValueError(f"{where}.op: uno di {', '.join(OPERATORS)}")
+        pregnant = c.get("pregnant")
+        if pregnant is not None and not isinstance(pregnant, bool):
+            raise ValueError(f"{where}.pregnant: true, false o assente")
+        out = _outcome(c, where)
+        criteria.append(
+            Criterion(
+                out.code,
+                c["series"],
+                _time(c.get("time"), f"{where}.time"),
+                OPERATORS[c.get("op", ">=")],
+                _number(c.get("value"), f"{where}.value"),
+                pregnant,
+                out.level,
+                out.message,
+            )
+        )
+
+    delayed = _outcome(ins.get("delayed"), "insulin.delayed", INSULIN_PATTERNS)
+    try:
+        delayed.message.format(peak_time=0)
+    except (KeyError, IndexError, ValueError):
+        raise ValueError("insulin.delayed.message: unico segnaposto ammesso {peak_time}") from None
+
+    return RulePlan(
+        summaries=tuple(summaries[level] for level in LEVELS),
+        gly_time=_time(gly.get("time"), "glycemic.time"),
+        band_bounds=bounds,
+        bands=bands,
+        preg_checks=preg_checks,
+        preg_positive=_outcome(preg.get("positive"), "glycemic.pregnant.positive", GLYCEMIC_CLASSES),
+        preg_negative=_outcome(preg.get("negative"), "glycemic.pregnant.negative", GLYCEMIC_CLASSES),
+        ins_peak_max_time=_time(ins.get("peak_max_time"), "insulin.peak_max_time"),
+        ins_return_time=_time(ins.get("return_time"), "insulin.return_time"),
+        ins_return_ratio=_number(ins.get("return_ratio"), "insulin.return_ratio"),
+        ins_ok=_outcome(ins.get("ok"), "insulin.ok", INSULIN_PATTERNS),
+        ins_delayed=delayed,
+        ins_slow_return=_outcome(ins.get("slow_return"), "insulin.slow_return", INSULIN_PATTERNS),
+        criteria=tuple(criteria),
+    )
+
+
+DEFAULT_PLAN = compile_rules()
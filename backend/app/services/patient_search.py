@@ -0,0 +1,260 @@
+"""
+Indice di ricerca pazienti.
+
+Ogni paziente ha chiavi normalizzate (minuscolo, senza accenti):
+- surname_key: cognome senza spazi/punteggiatura, per la ricerca per prefisso su indice B-tree
+- fiscal_code_key: codice fiscale maiuscolo, per il match esatto
+- search_text: "cognome nome codicefiscale", per la ricerca per sottostringa
+
+La sottostringa è servita da FTS5 (tokenizer trigram) su SQLite e da pg_trgm su PostgreSQL;
+con altri DB, o se l'indice non è disponibile, si ricade su LIKE. I termini più corti di
+TRIGRAM_MIN non hanno trigrammi: valgono come prefisso di parola, e se la ricerca ha solo
+termini corti il primo è un prefisso del cognome su surname_key (range su indice).
+"""
+from __future__ import annotations
+
+import re
+import unicodedata
+
+from sqlalchemy import Integer, bindparam, column, event, inspect, or_, select, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from .. import models
+
+
+FTS_TABLE = "patient_search"
+TRIGRAM_MIN = 3
+FTS_CANDIDATE_CAP = 2000  # tetto ai candidati per sottostringa: latenza limitata anche su archivi enormi
+
+_NON_ALNUM = re.compile(r"[^0-9a-z]+")
+_fts_available: dict[str, bool] = {}
+
+
+def fold(value: str | None) -> str:
+    """Minuscolo, senza accenti, solo alfanumerici separati da uno spazio."""
+    if not value:
+        return ""
+    decomposed = unicodedata.normalize("NFKD", value)
+    ascii_only = "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return _NON_ALNUM.sub(" ", ascii_only.lower()).strip()
+
+
+def surname_key(surname: str | None) -> str:
+    return fold(surname).replace(" ", "")
+
+
+def fiscal_code_key(fiscal_code: str | None) -> str | None:
+    key = fold(fiscal_code).replace(" ", "").upper()
+    return key or None
+
+
+def search_text(surname: str | None, name: str | None, fiscal_code: str | None) -> str:
+    return " ".join(x for x in (fold(surname), fold(name), fold(fiscal_code)) if x)
+
+
+def apply_keys(patient: models.Patient) -> None:
+    patient.surname_key = surname_key(patient.surname)
+    patient.fiscal_code_key = fiscal_code_key(patient.fiscal_code)
+    patient.search_text = search_text(patient.surname, patient.name, patient.fiscal_code)
+
+
+def has_fts(conn) -> bool:
+    """True se la tabella FTS5 esiste (solo SQLite); l'esito è memorizzato per URL del DB."""
+    if conn.dialect.name != "sqlite":
+        return False
+    url = str(conn.engine.url)
+    if url not in _fts_available:
+        _fts_available[url] = inspect(conn).has_table(FTS_TABLE)
+    return _fts_available[url]
+
+
+def _prefix_clause(column, prefix: str, dialect: str):
+    if dialect == "sqlite":
+        # Range sulle chiavi ASCII: usa l'indice anche dove LIKE non lo userebbe
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        return (column >= prefix) & (column < upper)
+    return column.like(f"{prefix}%")
+
+
+def _word_prefix_clause(column, term: str):
+    """Una parola del testo normalizzato (fold: parole separate da uno spazio) inizia con term."""
+    return or_(column.like(f"{term}%"), column.like(f"% {term}%"))
+
+
+def _term_clause(column, term: str):
+    """Sottostringa per i termini lunghi, prefisso di parola per quelli sotto TRIGRAM_MIN."""
+    return column.like(f"%{term}%") if len(term) >= TRIGRAM_MIN else _word_prefix_clause(column, term)
+
+
+def substring_filter(db: Session, terms: list[str]):
+    """Condizione SQL: ogni termine compare in search_text (usa l'indice trigram se possibile)."""
+    conn = db.connection()
+    long_terms = [t for t in terms if len(t) >= TRIGRAM_MIN]
+    short_terms = [t for t in terms if len(t) < TRIGRAM_MIN]
+
+    clauses = []
+    if long_terms and has_fts(conn):
+        match = " AND ".join(f'"{t}"' for t in long_terms)
+        ids = (
+            text(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :match")
+            .bindparams(match=match)
+            .columns(column("rowid", Integer))
+        )
+        clauses.append(models.Patient.id.in_(ids))
+    else:
+        # pg_trgm serve direttamente LIKE '%x%' tramite l'indice GIN su search_text
+        clauses.extend(models.Patient.search_text.like(f"%{t}%") for t in long_terms)
+    if short_terms and not long_terms:
+        # Nessun indice trigram utilizzabile: il primo termine restringe per prefisso del cognome
+        clauses.append(_prefix_clause(models.Patient.surname_key, short_terms[0], conn.dialect.name))
+        short_terms = short_terms[1:]
+    clauses.extend(_word_prefix_clause(models.Patient.search_text, t) for t in short_terms)
+    return clauses
+
+
+def filter_clauses(db: Session, search: str) -> list:
+    terms = fold(search).split()
+    return substring_filter(db, terms) if terms else []
+
+
+def search_patients(db: Session, query: str, limit: int = 20) -> list[models.Patient]:
+    """
+    Ricerca as-you-type con ranking a fasi, ognuna servita da un indice e limitata:
+    1. codice fiscale esatto  2. prefisso cognome  3. sottostringa (trigram).
+    """
+    terms = fold(query).split()
+    if not terms:
+        return []
+
+    dialect = db.get_bind().dialect.name
+    P = models.Patient
+    results: list[models.Patient] = []
+    seen: set[int] = set()
+
+    def take(rows):
+        for r in rows:
+            if r.id not in seen and len(results) < limit:
+                seen.add(r.id)
+                results.append(r)
+
+    fc = fiscal_code_key(query)
+    if fc and len(terms) == 1 and len(fc) >= 11:
+        take(db.query(P).filter(P.fiscal_code_key == fc).limit(limit).all())
+
+    # Prefisso: il primo termine sul cognome, gli altri devono comparire nel testo
+    first = terms[0]
+    if len(results) < limit:
+        q = db.query(P).filter(_prefix_clause(P.surname_key, first, dialect))
+        for t in terms[1:]:
+            q = q.filter(_term_clause(P.search_text, t))
+        take(q.order_by(P.surname_key.asc(), P.name.asc(), P.id.asc()).limit(limit).all())
+
+    if len(results) < limit and any(len(t) >= TRIGRAM_MIN for t in terms):
+        q = db.query(P).filter(*substring_filter(db, terms))
+        if seen:
+            q = q.filter(P.id.notin_(seen))
+        candidates = q.limit(FTS_CANDIDATE_CAP).all()
+        candidates.sort(key=lambda r: (r.surname_key or "", r.name or "", r.id))
+        take(candidates)
+
+    return results
+
+
+def _sync_fts(conn: Connection, patient_id: int, value: str | None) -> None:
+    if not has_fts(conn):
+        return
+    conn.execute(text(f"DELETE FROM {FTS_TABLE} WHERE rowid = :id"), {"id": patient_id})
+    if value is not None:
+        conn.execute(
+            text(f"INSERT INTO {FTS_TABLE}(rowid, search_text) VALUES (:id, :t)"),
+            {"id": patient_id, "t": value},
+        )
+
+
+@event.listens_for(models.Patient, "before_insert")
+@event.listens_for(models.Patient, "before_update")
+def _patient_keys(mapper, connection, target):
+    apply_keys(target)
+
+
+@event.listens_for(models.Patient, "after_insert")
+@event.listens_for(models.Patient, "after_update")
+def _patient_fts_upsert(mapper, connection, target):
+    _sync_fts(connection, target.id, target.search_text)
+
+
+def unindex(conn: Connection, patient_id: int) -> None:
+    """Toglie dall'indice un paziente cancellato senza ORM (DELETE Core)."""
+    _sync_fts(conn, patient_id, None)
+
+
+@event.listens_for(models.Patient, "after_delete")
+def _patient_fts_delete(mapper, connection, target):
+    unindex(connection, target.id)
+
+
+def install(conn: Connection) -> None:
+    """Crea le strutture di indice del dialetto e ricalcola chiavi/indice per i pazienti esistenti."""
+    patients = models.Patient.__table__
+    if conn.dialect.name == "sqlite":
+        try:
+            conn.execute(
+                text(f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(search_text, tokenize='trigram')")
+            )
+        except Exception:
+            pass  # SQLite senza FTS5/trigram: resta il fallback LIKE
+        _fts_available.pop(str(conn.engine.url), None)
+    elif conn.dialect.name == "postgresql":
+        try:
+            with conn.begin_nested():
+                conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+                conn.execute(
+                    text(
+                        "CREATE INDEX IF NOT EXISTS ix_patients_search_trgm "
+                        "ON patients USING gin (search_text gin_trgm_ops)"
+                    )
+                )
+        except Exception:
+            pass  # estensione non installabile (permessi): resta LIKE senza indice trigram
+        conn.execute(
+            text(
+                "CREATE INDEX IF NOT EXISTS ix_patients_surname_key_pattern "
+                "ON patients (surname_key varchar_pattern_ops)"
+            )
+        )
+
+    fts = has_fts(conn)
+    update = (
+        patients.update()
+        .where(patients.c.id == bindparam("pid"))
+        .values(surname_key=bindparam("sk"), fiscal_code_key=bindparam("fk"), search_text=bindparam("st"))
+    )
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            select(patients.c.id, patients.c.surname, patients.c.name, patients.c.fiscal_code)
+            .where(patients.c.id > last_id)
+            .order_by(patients.c.id)
+            .limit(1000)
+        ).all()
+        if not rows:
+            break
+        batch = [
+            {
+                "pid": r.id,
+                "sk": surname_key(r.surname),
+                "fk": fiscal_code_key(r.fiscal_code),
+                "st": search_text(r.surname, r.name, r.fiscal_code),
+            }
+            for r in rows
+        ]
+        conn.execute(update, batch)
+        if fts:
+            ids = [{"id": b["pid"]} for b in batch]
+            conn.execute(text(f"DELETE FROM {FTS_TABLE} WHERE rowid = :id"), ids)
+            conn.execute(
+                text(f"INSERT INTO {FTS_TABLE}(rowid, search_text) VALUES (:id, :t)"),
+                [{"id": b["pid"], "t": b["st"]} for b in batch],
+            )
+        last_id = rows[-1].id
@@ -1,11 +1,21 @@
 from __future__ import annotations
 
+import hashlib
 import json
+import logging
 from datetime import date
+from typing import NamedTuple
+
+from sqlalchemy import event, insert, select
+from sqlalchemy.engine import Connection
 from sqlalchemy.orm import Session
 
 from .. import models
+from .cache_versions import REFERENCE_PROFILE, VersionedCache
+from .interpretation_rules import DEFAULT_PLAN, RulePlan, compile_rules
+
 
+logger = logging.getLogger("curvelab.profiles")
 
 DEFAULT_GLYC_REFS = {
     "0": {"min": 60, "max": 100},
@@ -60,23 +70,29 @@ DATASET_NAME = "Global Endocrine Guideline Profile"
 DATASET_VERSION = "2026.02.10"
 
 
-def _new_default_profile() -> models.ReferenceProfile:
-    return models.ReferenceProfile(
-        profile_key="global-endocrine-consensus-v2",
-        profile_name="Global Endocrine Consensus DB (profilo locale)",
-        glyc_refs_json=json.dumps(DEFAULT_GLYC_REFS, ensure_ascii=False),
-        pregnant_glyc_refs_json=json.dumps(PREGNANT_GLYC_REFS, ensure_ascii=False),
-        ins_refs_json=json.dumps(DEFAULT_INS_REFS, ensure_ascii=False),
-        sources_json=json.dumps(DEFAULT_SOURCES, ensure_ascii=False),
-        method_glyc=DEFAULT_METHODS["glyc"],
-        method_ins=DEFAULT_METHODS["ins"],
-        notes=DEFAULT_NOTES,
-        updated_on=date.today(),
-        is_active=1,
-    )
+def _default_profile_values() -> dict:
+    return {
+        "profile_key": "global-endocrine-consensus-v2",
+        "profile_name": "Global Endocrine Consensus DB (profilo locale)",
+        "glyc_refs_json": json.dumps(DEFAULT_GLYC_REFS, ensure_ascii=False),
+        "pregnant_glyc_refs_json": json.dumps(PREGNANT_GLYC_REFS, ensure_ascii=False),
+        "ins_refs_json": json.dumps(DEFAULT_INS_REFS, ensure_ascii=False),
+        "sources_json": json.dumps(DEFAULT_SOURCES, ensure_ascii=False),
+        "method_glyc": DEFAULT_METHODS["glyc"],
+        "method_ins": DEFAULT_METHODS["ins"],
+        "notes": DEFAULT_NOTES,
+        "updated_on": date.today(),
+        "is_active": 1,
+    }
 
 
 def get_active_profile(db: Session) -> models.ReferenceProfile:
+    """
+    Profilo attivo più recente, in sola lettura (anche sul pool read-only).
+
+    La riga predefinita è creata dalla migrazione install(); se nel DB non c'è alcun profilo
+    attivo si usa il profilo predefinito non salvato (id 0), senza scrivere.
+    """
     row = (
         db.query(models.ReferenceProfile)
         .filter(models.ReferenceProfile.is_active == 1)
@@ -85,12 +101,14 @@ def get_active_profile(db: Session) -> models.ReferenceProfile:
     )
     if row:
         return row
+    return models.ReferenceProfile(id=0, **_default_profile_values())
+
 
-    row = _new_default_profile()
-    db.add(row)
-    db.commit()
-    db.refresh(row)
-    return row
+def install(conn: Connection) -> None:
+    """Migrazione: profilo predefinito se non ce n'è uno attivo."""
+    table = models.ReferenceProfile.__table__
+    if conn.execute(select(table.c.id).where(table.c.is_active == 1).limit(1)).first() is None:
+        conn.execute(insert(table).values(**_default_profile_values()))
 
 
 def row_to_payload(row: models.ReferenceProfile) -> dict:
@@ -126,7 +144,7 @@ def row_to_payload(row: models.ReferenceProfile) -> dict:
         "notes": row.notes,
     }
 
-    return {
+    payload = {
         "default_glyc_refs": glyc,
         "pregnant_glyc_refs": preg,
         "default_ins_refs": ins,
@@ -136,3 +154,102 @@ def row_to_payload(row: models.ReferenceProfile) -> dict:
             "ins": row.method_ins or DEFAULT_METHODS["ins"],
         },
     }
+
+    # Solo se personalizzate: senza regole il payload (e la versione) dei profili esistenti non cambia
+    try:
+        rules = json.loads(row.rules_json) if row.rules_json else None
+    except ValueError as exc:
+        logger.warning("Profilo %s: rules_json non leggibile, regole predefinite: %s", row.profile_key, exc)
+        rules = None
+    if isinstance(rules, dict):
+        payload["interpretation_rules"] = rules
+    elif rules is not None:
+        logger.warning("Profilo %s: rules_json non è un oggetto JSON, regole predefinite", row.profile_key)
+    return payload
+
+
+class ActiveProfile(NamedTuple):
+    """Payload decodificato del profilo attivo, condiviso in sola lettura tra le richieste."""
+
+    profile_id: int
+    updated_on: date | None
+    version: str
+    payload: dict
+    rules: RulePlan
+
+
+def _build_snapshot(row: models.ReferenceProfile) -> ActiveProfile:
+    payload = row_to_payload(row)
+    # updated_on ha granularità giornaliera: l'hash del contenuto distingue modifiche nello stesso giorno
+    digest = hashlib.sha1(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+    version = f"{row.id}-{row.updated_on.isoformat() if row.updated_on else 'na'}-{digest[:12]}"
+    try:
+        rules = compile_rules(payload.get("interpretation_rules"))
+    except ValueError as exc:
+        # Profili salvati prima della verifica in _check_rules (o scritti fuori dall'ORM)
+        logger.warning("Profilo %s: interpretation_rules non valide, regole predefinite: %s", row.profile_key, exc)
+        rules = DEFAULT_PLAN
+    return ActiveProfile(row.id, row.updated_on, version, payload, rules)
+
+
+@event.listens_for(models.ReferenceProfile, "before_insert")
+@event.listens_for(models.ReferenceProfile, "before_update")
+def _check_rules(mapper, connection, target: models.ReferenceProfile) -> None:
+    """Regole personalizzate verificate al salvataggio: ValueError invece di un fallback silenzioso."""
+    if not target.rules_json:
+        return
+    try:
+        compile_rules(json.loads(target.rules_json))
+    except ValueError as exc:
+        raise ValueError(f"interpretation_rules: {exc}") from exc
+
+
+# Ogni commit che scrive un ReferenceProfile incrementa la versione: gli altri worker la vedono
+_active = VersionedCache(REFERENCE_PROFILE, lambda db: _build_snapshot(get_active_profile(db)), models.ReferenceProfile)
+
+
+def get_active_snapshot(db: Session) -> ActiveProfile:
+    """Profilo attivo dalla cache in-process; ricostruito solo se un processo lo ha modificato."""
+    return _active.get(db)
+
+
+_recorded_versions: set[str] = set()
+
+
+def record_version(db: Session, snap: ActiveProfile) -> None:
+    """Registra il payload della versione (una volta per processo) nella transazione corrente."""
+    if snap.version in _recorded_versions:
+        return
+    if db.get(models.ReferenceProfileVersion, snap.version) is not None:
+        _recorded_versions.add(snap.version)
+        return
+    db.add(
+        models.ReferenceProfileVersion(
+            version=snap.version,
+            profile_id=snap.profile_id,
+            payload_json=json.dumps(snap.payload, ensure_ascii=False),
+        )
+    )
+
+
+def invalidate_active_profile() -> None:
+    _active.invalidate()
+
+
+def apply_default_refs(data: dict, ref_payload: dict) -> dict:
+    """
+    Completa con i range del profilo attivo i tempi senza range nel payload esame.
+    Restituisce lo stesso dict se non manca nulla, altrimenti una copia aggiornata.
+    """
+    glyc_key = "pregnant_glyc_refs" if data.get("pregnant_mode") else "default_glyc_refs"
+    updates = {}
+    for series, defaults in (("glyc", ref_payload.get(glyc_key) or {}), ("ins", ref_payload.get("default_ins_refs") or {})):
+        refs = data.get(f"{series}_refs") or {}
+        missing = [str(t) for t in data.get(f"{series}_times") or [] if str(t) not in refs and str(t) in defaults]
+        if missing:
+            filled = dict(refs)
+            for t in missing:
+                filled[t] = dict(defaults[t])
+            updates[f"{series}_refs"] = filled
+    return {**data, **updates} if updates else data
+
@@ -0,0 +1,345 @@
+"""
+Reinterpretazione in background degli esami dopo un cambio del profilo di riferimento.
+
+Ogni esame registra la versione di profilo che ha prodotto l'interpretazione
+(Exam.interpretation_version); sono "stale" gli esami con versione diversa da
+quella attiva. Un job (tabella reinterpretation_jobs) li riprocessa a blocchi di
+CHUNK_SIZE in un thread dedicato: ogni blocco aggiorna esami e avanzamento nella
+stessa transazione, così dopo un riavvio il job riprende da last_exam_id.
+Con più processi (worker) un job è eseguito da un solo processo alla volta: chi lo
+prende lo segna col proprio host:pid e rinnova heartbeat_at a ogni blocco; gli altri
+attendono e lo rilevano solo se resta senza segni di vita per LEASE_SECONDS.
+
+Range dei punti: un range uguale a quello della versione di profilo che aveva
+interpretato l'esame è considerato ereditato e viene sostituito con quello del
+profilo attivo; i range diversi (personalizzati dall'operatore) restano invariati.
+Gli esami precedenti a questa funzione hanno versione LEGACY_VERSION (migrazione
+stamp_legacy): non sono "stale" e si reinterpretano solo su richiesta esplicita
+(job con include_legacy). La provenienza dei loro range non è nota: si mantengono i
+range salvati e si completano solo quelli mancanti.
+
+Al più un job è attivo (pending/running) alla volta: lo garantisce un indice unico
+parziale (install), così più processi che accodano insieme ne creano uno solo. Un
+profilo modificato mentre il job gira non ne accoda un altro (enqueue restituisce
+quello in corso): al termine il worker ne accoda uno verso la versione attiva.
+"""
+from __future__ import annotations
+
+import json
+import os
+import socket
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, func, or_, select, text, update
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, selectinload
+
+from .. import models
+from ..crud.exams import SERIES, points_to_series
+from ..database import SessionLocal
+from . import rollups
+from .batch_interpretation import interpret_exams_batch
+from .interpretation import interpretation_columns
+from .reference_profiles import ActiveProfile, apply_default_refs, get_active_snapshot, record_version
+
+
+CHUNK_SIZE = 500
+ACTIVE_STATUSES = ("pending", "running")
+LEASE_SECONDS = 60
+LEGACY_VERSION = "legacy"
+ACTIVE_INDEX = "uq_reinterpretation_jobs_active"
+
+_worker_lock = threading.Lock()
+_worker: threading.Thread | None = None
+_wakeup = threading.Event()
+
+
+def stale_clause(version: str, include_legacy: bool = False):
+    v = models.Exam.interpretation_version
+    if include_legacy:
+        return or_(v.is_(None), v != version)
+    return and_(v != version, v != LEGACY_VERSION)
+
+
+def count_stale(db: Session, version: str, include_legacy: bool = False) -> int:
+    return (
+        db.scalar(select(func.count()).select_from(models.Exam).where(stale_clause(version, include_legacy))) or 0
+    )
+
+
+def count_legacy(db: Session) -> int:
+    v = models.Exam.interpretation_version
+    return db.scalar(select(func.count()).select_from(models.Exam).where(or_(v.is_(None), v == LEGACY_VERSION))) or 0
+
+
+def _series_defaults(payload: dict | None, series: str, pregnant: bool) -> dict:
+    if not payload:
+        return {}
+    if series == "glyc":
+        return payload.get("pregnant_glyc_refs" if pregnant else "default_glyc_refs") or {}
+    return payload.get("default_ins_refs") or {}
+
+
+def _same_range(a: dict | None, b: dict | None) -> bool:
+    if not a or not b:
+        return False
+    try:
+        return float(a["min"]) == float(b["min"]) and float(a["max"]) == float(b["max"])
+    except (KeyError, TypeError, ValueError):
+        return False
+
+
+def refreshed_refs(exam: models.Exam, old_payload: dict | None, new_payload: dict) -> dict:
+    """Payload di interpretazione dell'esame con i range ereditati aggiornati al profilo attivo."""
+    data = points_to_series(exam.points)
+    data["curve_mode"] = exam.curve_mode
+    data["pregnant_mode"] = bool(exam.pregnant_mode)
+    for s in SERIES:
+        old_defaults = _series_defaults(old_payload, s, data["pregnant_mode"])
+        new_defaults = _series_defaults(new_payload, s, data["pregnant_mode"])
+        refs = dict(data[f"{s}_refs"])
+        for t, ref in data[f"{s}_refs"].items():
+            if t in new_defaults and _same_range(ref, old_defaults.get(t)):
+                refs[t] = dict(new_defaults[t])
+        data[f"{s}_refs"] = refs
+    return apply_default_refs(data, new_payload)
+
+
+def _old_payloads(db: Session, versions: set, cache: dict) -> None:
+    missing = [v for v in versions if v is not None and v not in cache]
+    if not missing:
+        return
+    rows = db.execute(
+        select(models.ReferenceProfileVersion.version, models.ReferenceProfileVersion.payload_json).where(
+            models.ReferenceProfileVersion.version.in_(missing)
+        )
+    )
+    found = {version: json.loads(payload or "{}") for version, payload in rows}
+    for v in missing:
+        cache[v] = found.get(v)
+
+
+def _process_chunk(db: Session, job: models.ReinterpretationJob, snap: ActiveProfile, cache: dict) -> int:
+    exams = db.scalars(
+        select(models.Exam)
+        .options(selectinload(models.Exam.points))
+        .where(models.Exam.id > job.last_exam_id, stale_clause(snap.version, bool(job.include_legacy)))
+        .order_by(models.Exam.id)
+        .limit(CHUNK_SIZE)
+    ).all()
+    if not exams:
+        return 0
+
+    _old_payloads(db, {e.interpretation_version for e in exams}, cache)
+    datas = [refreshed_refs(e, cache.get(e.interpretation_version), snap.payload) for e in exams]
+    interpretations = interpret_exams_batch(datas, snap.rules)
+
+    before = [rollups.exam_key(e) for e in exams]
+    changed = 0
+    for exam, data, interp in zip(exams, datas, interpretations):
+        for point in exam.points:
+            ref = data[f"{point.series}_refs"].get(str(point.time_min))
+            if ref is not None:
+                # Gli esami storici possono avere un solo estremo
+                point.ref_min, point.ref_max = (None if ref.get(k) is None else float(ref[k]) for k in ("min", "max"))
+        details = json.dumps(interp)
+        if details != exam.interpretation_details_json:
+            changed += 1
+        exam.interpretation_summary = interp.get("summary")
+        exam.interpretation_details_json = details
+        exam.interpretation_version = snap.version
+        for column, value in interpretation_columns(interp).items():
+            setattr(exam, column, value)
+    # L'esito può cambiare con il profilo: i conteggi lo seguono nella stessa transazione
+    rollups.apply(db, rollups.changes(added=[rollups.exam_key(e) for e in exams], removed=before))
+
+    # Esami e avanzamento nella stessa transazione: il job riprende esattamente da qui
+    job.processed += len(exams)
+    job.changed += changed
+    job.last_exam_id = exams[-1].id
+    db.commit()
+    return len(exams)
+
+
+def worker_id() -> str:
+    """Identità del processo (host:pid) registrata sui job che esegue."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _claim(db: Session, job: models.ReinterpretationJob) -> bool:
+    """Prende il job per questo processo; False se lo sta eseguendo un altro processo ancora vivo."""
+    table = models.ReinterpretationJob.__table__
+    now = datetime.utcnow()
+    me = worker_id()
+    claimed = db.execute(
+        update(table)
+        .where(
+            table.c.id == job.id,
+            or_(
+                table.c.worker.is_(None),
+                table.c.worker == me,
+                table.c.heartbeat_at < now - timedelta(seconds=LEASE_SECONDS),
+            ),
+        )
+        .values(worker=me, heartbeat_at=now)
+    ).rowcount
+    db.commit()
+    return claimed == 1
+
+
+def _renew(db: Session, job: models.ReinterpretationJob) -> bool:
+    """Segno di vita nella transazione del blocco; False se il job è passato a un altro processo."""
+    table = models.ReinterpretationJob.__table__
+    renewed = db.execute(
+        update(table).where(table.c.id == job.id, table.c.worker == worker_id()).values(heartbeat_at=datetime.utcnow())
+    ).rowcount
+    return renewed == 1
+
+
+def run_job(db: Session, job: models.ReinterpretationJob) -> None:
+    try:
+        snap = get_active_snapshot(db)
+        if job.target_version != snap.version:
+            # Il profilo è cambiato dopo l'accodamento: si riparte verso la nuova versione
+            job.target_version = snap.version
+            job.last_exam_id = 0
+            job.processed = 0
+            job.changed = 0
+            job.total = count_stale(db, snap.version, bool(job.include_legacy))
+        record_version(db, snap)
+        job.status = "running"
+        job.started_at = job.started_at or datetime.utcnow()
+        db.commit()
+
+        cache: dict = {}
+        while _renew(db, job):
+            if not _process_chunk(db, job, snap, cache):
+                break
+        else:
+            # Fermo oltre LEASE_SECONDS e job ripreso da un altro processo: nessun blocco applicato due volte
+            db.rollback()
+            return
+        job.status = "done"
+        job.finished_at = datetime.utcnow()
+        db.commit()
+    except Exception as exc:
+        db.rollback()
+        job.status = "failed"
+        job.error = f"{exc.__class__.__name__}: {exc}"
+        job.finished_at = datetime.utcnow()
+        db.commit()
+
+
+def _next_job(db: Session) -> models.ReinterpretationJob | None:
+    return db.scalars(
+        select(models.ReinterpretationJob)
+        .where(models.ReinterpretationJob.status.in_(ACTIVE_STATUSES))
+        .order_by(models.ReinterpretationJob.id)
+        .limit(1)
+    ).first()
+
+
+def _requeue_if_changed(db: Session, job: models.ReinterpretationJob) -> None:
+    """Profilo cambiato mentre il job girava (verso la versione precedente): nuovo job se servono."""
+    if job.status == "done" and get_active_snapshot(db).version != job.target_version:
+        enqueue(db, only_if_stale=True)
+
+
+def _run_pending() -> None:
+    global _worker
+    while True:
+        _wakeup.clear()
+        with SessionLocal() as db:
+            job = _next_job(db)
+            if job is not None:
+                if _claim(db, job):
+                    run_job(db, job)
+                    _requeue_if_changed(db, job)
+                else:
+                    # Lo esegue un altro processo: si riprova quando il suo lease potrebbe essere scaduto
+                    _wakeup.wait(LEASE_SECONDS)
+                continue
+        with _worker_lock:
+            # Un job accodato mentre si cercava il successivo riattiva il ciclo
+            if not _wakeup.is_set():
+                _worker = None
+                return
+
+
+def start_worker() -> None:
+    """Avvia il thread di lavoro se non è già attivo (uno per processo)."""
+    global _worker
+    with _worker_lock:
+        _wakeup.set()
+        if _worker is not None and _worker.is_alive():
+            return
+        _worker = threading.Thread(target=_run_pending, name="reinterpretation", daemon=True)
+        _worker.start()
+
+
+def latest_job(db: Session) -> models.ReinterpretationJob | None:
+    return db.scalars(select(models.ReinterpretationJob).order_by(models.ReinterpretationJob.id.desc()).limit(1)).first()
+
+
+def enqueue(db: Session, only_if_stale: bool = False, include_legacy: bool = False) -> models.ReinterpretationJob | None:
+    """
+    Accoda un job verso la versione attiva; riusa quello già in corso. Avvia il worker.
+
+    include_legacy: reinterpreta anche gli esami LEGACY_VERSION (solo su richiesta esplicita).
+    """
+    active = _next_job(db)
+    if active is None:
+        snap = get_active_snapshot(db)
+        total = count_stale(db, snap.version, include_legacy)
+        if only_if_stale and not total:
+            return None
+        db.add(models.ReinterpretationJob(target_version=snap.version, total=total, include_legacy=int(include_legacy)))
+        try:
+            db.commit()
+        except IntegrityError:
+            # Un altro processo ha accodato nello stesso momento (indice ACTIVE_INDEX): si usa il suo job
+            db.rollback()
+        active = _next_job(db)
+        if active is None:
+            return None  # già concluso nel frattempo
+    start_worker()
+    return active
+
+
+def resume_on_startup() -> None:
+    """Riprende i job interrotti o ne accoda uno se ci sono esami non allineati al profilo attivo."""
+    with SessionLocal() as db:
+        enqueue(db, only_if_stale=True)
+
+
+def stamp_legacy(conn: Connection) -> None:
+    """Migrazione: gli esami senza versione diventano LEGACY_VERSION, esclusi dalla reinterpretazione automatica."""
+    exams = models.Exam.__table__
+    conn.execute(
+        update(exams).where(exams.c.interpretation_version.is_(None)).values(interpretation_version=LEGACY_VERSION)
+    )
+
+
+def install(conn: Connection) -> None:
+    """Migrazione: indice unico parziale che ammette un solo job attivo; i doppioni già presenti falliscono."""
+    table = models.ReinterpretationJob.__table__
+    active = conn.execute(
+        select(table.c.id).where(table.c.status.in_(ACTIVE_STATUSES)).order_by(table.c.id)
+    ).scalars().all()
+    if len(active) > 1:
+        conn.execute(
+            update(table)
+            .where(table.c.id.in_(active[1:]))
+            .values(status="failed", error=f"Duplicato del job {active[0]}", finished_at=datetime.utcnow())
+        )
+    # Colonna aggiunta da _sync_columns: NULL sui job già presenti
+    conn.execute(update(table).where(table.c.include_legacy.is_(None)).values(include_legacy=0))
+    statuses = ", ".join(f"'{status}'" for status in ACTIVE_STATUSES)
+    conn.execute(
+        text(
+            f"CREATE UNIQUE INDEX IF NOT EXISTS {ACTIVE_INDEX} "
+            f"ON reinterpretation_jobs ((status IN ({statuses}))) WHERE status IN ({statuses})"
+        )
+    )
@@ -0,0 +1,198 @@
+"""
+Cache su disco, indirizzata per contenuto, degli asset di referto per esame:
+grafici PNG/SVG (glicemia, insulina, combinato), JSON del referto e PDF.
+
+La chiave è l'hash di punti e dati esame, interpretazione, impostazioni referto
+(logo compreso) e versione del profilo di riferimento attivo: se un input cambia
+cambia la chiave, e i file vecchi escono per LRU quando la cache supera
+REPORT_CACHE_MAX_MB. I file sono serviti così come sono (sendfile), senza rendering.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, NamedTuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session, selectinload
+
+from .. import models
+from ..config import settings
+from .reference_profiles import get_active_snapshot
+from .report_charts import CHART_KINDS, CHART_TITLES, drawing_to_png, drawing_to_svg, exam_chart, report_chart_kinds
+from .report_jobs import exam_report, refs_source, report_settings_payload
+from .report_pdf import render_report_pdf
+from .report_settings import get_logo, logo_url
+
+
+RENDER_VERSION = "1"  # da incrementare quando cambia la resa di grafici/PDF: invalida tutta la cache
+MEDIA_TYPES = {"png": "image/png", "svg": "image/svg+xml", "json": "application/json", "pdf": "application/pdf"}
+
+
+class DiskCache:
+    """File per chiave in root/ab/abcdef….ext, con indice LRU in memoria ed eviction per dimensione."""
+
+    def __init__(self, root: str | Path, max_bytes: int):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._index: OrderedDict[Path, int] | None = None
+        self._total = 0
+
+    def _load_index(self) -> None:
+        files = []
+        if self.root.exists():
+            for path in self.root.glob("*/*"):
+                if path.suffix == ".tmp":
+                    continue
+                try:
+                    st = path.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((st.st_mtime, path, st.st_size))
+        files.sort()
+        self._index = OrderedDict((path, size) for _, path, size in files)
+        self._total = sum(self._index.values())
+
+    def path(self, key: str, ext: str) -> Path:
+        return self.root / key[:2] / f"{key}.{ext}"
+
+    def get(self, key: str, ext: str) -> Path | None:
+        path = self.path(key, ext)
+        with self._lock:
+            if self._index is None:
+                self._load_index()
+            try:
+                os.utime(path)  # mtime = ultimo uso, per ricostruire l'ordine LRU al riavvio
+            except FileNotFoundError:
+                self._total -= self._index.pop(path, 0)
+                return None
+            if path in self._index:
+                self._index.move_to_end(path)
+            else:
+                # Scritto da un altro processo
+                self._index[path] = path.stat().st_size
+                self._total += self._index[path]
+            return path
+
+    def put(self, key: str, ext: str, data: bytes) -> Path:
+        path = self.path(key, ext)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)  # atomico: chi legge vede il file intero o nessun file
+        with self._lock:
+            if self._index is None:
+                self._load_index()
+            self._total += len(data) - self._index.pop(path, 0)
+            self._index[path] = len(data)
+            self._evict()
+        return path
+
+    def get_or_create(self, key: str, ext: str, produce: Callable[[], bytes]) -> Path:
+        return self.get(key, ext) or self.put(key, ext, produce())
+
+    def _evict(self) -> None:
+        while self._total > self.max_bytes and len(self._index) > 1:
+            path, size = self._index.popitem(last=False)
+            self._total -= size
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+
+cache = DiskCache(settings.report_cache_dir, settings.report_cache_max_mb * 1024 * 1024)
+
+
+class ExamAssets(NamedTuple):
+    exam_id: int
+    digest: str
+    report: dict
+    settings: dict
+
+    def key(self, asset: str) -> str:
+        return hashlib.sha256(f"{self.digest}:{asset}".encode("utf-8")).hexdigest()
+
+
+def exam_assets(db: Session, exam_id: int) -> ExamAssets | None:
+    """Dati del referto e hash di tutti gli input; None se l'esame non esiste."""
+    exam = db.scalars(
+        select(models.Exam)
+        .options(selectinload(models.Exam.points), selectinload(models.Exam.patient))
+        .where(models.Exam.id == exam_id)
+    ).first()
+    if exam is None:
+        return None
+    report = exam_report(exam, refs_source(db), generated_at="")
+    # Il logo entra nella chiave col suo hash; i byte servono solo per il PDF
+    settings_payload = report_settings_payload(db, {}, with_logo=False)
+    source = json.dumps(
+        {
+            "render": RENDER_VERSION,
+            "report": report,
+            "settings": settings_payload,
+            "profile": get_active_snapshot(db).version,
+        },
+        sort_keys=True,
+        default=str,
+    )
+    return ExamAssets(exam_id, hashlib.sha256(source.encode("utf-8")).hexdigest(), report, settings_payload)
+
+
+def chart_file(assets: ExamAssets, kind: str, fmt: str) -> tuple[Path, str] | None:
+    """(file, chiave) del grafico; None se l'esame non ha i dati per quel grafico."""
+    if kind not in CHART_KINDS:
+        return None
+    key = assets.key(f"chart-{kind}")
+    path = cache.get(key, fmt)
+    if path is None:
+        drawing = exam_chart(assets.report["exam"], kind)
+        if drawing is None:
+            return None
+        path = cache.put(key, fmt, drawing_to_png(drawing) if fmt == "png" else drawing_to_svg(drawing))
+    return path, key
+
+
+def report_json_file(assets: ExamAssets, base_url: str) -> tuple[Path, str]:
+    key = assets.key("report")
+
+    def produce() -> bytes:
+        s = assets.settings
+        charts = [
+            {
+                "kind": kind,
+                "title": CHART_TITLES[kind],
+                "png_url": f"{base_url}/charts/{kind}.png",
+                "svg_url": f"{base_url}/charts/{kind}.svg",
+            }
+            for kind in report_chart_kinds(assets.report["exam"], s["merge_charts"])
+        ]
+        payload = {
+            **{k: v for k, v in assets.report.items() if k != "generated_at"},
+            "exam_id": assets.exam_id,
+            "settings": {k: v for k, v in s.items() if k not in ("logo", "logo_hash")},
+            "logo_url": logo_url(s["logo_hash"]),
+            "charts": charts,
+            "pdf_url": f"{base_url}/pdf",
+        }
+        return json.dumps(payload, ensure_ascii=False).encode("utf-8")
+
+    return cache.get_or_create(key, "json", produce), key
+
+
+def report_pdf_file(db: Session, assets: ExamAssets) -> tuple[Path, str]:
+    key = assets.key("pdf")
+
+    def produce() -> bytes:
+        generated_at = datetime.now().strftime("%d/%m/%Y %H:%M")
+        logo = get_logo(db, assets.settings["logo_hash"], "print")
+        report_settings = {**assets.settings, "logo": logo.data if logo else None}
+        return render_report_pdf({**assets.report, "settings": report_settings, "generated_at": generated_at})
+
+    return cache.get_or_create(key, "pdf", produce), key
@@ -0,0 +1,311 @@
+"""
+Grafici delle curve per il referto, come Drawing vettoriali reportlab.
+
+Stessa resa dei grafici Chart.js del frontend (charts-ui.js): banda del range di
+normalità, linee dei limiti e curva del paziente. Il Drawing si disegna sul PDF
+(renderPDF), si esporta in SVG (renderSVG) o in PNG con Pillow (drawing_to_png).
+"""
+from __future__ import annotations
+
+import io
+import math
+from typing import List, Sequence
+
+from PIL import Image, ImageDraw, ImageFont
+from reportlab.graphics import renderSVG
+from reportlab.graphics.shapes import Circle, Drawing, Group, Line, PolyLine, Polygon, Rect, String
+from reportlab.lib import colors
+
+
+GLYC_LINE = colors.HexColor("#2563eb")
+INS_LINE = colors.HexColor("#1d4ed8")
+RANGE_LINE = colors.Color(22 / 255, 163 / 255, 74 / 255, alpha=0.55)
+GLYC_AREA = colors.Color(16 / 255, 185 / 255, 129 / 255, alpha=0.18)
+INS_AREA = colors.Color(249 / 255, 115 / 255, 22 / 255, alpha=0.18)
+GRID = colors.HexColor("#e5e7eb")
+AXIS = colors.HexColor("#6b7280")
+TEXT = colors.HexColor("#374151")
+
+FONT = "Helvetica"
+
+
+def _num(value):
+    try:
+        v = float(value)
+    except (TypeError, ValueError):
+        return None
+    return v if math.isfinite(v) else None
+
+
+def series_points(times: Sequence[int], values: Sequence, refs: dict) -> dict:
+    """Punti (x, y) di valori e limiti; i tempi senza valore restano buchi nella curva."""
+    vals, lows, highs = [], [], []
+    for i, t in enumerate(times or []):
+        v = _num(values[i]) if i < len(values or []) else None
+        vals.append((float(t), v))
+        ref = (refs or {}).get(str(t)) or {}
+        lows.append((float(t), _num(ref.get("min")) or 0.0))
+        highs.append((float(t), _num(ref.get("max")) or 0.0))
+    return {"values": vals, "low": lows, "high": highs}
+
+
+def _nice_step(span: float, ticks: int = 5) -> float:
+    raw = span / max(ticks, 1)
+    mag = 10 ** math.floor(math.log10(raw)) if raw > 0 else 1
+    for mult in (1, 2, 2.5, 5, 10):
+        if raw <= mult * mag:
+            return mult * mag
+    return 10 * mag
+
+
+def _segments(points):
+    """Tratti continui della curva (i valori mancanti interrompono la linea, come Chart.js)."""
+    out, cur = [], []
+    for x, y in points:
+        if y is None:
+            if cur:
+                out.append(cur)
+            cur = []
+        else:
+            cur.append((x, y))
+    if cur:
+        out.append(cur)
+    return out
+
+
+def build_chart(datasets: List[dict], width: float, height: float, y_label: str) -> Drawing:
+    """
+    datasets: dict con "label", "points" (series_points), "line" e "area" (colori).
+    Con più dataset (grafico combinato) si disegnano bande e curve di tutti sullo stesso asse.
+    """
+    d = Drawing(width, height)
+    d.add(Rect(0, 0, width, height, fillColor=colors.white, strokeColor=None))
+
+    xs = [x for ds in datasets for x, _ in ds["points"]["values"]]
+    ys = [y for ds in datasets for key in ("values", "low", "high") for _, y in ds["points"][key] if y is not None]
+    if not xs:
+        d.add(String(width / 2, height / 2, "Nessun dato", fontName=FONT, fontSize=9, fillColor=AXIS, textAnchor="middle"))
+        return d
+
+    x_min, x_max = min(xs), max(xs)
+    if x_max == x_min:
+        x_max = x_min + 1
+    y_max_raw = max(ys) if ys else 1.0
+    y_min_raw = min(0.0, min(ys)) if ys else 0.0
+    y_step = _nice_step(y_max_raw - y_min_raw or 1.0)
+    y_min = math.floor(y_min_raw / y_step) * y_step
+    y_max = math.ceil(y_max_raw * 1.05 / y_step) * y_step or y_step
+
+    legend_h = 14 * math.ceil(len(datasets) / 2) + 4
+    left, right, bottom, top = 40, 10, 30, legend_h + 4
+    pw, ph = width - left - right, height - bottom - top
+
+    def sx(x):
+        return left + (x - x_min) / (x_max - x_min) * pw
+
+    def sy(y):
+        return bottom + (y - y_min) / (y_max - y_min) * ph
+
+    grid = Group()
+    y = y_min
+    while y <= y_max + 1e-9:
+        grid.add(Line(left, sy(y), left + pw, sy(y), strokeColor=GRID, strokeWidth=0.5))
+        grid.add(String(left - 4, sy(y) - 3, f"{y:g}", fontName=FONT, fontSize=7, fillColor=TEXT, textAnchor="end"))
+        y += y_step
+    for x in sorted(set(xs)):
+        grid.add(Line(sx(x), bottom, sx(x), bottom + ph, strokeColor=GRID, strokeWidth=0.5))
+        grid.add(String(sx(x), bottom - 10, f"{x:g}", fontName=FONT, fontSize=7, fillColor=TEXT, textAnchor="middle"))
+    grid.add(Line(left, bottom, left + pw, bottom, strokeColor=AXIS, strokeWidth=0.8))
+    grid.add(Line(left, bottom, left, bottom + ph, strokeColor=AXIS, strokeWidth=0.8))
+    grid.add(String(left + pw / 2, 4, "Tempo (min)", fontName=FONT, fontSize=8, fillColor=TEXT, textAnchor="middle"))
+    label = String(0, 0, y_label, fontName=FONT, fontSize=8, fillColor=TEXT, textAnchor="middle")
+    axis_label = Group(label)
+    axis_label.translate(10, bottom + ph / 2)
+    axis_label.rotate(90)
+    grid.add(axis_label)
+    d.add(grid)
+
+    for ds in datasets:
+        low, high = ds["points"]["low"], ds["points"]["high"]
+        if len(low) >= 2:
+            band = [c for x, y in high for c in (sx(x), sy(y))] + [c for x, y in reversed(low) for c in (sx(x), sy(y))]
+            d.add(Polygon(band, fillColor=ds["area"], strokeColor=None))
+            if not ds.get("combined"):
+                for edge in (low, high):
+                    d.add(PolyLine([c for x, y in edge for c in (sx(x), sy(y))], strokeColor=RANGE_LINE, strokeWidth=1))
+
+    for ds in datasets:
+        for seg in _segments(ds["points"]["values"]):
+            if len(seg) >= 2:
+                d.add(PolyLine([c for x, y in seg for c in (sx(x), sy(y))], strokeColor=ds["line"], strokeWidth=1.6))
+            for x, y in seg:
+                d.add(Circle(sx(x), sy(y), 2, fillColor=ds["line"], strokeColor=ds["line"]))
+
+    legend = Group()
+    for i, ds in enumerate(datasets):
+        lx = left + (i % 2) * (pw / 2)
+        ly = height - 12 - 14 * (i // 2)
+        legend.add(Rect(lx, ly, 10, 6, fillColor=ds["area"], strokeColor=ds["line"], strokeWidth=1))
+        legend.add(String(lx + 14, ly, ds["label"], fontName=FONT, fontSize=8, fillColor=TEXT))
+    d.add(legend)
+    return d
+
+
+CHART_KINDS = ("glyc", "ins", "combined")
+CHART_TITLES = {
+    "glyc": "Curva glicemica",
+    "ins": "Curva insulinemica",
+    "combined": "Grafico combinato glicemia + insulina",
+}
+
+
+def exam_chart(exam: dict, kind: str, width: float = 400, height: float = 400) -> Drawing | None:
+    """Grafico di un tipo (glyc | ins | combined); None se l'esame non ha i dati per disegnarlo."""
+    has_g = bool(exam.get("glyc_times"))
+    has_i = exam.get("curve_mode") == "combined" and bool(exam.get("ins_times"))
+    glyc_unit = exam.get("glyc_unit") or "mg/dL"
+    ins_unit = exam.get("ins_unit") or "µUI/mL"
+
+    if kind == "glyc" and has_g:
+        glyc = series_points(exam.get("glyc_times"), exam.get("glyc_values"), exam.get("glyc_refs"))
+        ds = [{"label": "Paziente", "points": glyc, "line": GLYC_LINE, "area": GLYC_AREA}]
+        return build_chart(ds, width, height, glyc_unit)
+    if kind == "ins" and has_i:
+        ins = series_points(exam.get("ins_times"), exam.get("ins_values"), exam.get("ins_refs"))
+        ds = [{"label": "Paziente", "points": ins, "line": INS_LINE, "area": INS_AREA}]
+        return build_chart(ds, width, height, ins_unit)
+    if kind == "combined" and has_g and has_i:
+        glyc = series_points(exam.get("glyc_times"), exam.get("glyc_values"), exam.get("glyc_refs"))
+        ins = series_points(exam.get("ins_times"), exam.get("ins_values"), exam.get("ins_refs"))
+        datasets = [
+            {"label": f"Glicemia ({glyc_unit})", "points": glyc, "line": GLYC_LINE, "area": GLYC_AREA, "combined": True},
+            {"label": f"Insulina ({ins_unit})", "points": ins, "line": INS_LINE, "area": INS_AREA, "combined": True},
+        ]
+        return build_chart(datasets, width, height, "Valori")
+    return None
+
+
+def report_chart_kinds(exam: dict, merge: bool) -> List[str]:
+    """Grafici presenti nel referto, con la stessa scelta di report-ui.js."""
+    has_g = bool(exam.get("glyc_times"))
+    has_i = exam.get("curve_mode") == "combined" and bool(exam.get("ins_times"))
+    if merge and has_g and has_i:
+        return ["combined"]
+    return [k for k, ok in (("glyc", has_g), ("ins", has_i)) if ok]
+
+
+def exam_charts(exam: dict, merge: bool, width: float = 400, height: float = 400) -> List[tuple]:
+    """(titolo, Drawing) dei grafici del referto."""
+    return [(CHART_TITLES[k], exam_chart(exam, k, width, height)) for k in report_chart_kinds(exam, merge)]
+
+
+def drawing_to_svg(drawing: Drawing) -> bytes:
+    return renderSVG.drawToString(drawing).encode("utf-8")
+
+
+def _rgba(color, opacity: float = 1.0):
+    if color is None:
+        return None
+    alpha = getattr(color, "alpha", 1) * opacity
+    return (int(color.red * 255), int(color.green * 255), int(color.blue * 255), int(alpha * 255))
+
+
+def _mul(a, b):
+    return (
+        a[0] * b[0] + a[2] * b[1],
+        a[1] * b[0] + a[3] * b[1],
+        a[0] * b[2] + a[2] * b[3],
+        a[1] * b[2] + a[3] * b[3],
+        a[0] * b[4] + a[2] * b[5] + a[4],
+        a[1] * b[4] + a[3] * b[5] + a[5],
+    )
+
+
+class _Raster:
+    """Rasterizzatore Pillow per le forme usate da build_chart (niente backend cairo)."""
+
+    def __init__(self, drawing: Drawing, scale: float):
+        self.scale = scale
+        self.height = drawing.height
+        self.image = Image.new("RGBA", (round(drawing.width * scale), round(drawing.height * scale)), (255, 255, 255, 255))
+        self.fonts: dict = {}
+
+    def point(self, m, x, y):
+        tx, ty = m[0] * x + m[2] * y + m[4], m[1] * x + m[3] * y + m[5]
+        return tx * self.scale, (self.height - ty) * self.scale
+
+    def font(self, size: float):
+        key = round(size * self.scale)
+        if key not in self.fonts:
+            try:
+                self.fonts[key] = ImageFont.truetype("DejaVuSans.ttf", key)
+            except OSError:
+                self.fonts[key] = ImageFont.load_default(size=key)  # font incluso in Pillow, senza µ
+        return self.fonts[key]
+
+    def layer(self, *paints):
+        # Colori semitrasparenti: si disegna su un livello e si compone
+        if any(p is not None and p[3] < 255 for p in paints):
+            return Image.new("RGBA", self.image.size, (0, 0, 0, 0))
+        return None
+
+    def draw(self, node, m=(1, 0, 0, 1, 0, 0)):
+        if isinstance(node, Group):
+            m = _mul(m, node.transform)
+            for child in node.contents:
+                self.draw(child, m)
+            return
+        w = max(1, round(getattr(node, "strokeWidth", 1) * self.scale))
+        stroke = _rgba(getattr(node, "strokeColor", None))
+        fill = _rgba(getattr(node, "fillColor", None))
+        if isinstance(node, String):
+            self.text(node, m)
+            return
+        layer = self.layer(fill, stroke)
+        target = layer if layer is not None else self.image
+        d = ImageDraw.Draw(target)
+        if isinstance(node, Rect):
+            pts = [self.point(m, node.x, node.y), self.point(m, node.x + node.width, node.y + node.height)]
+            box = [min(p[0] for p in pts), min(p[1] for p in pts), max(p[0] for p in pts), max(p[1] for p in pts)]
+            d.rectangle(box, fill=fill, outline=stroke, width=w if stroke else 0)
+        elif isinstance(node, Line):
+            d.line([self.point(m, node.x1, node.y1), self.point(m, node.x2, node.y2)], fill=stroke, width=w)
+        elif isinstance(node, (Polygon, PolyLine)):
+            pts = [self.point(m, node.points[i], node.points[i + 1]) for i in range(0, len(node.points), 2)]
+            if isinstance(node, Polygon):
+                d.polygon(pts, fill=fill, outline=stroke)
+            elif stroke and len(pts) >= 2:
+                d.line(pts, fill=stroke, width=w, joint="curve")
+        elif isinstance(node, Circle):
+            cx, cy = self.point(m, node.cx, node.cy)
+            r = node.r * self.scale
+            d.ellipse([cx - r, cy - r, cx + r, cy + r], fill=fill, outline=stroke)
+        if layer is not None:
+            self.image.alpha_composite(layer)
+
+    def text(self, node: String, m):
+        font = self.font(node.fontSize)
+        color = _rgba(node.fillColor) or (0, 0, 0, 255)
+        left, top, right, bottom = font.getbbox(node.text)
+        tw = right - left
+        ascent = font.getmetrics()[0]
+        offset = {"middle": tw / 2, "end": tw}.get(node.textAnchor, 0)
+        angle = math.degrees(math.atan2(m[1], m[0]))
+        if abs(angle) < 0.01:
+            x, y = self.point(m, node.x, node.y)
+            ImageDraw.Draw(self.image).text((x - offset, y - ascent), node.text, font=font, fill=color)
+            return
+        # Testo ruotato (etichetta asse y): disegnato a parte e ruotato attorno all'ancora
+        label = Image.new("RGBA", (int(tw) + 4, int(bottom) + 4), (0, 0, 0, 0))
+        ImageDraw.Draw(label).text((0, 0), node.text, font=font, fill=color)
+        rotated = label.rotate(angle, expand=True)
+        x, y = self.point(m, node.x, node.y)
+        self.image.alpha_composite(rotated, (int(x - rotated.width / 2), int(y - rotated.height / 2)))
+
+
+def drawing_to_png(drawing: Drawing, scale: float = 3.0) -> bytes:
+    raster = _Raster(drawing, scale)
+    raster.draw(drawing)
+    buffer = io.BytesIO()
+    raster.image.convert("RGB").save(buffer, "PNG", optimize=True)
+    return buffer.getvalue()
@@ -0,0 +1,327 @@
+"""
+Stampa massiva dei referti: job in background con rendering in un ProcessPoolExecutor.
+
+Il thread del job legge gli esami a blocchi, prepara dati semplici (dict/bytes)
+e li passa al pool; i PDF tornano in ordine e sono scritti man mano nello zip
+(un PDF per esame) o accodati in un unico PDF. Lo stato è in report_jobs.
+
+Il thread vive nel processo che ha ricevuto la richiesta: il job registra quel processo
+(host:pid) e un segno di vita a ogni blocco. All'avvio fail_orphans() chiude come falliti
+i job rimasti attivi di processi terminati; purge_outputs() elimina i file prodotti più
+vecchi di REPORT_OUTPUT_TTL_HOURS.
+"""
+from __future__ import annotations
+
+import io
+import json
+import math
+import multiprocessing
+import os
+import socket
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import List
+
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session, selectinload
+
+from .. import models
+from ..config import settings
+from ..crud.exams import points_to_series
+from ..database import SessionLocal
+from . import report_settings as report_srv
+from .reference_profiles import get_active_snapshot
+from .reinterpretation import worker_id
+from .report_pdf import render_reports, report_filename
+
+
+LOAD_CHUNK = 200
+MAX_TASK_REPORTS = 25
+ACTIVE_STATUSES = ("pending", "running")
+# Senza segni di vita da così tanto il job è considerato perso anche se il processo risulta vivo
+ORPHAN_SECONDS = 600
+OUTPUT_PATTERN = "report-job-*"
+
+_pool_lock = threading.Lock()
+_pool: ProcessPoolExecutor | None = None
+
+
+def pool_size() -> int:
+    return settings.report_workers or os.cpu_count() or 1
+
+
+def get_pool() -> ProcessPoolExecutor:
+    """Pool condiviso e creato al primo uso; "spawn" per non duplicare thread e connessioni DB."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=pool_size(), mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def shutdown_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def report_settings_payload(db: Session, options: dict, with_logo: bool = True) -> dict:
+    payload = report_srv.current_payload(db)
+    include = options.get("include_interpretation")
+    merge = options.get("merge_charts")
+    return {
+        "report_title": payload["report_title"],
+        "header_line1": payload["header_line1"],
+        "header_line2": payload["header_line2"],
+        "header_line3": payload["header_line3"],
+        "include_interpretation": payload["include_interpretation_default"] if include is None else include,
+        "merge_charts": payload["merge_charts_default"] if merge is None else merge,
+        "logo_hash": payload["header_logo_hash"],
+        "logo": report_srv.logo_bytes(db, payload["header_logo_hash"], "print") if with_logo else None,
+    }
+
+
+def refs_source(db: Session) -> str:
+    meta = get_active_snapshot(db).payload.get("references_metadata") or {}
+    return " • ".join(x for x in (meta.get("dataset_name"), meta.get("dataset_version")) if x)
+
+
+def exam_report(exam: models.Exam, source: str, generated_at: str) -> dict:
+    """Dati del referto di un esame (senza impostazioni), serializzabili verso il pool."""
+    patient = exam.patient
+    data = points_to_series(exam.points)
+    data.update(
+        exam_date=exam.exam_date.isoformat(),
+        acceptance_number=exam.acceptance_number,
+        curve_mode=exam.curve_mode,
+        pregnant_mode=bool(exam.pregnant_mode),
+        glucose_load_g=exam.glucose_load_g,
+        glyc_unit=exam.glyc_unit,
+        ins_unit=exam.ins_unit,
+        methodology=exam.methodology,
+        notes=exam.notes,
+    )
+    return {
+        "patient": {
+            "surname": patient.surname,
+            "name": patient.name,
+            "birth_date": patient.birth_date.isoformat() if patient.birth_date else None,
+            "sex": patient.sex,
+            "fiscal_code": patient.fiscal_code,
+        }
+        if patient
+        else {},
+        "exam": data,
+        "interpretation": json.loads(exam.interpretation_details_json or "{}"),
+        "refs_source": source,
+        "generated_at": generated_at,
+    }
+
+
+def load_reports(db: Session, exam_ids: List[int], source: str, generated_at: str) -> List[dict]:
+    rows = db.scalars(
+        select(models.Exam)
+        .options(selectinload(models.Exam.points), selectinload(models.Exam.patient))
+        .where(models.Exam.id.in_(exam_ids))
+    ).all()
+    by_id = {r.id: r for r in rows}
+    return [exam_report(by_id[i], source, generated_at) for i in exam_ids if i in by_id]
+
+
+class _ZipSink:
+    def __init__(self, path: Path):
+        self.path = path
+        self.zip = zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED)
+        self.names: set[str] = set()
+
+    def add(self, report: dict, pdf: bytes) -> None:
+        name = report_filename(report)
+        stem, n = name[:-4], 1
+        while name in self.names:
+            n += 1
+            name = f"{stem}_{n}.pdf"
+        self.names.add(name)
+        self.zip.writestr(name, pdf)
+
+    def close(self) -> None:
+        self.zip.close()
+
+    def discard(self) -> None:
+        """Job fallito: chiude lo zip e rimuove il file parziale."""
+        try:
+            self.zip.close()
+        finally:
+            self.path.unlink(missing_ok=True)
+
+
+class _MergedSink:
+    def __init__(self, path: Path):
+        from pypdf import PdfWriter
+
+        self.path = path
+        self.writer = PdfWriter()
+
+    def add(self, report: dict, pdf: bytes) -> None:
+        self.writer.append(io.BytesIO(pdf))
+
+    def close(self) -> None:
+        with open(self.path, "wb") as fh:
+            self.writer.write(fh)
+
+    def discard(self) -> None:
+        """Job fallito: rimuove il file se close() lo ha scritto solo in parte."""
+        self.path.unlink(missing_ok=True)
+
+
+def _set(job_id: int, **values) -> None:
+    with SessionLocal() as db:
+        job = db.get(models.ReportJob, job_id)
+        for key, value in values.items():
+            setattr(job, key, value)
+        job.heartbeat_at = datetime.utcnow()
+        db.commit()
+
+
+def run_job(job_id: int) -> None:
+    sink = None
+    try:
+        with SessionLocal() as db:
+            job = db.get(models.ReportJob, job_id)
+            exam_ids = json.loads(job.exam_ids_json or "[]")
+            options = json.loads(job.options_json or "{}")
+            fmt = job.format
+            settings_payload = report_settings_payload(db, options)
+            source = refs_source(db)
+            job.status = "running"
+            db.commit()
+
+        out_dir = Path(settings.report_output_dir)
+        out_dir.mkdir(parents=True, exist_ok=True)
+        path = out_dir / f"report-job-{job_id}.{fmt}"
+        sink = _ZipSink(path) if fmt == "zip" else _MergedSink(path)
+        generated_at = datetime.now().strftime("%d/%m/%Y %H:%M")
+        pool = get_pool()
+        done = 0
+        for start in range(0, len(exam_ids), LOAD_CHUNK):
+            with SessionLocal() as db:
+                reports = load_reports(db, exam_ids[start : start + LOAD_CHUNK], source, generated_at)
+            # Blocchi per task: abbastanza da tenere occupati tutti i processi
+            size = max(1, min(MAX_TASK_REPORTS, math.ceil(len(reports) / (pool_size() * 2))))
+            tasks = [reports[i : i + size] for i in range(0, len(reports), size)]
+            futures = [pool.submit(render_reports, settings_payload, t) for t in tasks]
+            for task, future in zip(tasks, futures):
+                for report, pdf in zip(task, future.result()):
+                    sink.add(report, pdf)
+            done += len(reports)
+            _set(job_id, done=done)
+        sink.close()
+        _set(job_id, status="done", output_path=str(path), finished_at=datetime.utcnow())
+    except Exception as exc:
+        if sink is not None:
+            try:
+                sink.discard()
+            except Exception:
+                pass  # il job risulta comunque fallito; un file residuo lo rimuove purge_outputs
+        _set(job_id, status="failed", error=f"{exc.__class__.__name__}: {exc}", finished_at=datetime.utcnow())
+
+
+def select_exam_ids(db: Session, exam_ids: List[int] | None, exam_date: date | None) -> List[int]:
+    stmt = select(models.Exam.id)
+    if exam_ids:
+        stmt = stmt.where(models.Exam.id.in_(exam_ids))
+    if exam_date:
+        stmt = stmt.where(models.Exam.exam_date == exam_date)
+    found = set(db.scalars(stmt).all())
+    # Ordine richiesto se la lista è esplicita, altrimenti per id
+    return [i for i in dict.fromkeys(exam_ids) if i in found] if exam_ids else sorted(found)
+
+
+def enqueue(db: Session, exam_ids: List[int], fmt: str, options: dict) -> models.ReportJob:
+    purge_outputs(db)
+    job = models.ReportJob(
+        format=fmt,
+        exam_ids_json=json.dumps(exam_ids),
+        options_json=json.dumps(options),
+        total=len(exam_ids),
+        worker=worker_id(),
+        heartbeat_at=datetime.utcnow(),
+    )
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    threading.Thread(target=run_job, args=(job.id,), name=f"report-job-{job.id}", daemon=True).start()
+    return job
+
+
+def _process_alive(worker: str | None) -> bool:
+    """False se il processo del job (host:pid) è su questa macchina e non esiste più."""
+    host, _, pid = (worker or "").rpartition(":")
+    if not host or not pid.isdigit():
+        return False  # job precedente alla registrazione del processo
+    if host != socket.gethostname() or os.name == "nt":  # su Windows os.kill(pid, 0) non è una verifica
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass  # esiste ma di un altro utente
+    return True
+
+
+def fail_orphans(db: Session) -> int:
+    """Segna come falliti i job attivi il cui thread non esiste più (processo terminato o fermo)."""
+    stale_before = datetime.utcnow() - timedelta(seconds=ORPHAN_SECONDS)
+    jobs = db.scalars(select(models.ReportJob).where(models.ReportJob.status.in_(ACTIVE_STATUSES))).all()
+    orphans = [
+        j.id
+        for j in jobs
+        if not _process_alive(j.worker) or j.heartbeat_at is None or j.heartbeat_at < stale_before
+    ]
+    if orphans:
+        table = models.ReportJob.__table__
+        db.execute(
+            update(table)
+            .where(table.c.id.in_(orphans), table.c.status.in_(ACTIVE_STATUSES))
+            .values(
+                status="failed",
+                error="Interrotto: il processo che eseguiva il job è terminato. Ripetere la stampa.",
+                finished_at=datetime.utcnow(),
+            )
+        )
+        db.commit()
+    return len(orphans)
+
+
+def purge_outputs(db: Session) -> int:
+    """Elimina i file dei job più vecchi di REPORT_OUTPUT_TTL_HOURS (0 = mai); il download risponde 410."""
+    if settings.report_output_ttl_hours <= 0:
+        return 0
+    out_dir = Path(settings.report_output_dir)
+    if not out_dir.is_dir():
+        return 0
+    cutoff = datetime.now().timestamp() - settings.report_output_ttl_hours * 3600
+    removed = []
+    for path in out_dir.glob(OUTPUT_PATTERN):
+        try:
+            if path.stat().st_mtime < cutoff:
+                path.unlink()
+                removed.append(str(path))
+        except FileNotFoundError:
+            pass  # già eliminato da un altro processo
+    if removed:
+        table = models.ReportJob.__table__
+        db.execute(update(table).where(table.c.output_path.in_(removed)).values(output_path=None))
+        db.commit()
+    return len(removed)
+
+
+def cleanup_on_startup() -> None:
+    with SessionLocal() as db:
+        fail_orphans(db)
+        purge_outputs(db)
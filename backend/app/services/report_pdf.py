@@ -0,0 +1,381 @@
+"""
+Referto PDF lato server, con la stessa impaginazione di generatePdf() in report-ui.js.
+
+render_report_pdf riceve solo dati semplici (dict, bytes) e non tocca il DB:
+gira nei processi del pool di services/report_jobs.py.
+"""
+from __future__ import annotations
+
+import io
+import re
+from datetime import date, datetime
+
+from reportlab.graphics import renderPDF
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import mm
+from reportlab.lib.utils import ImageReader, simpleSplit
+from reportlab.pdfgen import canvas
+
+from .report_charts import exam_charts
+
+
+PAGE_W, PAGE_H = A4[0] / mm, A4[1] / mm
+MARGIN = 12
+SAFE_BOTTOM = PAGE_H - 20
+DEFAULT_TITLE = "Referto Curva da Carico Orale di Glucosio"
+
+GREEN = (20, 98, 61)
+BADGE_COLORS = {
+    "normal": ((230, 245, 230), (22, 101, 52)),
+    "warning": ((255, 248, 220), (146, 64, 14)),
+    "danger": ((254, 226, 226), (153, 27, 27)),
+}
+
+
+def _rgb(c):
+    return tuple(x / 255 for x in c)
+
+
+def _fmt_date(value) -> str:
+    if not value:
+        return ""
+    try:
+        d = value if isinstance(value, date) else date.fromisoformat(str(value)[:10])
+    except ValueError:
+        return str(value)
+    return d.strftime("%d/%m/%Y")
+
+
+def split_methodology(raw: str | None) -> dict:
+    """Porting di parseMethodologyField: metodica glicemia/insulina da testo libero."""
+    out = {"glyc": "", "ins": ""}
+    text = (raw or "").strip()
+    if not text:
+        return out
+    for part in (p.strip() for p in re.split(r"\n+|\|+|;+", text.replace("\r", "\n"))):
+        if not part:
+            continue
+        p = re.sub(r"^Metodica analitica\s*:\s*", "", part, flags=re.I).strip()
+        g = re.match(r"^glicemia\s*:\s*(.+)$", p, flags=re.I)
+        i = re.match(r"^insulina\s*:\s*(.+)$", p, flags=re.I)
+        if g:
+            out["glyc"] = g.group(1).strip()
+        elif i:
+            out["ins"] = i.group(1).strip()
+        elif not out["glyc"]:
+            out["glyc"] = p
+        elif not out["ins"]:
+            out["ins"] = p
+    out["ins"] = out["ins"] or out["glyc"]
+    out["glyc"] = out["glyc"] or out["ins"]
+    return out
+
+
+def _rows(times, values, refs) -> list:
+    rows = []
+    for i, t in enumerate(times or []):
+        raw = values[i] if i < len(values or []) else None
+        try:
+            value = float(raw) if raw is not None else None
+        except (TypeError, ValueError):
+            value = None
+        ref = (refs or {}).get(str(t)) or {}
+        rmin, rmax = float(ref.get("min") or 0), float(ref.get("max") or 0)
+        status = "-"
+        if value is not None:
+            status = "BASSO" if value < rmin else "ALTO" if value > rmax else "OK"
+        rows.append((t, value, rmin, rmax, status))
+    return rows
+
+
+class _NumberedCanvas(canvas.Canvas):
+    """Canvas che rimanda il piè di pagina alla fine, quando il numero di pagine è noto."""
+
+    def __init__(self, *args, generated_at: str = "", **kwargs):
+        super().__init__(*args, **kwargs)
+        self._pages = []
+        self._generated_at = generated_at
+
+    def showPage(self):
+        self._pages.append(dict(self.__dict__))
+        self._startPage()
+
+    def save(self):
+        total = len(self._pages)
+        for number, page_state in enumerate(self._pages, start=1):
+            self.__dict__.update(page_state)
+            self._footer(number, total)
+            super().showPage()
+        super().save()
+
+    def _footer(self, number: int, total: int):
+        self.setStrokeGray(190 / 255)
+        self.line(MARGIN * mm, 13 * mm, (PAGE_W - MARGIN) * mm, 13 * mm)
+        self.setFont("Helvetica", 8)
+        self.setFillGray(100 / 255)
+        self.drawString(MARGIN * mm, 8 * mm, f"Generato il {self._generated_at} • CurvaLab WebApp")
+        self.drawRightString((PAGE_W - MARGIN) * mm, 8 * mm, f"Pagina {number}/{total}")
+
+
+class _Report:
+    """Impaginazione dall'alto in mm, come jsPDF."""
+
+    def __init__(self, c: canvas.Canvas, settings: dict):
+        self.c = c
+        self.settings = settings
+        self.logo = None
+        if settings.get("logo"):
+            try:
+                self.logo = ImageReader(io.BytesIO(settings["logo"]))
+            except Exception:
+                self.logo = None  # logo non valido: intestazione solo testo
+        self.y = self.header()
+
+    # Coordinate: (x, y) in mm dall'alto a sinistra
+    def text(self, x, y, value, font="Helvetica", size=10, color=(0, 0, 0), align="left"):
+        self.c.setFont(font, size)
+        self.c.setFillColorRGB(*_rgb(color))
+        if align == "center":
+            self.c.drawCentredString(x * mm, (PAGE_H - y) * mm, value)
+        elif align == "right":
+            self.c.drawRightString(x * mm, (PAGE_H - y) * mm, value)
+        else:
+            self.c.drawString(x * mm, (PAGE_H - y) * mm, value)
+
+    def rect(self, x, y, w, h, fill, radius=0):
+        self.c.setFillColorRGB(*_rgb(fill))
+        if radius:
+            self.c.roundRect(x * mm, (PAGE_H - y - h) * mm, w * mm, h * mm, radius * mm, stroke=0, fill=1)
+        else:
+            self.c.rect(x * mm, (PAGE_H - y - h) * mm, w * mm, h * mm, stroke=0, fill=1)
+
+    def hline(self, y, gray):
+        self.c.setStrokeGray(gray / 255)
+        self.c.line(MARGIN * mm, (PAGE_H - y) * mm, (PAGE_W - MARGIN) * mm, (PAGE_H - y) * mm)
+
+    def wrap(self, value, font, size, width):
+        return simpleSplit(value, font, size, width * mm)
+
+    def draw_logo(self, x, y, w, h):
+        iw, ih = self.logo.getSize()
+        scale = min(w / iw, h / ih)
+        dw, dh = iw * scale, ih * scale
+        self.c.drawImage(
+            self.logo, (x + (w - dw) / 2) * mm, (PAGE_H - y - (h + dh) / 2) * mm, dw * mm, dh * mm, mask="auto"
+        )
+
+    def header(self) -> float:
+        s = self.settings
+        lines = [str(s.get(f"header_line{i}") or "").strip() for i in (1, 2, 3)]
+        if self.logo and not any(lines):
+            self.draw_logo(MARGIN, 6, PAGE_W - MARGIN * 2, 18)
+            self.hline(26.5, 170)
+            return 33
+        if self.logo:
+            self.draw_logo(MARGIN, 7, 36, 16)
+        self.text(PAGE_W / 2, 11, lines[0], "Helvetica-Bold", 11, align="center")
+        self.text(PAGE_W / 2, 16, lines[1], "Helvetica", 9.5, align="center")
+        self.text(PAGE_W / 2, 20.5, lines[2], "Helvetica", 9.5, align="center")
+        self.hline(25, 170)
+        return 31
+
+    def ensure(self, needed: float) -> None:
+        if self.y + needed <= SAFE_BOTTOM:
+            return
+        self.c.showPage()
+        self.y = self.header()
+
+    def section(self, title: str) -> None:
+        self.ensure(12)
+        self.rect(MARGIN, self.y - 4.5, PAGE_W - MARGIN * 2, 7, (240, 248, 242))
+        self.text(MARGIN + 2, self.y, title, "Helvetica-Bold", 11, GREEN)
+        self.y += 5
+
+    def paragraph(self, value: str, size=9.8, font="Helvetica", color=(0, 0, 0), leading=4.3) -> None:
+        lines = self.wrap(value, font, size, PAGE_W - MARGIN * 2)
+        self.ensure(len(lines) * leading + 2)
+        for i, line in enumerate(lines):
+            self.text(MARGIN, self.y + 4 + i * leading, line, font, size, color)
+        self.y += len(lines) * leading + 1
+
+    def badge(self, overall: str, summary: str) -> None:
+        lines = self.wrap(summary.strip() or "-", "Helvetica-Bold", 10.2, PAGE_W - MARGIN * 2 - 6)
+        box_h = max(11, len(lines) * 4.4 + 3)
+        self.ensure(box_h + 2)
+        fill, color = BADGE_COLORS.get(overall, BADGE_COLORS["normal"])
+        self.rect(MARGIN, self.y, PAGE_W - MARGIN * 2, box_h, fill, radius=1.5)
+        for i, line in enumerate(lines):
+            self.text(MARGIN + 2, self.y + 6 + i * 4.4, line, "Helvetica-Bold", 10.2, color)
+        self.y += box_h + 2
+
+    def table(self, title: str, unit: str, rows: list, methodology: str) -> None:
+        self.ensure(28)
+        self.text(MARGIN, self.y, f"{title} ({unit})", "Helvetica-Bold", 10.5)
+        self.y += 2.5
+        table_w = PAGE_W - MARGIN * 2
+        widths = [table_w * f for f in (0.16, 0.22, 0.22, 0.22, 0.18)]
+        row_h = 6.2
+
+        self.rect(MARGIN, self.y + 1, table_w, row_h, (237, 242, 247))
+        x = MARGIN + 1.8
+        for head, w in zip(("Tempo", "Valore", "Ref min", "Ref max", "Stato"), widths):
+            self.text(x, self.y + 5.1, head, "Helvetica-Bold", 9)
+            x += w
+        self.y += row_h + 1.2
+
+        for idx, (t, value, rmin, rmax, status) in enumerate(rows):
+            self.ensure(row_h + 2)
+            if idx % 2 == 0:
+                self.rect(MARGIN, self.y, table_w, row_h, (250, 250, 250))
+            cells = [f"{t}'", "-" if value is None else f"{value:.1f}", f"{rmin:.1f}", f"{rmax:.1f}", status]
+            x = MARGIN + 1.8
+            for i, (cell, w) in enumerate(zip(cells, widths)):
+                alert = i == 4 and status != "OK"
+                self.text(
+                    x, self.y + 4.4, cell, "Helvetica-Bold" if alert else "Helvetica", 9, (185, 28, 28) if alert else (0, 0, 0)
+                )
+                x += w
+            self.y += row_h
+        self.y += 1.2
+
+        if methodology:
+            lines = self.wrap(methodology, "Helvetica", 9, PAGE_W - MARGIN * 2 - 34)
+            block_h = max(6, len(lines) * 4.4) + 2
+            self.ensure(block_h + 1)
+            self.text(MARGIN, self.y + 4, "Metodica analitica:", "Helvetica-Bold", 9)
+            for i, line in enumerate(lines):
+                self.text(MARGIN + 34, self.y + 4 + i * 4.4, line, "Helvetica", 9)
+            self.y += block_h
+        self.y += 1.5
+
+    def charts(self, charts: list) -> None:
+        if not charts:
+            return
+        self.y += 2.5
+        self.section("Grafici")
+        title_gap, label_h, gap = 2.6, 3.2, 5
+        required = 72 if len(charts) == 2 else 68
+        if SAFE_BOTTOM - (self.y + title_gap + label_h + 3) < required:
+            self.c.showPage()
+            self.y = self.header() + 2
+            self.section("Grafici")
+
+        available = max(18, SAFE_BOTTOM - (self.y + title_gap + label_h + 3))
+        if len(charts) == 2:
+            side = max(18, min((PAGE_W - MARGIN * 2 - gap) / 2, available))
+            start = MARGIN + (PAGE_W - MARGIN * 2 - (side * 2 + gap)) / 2
+            slots = [(start, charts[0]), (start + side + gap, charts[1])]
+        else:
+            side = max(18, min(PAGE_W - MARGIN * 2, available, 120))
+            slots = [((PAGE_W - side) / 2, charts[0])]
+
+        box_y = self.y + title_gap + label_h
+        for i, (x, (title, drawing)) in enumerate(slots):
+            self.text(x if len(slots) == 2 else MARGIN, self.y + label_h, title, "Helvetica-Bold", 9.2)
+            self.c.saveState()
+            self.c.translate(x * mm, (PAGE_H - box_y - side) * mm)
+            self.c.scale(side * mm / drawing.width, side * mm / drawing.height)
+            renderPDF.draw(drawing, self.c, 0, 0)
+            self.c.restoreState()
+            self.c.setStrokeGray(225 / 255)
+            self.c.rect(x * mm, (PAGE_H - box_y - side) * mm, side * mm, side * mm, stroke=1, fill=0)
+        self.y = box_y + side + 4.5
+
+
+def render_report_pdf(report: dict) -> bytes:
+    """
+    report: {"settings": {..., "logo": bytes|None}, "patient": {...}, "exam": {...},
+             "interpretation": {...}, "refs_source": str, "generated_at": str}
+    """
+    settings = report["settings"]
+    patient = report.get("patient") or {}
+    exam = report["exam"]
+    interp = report.get("interpretation") or {}
+
+    buffer = io.BytesIO()
+    c = _NumberedCanvas(
+        buffer, pagesize=A4, generated_at=report.get("generated_at") or datetime.now().strftime("%d/%m/%Y %H:%M")
+    )
+    c.setTitle(settings.get("report_title") or DEFAULT_TITLE)
+    r = _Report(c, settings)
+
+    r.text(PAGE_W / 2, r.y, settings.get("report_title") or DEFAULT_TITLE, "Helvetica-Bold", 15, GREEN, "center")
+    r.y += 8
+
+    r.section("Dati paziente")
+    left = [
+        f"Cognome e nome: {patient.get('surname') or ''} {patient.get('name') or ''}",
+        f"Data di nascita: {_fmt_date(patient.get('birth_date')) or '-'}",
+        f"Sesso: {patient.get('sex') or '-'}",
+    ]
+    right = [
+        f"Codice fiscale: {patient.get('fiscal_code') or '-'}",
+        f"N° accettazione: {exam.get('acceptance_number') or '-'}",
+        f"Data esame: {_fmt_date(exam.get('exam_date')) or '-'}",
+    ]
+    for i, (a, b) in enumerate(zip(left, right)):
+        r.text(MARGIN, r.y + i * 5.2, a)
+        r.text(MARGIN + 95, r.y + i * 5.2, b)
+    r.y += 18
+
+    show_g = bool(exam.get("glyc_times"))
+    show_i = exam.get("curve_mode") == "combined" and bool(exam.get("ins_times"))
+
+    r.ensure(20)
+    r.text(MARGIN, r.y, "Dati tecnici esame", "Helvetica-Bold", 10.5)
+    r.y += 5.5
+    r.text(MARGIN, r.y, f"Tipo curva: {'Glicemica + Insulinemica' if show_i else 'Glicemica'}", size=9.5)
+    r.text(MARGIN + 70, r.y, f"Carico glucosio: {exam.get('glucose_load_g') or 75} g", size=9.5)
+    r.text(MARGIN + 125, r.y, f"Modalità gravidanza: {'SÌ' if exam.get('pregnant_mode') else 'NO'}", size=9.5)
+    r.y += 8
+
+    include_interp = settings.get("include_interpretation", True)
+    if include_interp:
+        r.badge(interp.get("overall_status") or "normal", interp.get("summary") or "")
+
+    r.section("Risultati analitici")
+    meth = split_methodology(exam.get("methodology"))
+    if show_g:
+        rows = _rows(exam.get("glyc_times"), exam.get("glyc_values"), exam.get("glyc_refs"))
+        r.table("Curva glicemica", exam.get("glyc_unit") or "mg/dL", rows, meth["glyc"])
+    if show_i:
+        rows = _rows(exam.get("ins_times"), exam.get("ins_values"), exam.get("ins_refs"))
+        r.table("Curva insulinemica", exam.get("ins_unit") or "µUI/mL", rows, meth["ins"])
+
+    r.charts(exam_charts(exam, merge=settings.get("merge_charts", True)))
+
+    if include_interp:
+        r.section("Interpretazione")
+        details = interp.get("details") or {}
+        chunks = [
+            interp.get("summary") or "",
+            f"Glicemia: {details['glycemic_interpretation']}" if details.get("glycemic_interpretation") else "",
+            f"Insulina: {details['insulin_interpretation']}" if show_i and details.get("insulin_interpretation") else "",
+        ]
+        for chunk in filter(None, chunks):
+            r.paragraph(chunk)
+
+    if exam.get("notes"):
+        r.section("Note")
+        r.paragraph(exam["notes"], leading=4.2)
+
+    if report.get("refs_source"):
+        r.paragraph(f"Valori di riferimento: {report['refs_source']}", 8.5, "Helvetica-Oblique", (90, 90, 90), 4.2)
+
+    c.showPage()
+    c.save()
+    return buffer.getvalue()
+
+
+def render_reports(settings: dict, reports: list) -> list:
+    """Task del pool: le impostazioni (con il logo) viaggiano una volta per blocco, non per esame."""
+    return [render_report_pdf({**r, "settings": settings}) for r in reports]
+
+
+def report_filename(report: dict) -> str:
+    patient = report.get("patient") or {}
+
+    def clean(value):
+        return re.sub(r"[^a-z0-9_-]", "_", value or "", flags=re.I)
+
+    return f"Referto_Curva_{clean(patient.get('surname') or 'paziente')}_{clean(patient.get('name'))}_{report['exam'].get('exam_date') or ''}.pdf"
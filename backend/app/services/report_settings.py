@@ -1,39 +1,73 @@
 from __future__ import annotations
 
+import base64
+import binascii
+import hashlib
+import io
+from urllib.parse import unquote_to_bytes
+
+from PIL import Image
+from sqlalchemy import delete, insert, select, update
 from sqlalchemy.orm import Session
 
 from .. import models
+from .cache_versions import REPORT_SETTINGS, VersionedCache
 
 
-def _default() -> models.ReportSettings:
-    return models.ReportSettings(
-        singleton_key="default",
-        report_title="Referto Curva da Carico Orale di Glucosio",
-        header_line1="Centro Polispecialistico Giovanni Paolo I srl",
-        header_line2="Via Ignazio Garbini, 25 - 01100 Viterbo",
-        header_line3="Tel 0761 304260 - www.polispecialisticoviterbo.it",
-        include_interpretation_default=1,
-        merge_charts_default=1,
-        header_logo_data_url=None,
-    )
+LOGO_PATH = "/api/report-settings/logo"
+LOGO_MAX_DATA_URL = 1_200_000
+# Lato massimo in pixel delle varianti: anteprima a schermo e intestazione PDF (18 mm di altezza a ~300 dpi)
+LOGO_VARIANTS = {"screen": (640, 240), "print": (2400, 600)}
+
+
+def _default_values() -> dict:
+    return {
+        "singleton_key": "default",
+        "report_title": "Referto Curva da Carico Orale di Glucosio",
+        "header_line1": "Centro Polispecialistico Giovanni Paolo I srl",
+        "header_line2": "Via Ignazio Garbini, 25 - 01100 Viterbo",
+        "header_line3": "Tel 0761 304260 - www.polispecialisticoviterbo.it",
+        "include_interpretation_default": 1,
+        "merge_charts_default": 1,
+        "header_logo_data_url": None,
+    }
+
+
+def _find(db: Session) -> models.ReportSettings | None:
+    return db.query(models.ReportSettings).filter(models.ReportSettings.singleton_key == "default").first()
+
+
+def get_settings(db: Session) -> models.ReportSettings:
+    """Impostazioni correnti in sola lettura; i valori predefiniti (non salvati) se la riga manca."""
+    return _find(db) or models.ReportSettings(**_default_values())
 
 
 def get_or_create(db: Session) -> models.ReportSettings:
-    row = db.query(models.ReportSettings).filter(models.ReportSettings.singleton_key == "default").first()
-    if row:
-        return row
-    row = _default()
-    db.add(row)
-    db.commit()
-    db.refresh(row)
+    """Riga da modificare: se manca è aggiunta alla sessione, il commit resta al chiamante."""
+    row = _find(db)
+    if row is None:
+        row = models.ReportSettings(**_default_values())
+        db.add(row)
     return row
 
 
+def install(conn) -> None:
+    """Migrazione: riga delle impostazioni predefinite, così le letture non devono crearla."""
+    table = models.ReportSettings.__table__
+    if conn.execute(select(table.c.id).where(table.c.singleton_key == "default")).first() is None:
+        conn.execute(insert(table).values(**_default_values()))
+
+
+def logo_url(sha256: str | None) -> str | None:
+    return f"{LOGO_PATH}?v={sha256}" if sha256 else None
+
+
 def row_to_payload(row: models.ReportSettings) -> dict:
     include = bool(row.include_interpretation_default)
     merge = bool(row.merge_charts_default)
 
     # Manteniamo sia i nomi legacy che i nuovi alias *_pdf per retrocompatibilità.
+    # Il logo non viaggia nel JSON: solo URL (versionato con l'hash) e hash.
     return {
         "report_title": row.report_title,
         "header_line1": row.header_line1,
@@ -43,11 +77,22 @@ def row_to_payload(row: models.ReportSettings) -> dict:
         "merge_charts_default": merge,
         "include_interpretation_pdf": include,
         "merge_charts_pdf": merge,
-        "header_logo_data_url": row.header_logo_data_url,
+        "header_logo_url": logo_url(row.header_logo_sha256),
+        "header_logo_hash": row.header_logo_sha256,
     }
 
 
+# Letture dalla cache in-process; ogni commit che scrive ReportSettings incrementa la versione
+_current = VersionedCache(REPORT_SETTINGS, lambda db: row_to_payload(get_settings(db)), models.ReportSettings)
+
+
+def current_payload(db: Session) -> dict:
+    """row_to_payload delle impostazioni correnti, condiviso tra le richieste: in sola lettura."""
+    return _current.get(db)
+
+
 def update_from_payload(db: Session, payload: dict) -> dict:
+    """Aggiorna i campi presenti nel payload; header_logo_data_url assente lascia il logo invariato."""
     row = get_or_create(db)
 
     include = payload.get("include_interpretation_pdf")
@@ -65,12 +110,104 @@ def update_from_payload(db: Session, payload: dict) -> dict:
     row.include_interpretation_default = 1 if bool(include) else 0
     row.merge_charts_default = 1 if bool(merge) else 0
 
-    logo = payload.get("header_logo_data_url", row.header_logo_data_url)
-    if logo and len(str(logo)) > 1_200_000:
-        logo = None  # protezione dimensione eccessiva in SQLite
-    row.header_logo_data_url = str(logo) if logo else None
+    if "header_logo_data_url" in payload:
+        logo = payload["header_logo_data_url"]
+        if logo and len(str(logo)) > LOGO_MAX_DATA_URL:
+            logo = None  # protezione dimensione eccessiva
+        row.header_logo_sha256 = (
+            store_logo(db, decode_data_url(str(logo)), data_url_media_type(str(logo))) if logo else None
+        )
+        row.header_logo_data_url = None
+        prune_logos(db, row.header_logo_sha256)
 
     db.add(row)
     db.commit()
     db.refresh(row)
     return row_to_payload(row)
+
+
+def decode_data_url(raw: str | None) -> bytes | None:
+    """Byte dell'immagine di un data URL (None se assente o non valido)."""
+    raw = raw or ""
+    if not raw.startswith("data:") or "," not in raw:
+        return None
+    meta, data = raw.split(",", 1)
+    try:
+        return base64.b64decode(data) if meta.endswith(";base64") else unquote_to_bytes(data)
+    except (binascii.Error, ValueError):
+        return None
+
+
+def data_url_media_type(raw: str | None) -> str | None:
+    """Tipo dichiarato nel data URL se è un'immagine (es. image/svg+xml), altrimenti None."""
+    raw = raw or ""
+    if not raw.startswith("data:") or "," not in raw:
+        return None
+    media_type = raw[5 : raw.index(",")].split(";", 1)[0].strip().lower()
+    return media_type if media_type.startswith("image/") else None
+
+
+def _logo_row(variant: str, media_type: str, data: bytes, size=(None, None)) -> dict:
+    return {"variant": variant, "media_type": media_type, "width": size[0], "height": size[1], "data": data}
+
+
+def _logo_variants(raw: bytes, declared: str | None = None) -> list[dict]:
+    """
+    Originale più varianti ridotte; un'immagine che Pillow non legge (es. SVG) resta solo
+    come originale. declared: tipo del data URL, usato quando Pillow non lo riconosce.
+    """
+    fallback = declared or "application/octet-stream"
+    try:
+        img = Image.open(io.BytesIO(raw))
+        img.load()
+    except Exception:
+        return [_logo_row("original", fallback, raw)]
+
+    out = [_logo_row("original", Image.MIME.get(img.format, fallback), raw, img.size)]
+    alpha = img.mode in ("RGBA", "LA", "P", "PA") or "transparency" in img.info
+    for variant, bound in LOGO_VARIANTS.items():
+        if img.width <= bound[0] and img.height <= bound[1]:
+            continue  # già abbastanza piccola: si usa l'originale
+        small = img.convert("RGBA" if alpha else "RGB")
+        small.thumbnail(bound, Image.LANCZOS)
+        buf = io.BytesIO()
+        small.save(buf, "PNG" if alpha else "JPEG", **({"optimize": True} if alpha else {"quality": 90}))
+        out.append(_logo_row(variant, "image/png" if alpha else "image/jpeg", buf.getvalue(), small.size))
+    return out
+
+
+def store_logo(db, raw: bytes | None, media_type: str | None = None) -> str | None:
+    """Salva il logo (decodificato una sola volta) con le varianti; restituisce l'hash. db: Session o Connection."""
+    if not raw:
+        return None
+    sha = hashlib.sha256(raw).hexdigest()
+    table = models.ReportLogo.__table__
+    if db.execute(select(table.c.sha256).where(table.c.sha256 == sha).limit(1)).first() is None:
+        db.execute(insert(table), [{"sha256": sha, **v} for v in _logo_variants(raw, media_type)])
+    return sha
+
+
+def prune_logos(db, keep: str | None) -> None:
+    table = models.ReportLogo.__table__
+    db.execute(delete(table).where(table.c.sha256 != keep) if keep else delete(table))
+
+
+def get_logo(db: Session, sha256: str | None, variant: str = "original") -> models.ReportLogo | None:
+    """Variante richiesta del logo, o l'originale se la variante non serve (immagine già piccola)."""
+    if not sha256:
+        return None
+    return db.get(models.ReportLogo, (sha256, variant)) or db.get(models.ReportLogo, (sha256, "original"))
+
+
+def logo_bytes(db: Session, sha256: str | None, variant: str = "print") -> bytes | None:
+    logo = get_logo(db, sha256, variant)
+    return logo.data if logo else None
+
+
+def convert_legacy_logos(conn) -> None:
+    """Migrazione: data URL salvati in report_settings -> report_logos."""
+    table = models.ReportSettings.__table__
+    rows = conn.execute(select(table.c.id, table.c.header_logo_data_url).where(table.c.header_logo_data_url.is_not(None))).all()
+    for row_id, data_url in rows:
+        sha = store_logo(conn, decode_data_url(data_url), data_url_media_type(data_url))
+        conn.execute(update(table).where(table.c.id == row_id).values(header_logo_sha256=sha, header_logo_data_url=None))
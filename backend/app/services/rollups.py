@@ -0,0 +1,177 @@
+"""
+Tabelle riassuntive per i cruscotti: numero di esami per giorno (exam_rollup_daily)
+e per mese (exam_rollup_monthly), per esito, curve_mode, medico richiedente e gravidanza.
+
+Sono aggiornate nella stessa transazione di ogni scrittura sugli esami (creazione,
+cancellazione di esami o pazienti, import, reinterpretazione che cambia l'esito):
+i conteggi delle statistiche di coorte leggono O(giorni) righe invece di O(esami).
+
+    python -m app.services.rollups rebuild   # ricostruzione completa da exams (backfill)
+    python -m app.services.rollups check     # confronto con exams; exit 1 se divergono
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+from collections import Counter
+from datetime import date
+from typing import Iterable, List, Mapping, NamedTuple
+
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from .. import models
+
+
+CHUNK_SIZE = 1000
+
+DAILY = models.ExamRollupDaily.__table__
+MONTHLY = models.ExamRollupMonthly.__table__
+_UPSERT = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+
+class RollupKey(NamedTuple):
+    day: date
+    overall_status: str
+    curve_mode: str
+    requester_doctor: str
+    pregnant_mode: int
+
+
+KEY_FIELDS = RollupKey._fields[1:]
+
+
+def exam_key(exam) -> RollupKey:
+    """Chiave di un esame: oggetto Exam, riga o dizionario di valori colonna (exam_values)."""
+    get = exam.get if isinstance(exam, Mapping) else lambda name: getattr(exam, name, None)
+    return RollupKey(
+        get("exam_date"),
+        get("overall_status") or "",
+        get("curve_mode") or "",
+        get("requester_doctor") or "",
+        1 if get("pregnant_mode") else 0,
+    )
+
+
+def key_columns():
+    E = models.Exam
+    return (E.exam_date, E.overall_status, E.curve_mode, E.requester_doctor, E.pregnant_mode)
+
+
+def changes(added: Iterable[RollupKey] = (), removed: Iterable[RollupKey] = ()) -> Counter:
+    """Variazione dei conteggi per chiave."""
+    delta = Counter(added)
+    delta.subtract(removed)
+    return delta
+
+
+def _by_month(counts: Counter) -> Counter:
+    out: Counter = Counter()
+    for key, n in counts.items():
+        out[key._replace(day=key.day.replace(day=1))] += n
+    return out
+
+
+def _rows(table, counts: Counter) -> List[dict]:
+    date_col = table.primary_key.columns.values()[0].name
+    return [{date_col: k.day, **dict(zip(KEY_FIELDS, k[1:])), "exam_count": n} for k, n in counts.items() if n]
+
+
+def _dialect(db: Session | Connection) -> str:
+    return db.dialect.name if isinstance(db, Connection) else db.get_bind().dialect.name
+
+
+def _upsert(db: Session | Connection, table, rows: List[dict]) -> None:
+    upsert = _UPSERT.get(_dialect(db))
+    if upsert is not None:
+        stmt = upsert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[c.name for c in table.primary_key],
+            set_={"exam_count": table.c.exam_count + stmt.excluded.exam_count},
+        )
+        db.execute(stmt, rows)
+        return
+    for row in rows:
+        where = [c == row[c.name] for c in table.primary_key]
+        found = db.execute(update(table).where(*where).values(exam_count=table.c.exam_count + row["exam_count"]))
+        if not found.rowcount:
+            db.execute(insert(table).values(row))
+
+
+def apply(db: Session | Connection, delta: Counter) -> None:
+    """Somma delta alle due tabelle, nella transazione corrente di db (Session o Connection)."""
+    for table, counts in ((DAILY, delta), (MONTHLY, _by_month(delta))):
+        rows = _rows(table, counts)
+        if not rows:
+            continue
+        _upsert(db, table, rows)
+        if any(r["exam_count"] < 0 for r in rows):
+            db.execute(delete(table).where(table.c.exam_count <= 0))
+
+
+def current_counts(db: Session | Connection) -> Counter:
+    """Conteggi per giorno ricalcolati da exams."""
+    cols = key_columns()
+    rows = db.execute(select(*cols, func.count().label("n")).group_by(*cols)).mappings()
+    counts: Counter = Counter()
+    for r in rows:
+        counts[exam_key(r)] += r["n"]  # NULL e '' finiscono nella stessa chiave
+    return counts
+
+
+def stored_counts(db: Session | Connection, table=DAILY) -> Counter:
+    date_col = table.primary_key.columns.values()[0]
+    rows = db.execute(select(date_col, *(table.c[k] for k in KEY_FIELDS), table.c.exam_count))
+    return Counter({RollupKey(*r[:-1]): r[-1] for r in rows if r[-1]})
+
+
+def rebuild(db: Session | Connection) -> int:
+    """Ricostruisce entrambe le tabelle da exams; restituisce il numero di esami contati."""
+    counts = current_counts(db)
+    for table, table_counts in ((DAILY, counts), (MONTHLY, _by_month(counts))):
+        db.execute(delete(table))
+        rows = _rows(table, table_counts)
+        for start in range(0, len(rows), CHUNK_SIZE):
+            db.execute(insert(table), rows[start : start + CHUNK_SIZE])
+    return sum(counts.values())
+
+
+def check(db: Session | Connection) -> List[dict]:
+    """Differenze tra tabelle riassuntive ed exams (lista vuota = coerenti)."""
+    expected = current_counts(db)
+    out = []
+    for table, table_expected in ((DAILY, expected), (MONTHLY, _by_month(expected))):
+        stored = stored_counts(db, table)
+        for key in sorted(set(stored) | set(table_expected)):
+            if stored[key] != table_expected[key]:
+                out.append(
+                    {"table": table.name, **key._asdict(), "expected": table_expected[key], "stored": stored[key]}
+                )
+    return out
+
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Tabelle riassuntive degli esami")
+    parser.add_argument("command", choices=["rebuild", "check"])
+    args = parser.parse_args(argv)
+
+    from ..database import engine
+    from ..migrations import run_migrations
+
+    run_migrations(engine)
+    with engine.begin() as conn:
+        if args.command == "rebuild":
+            print(f"Tabelle riassuntive ricostruite: {rebuild(conn)} esami")
+            return 0
+        diffs = check(conn)
+    for d in diffs:
+        print(json.dumps(d, default=str))
+    print("Tabelle riassuntive coerenti" if not diffs else f"{len(diffs)} righe divergenti")
+    return 1 if diffs else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,103 @@
+"""
+Sincronizzazione incrementale con i client offline (archivio LocalStorage del frontend).
+
+Pazienti ed esami hanno un uid stabile e un change_seq preso da un contatore globale
+(sync_state) a ogni inserimento o modifica; le cancellazioni lasciano una riga in
+sync_tombstones con il proprio numero. Così:
+
+- crud.sync.changes(since): ciò che è cambiato dopo `since`, in ordine di numero e a
+  pagine; il client riparte dall'`until` ricevuto;
+- crud.sync.push(...): modifiche del client in blocco, ognuna con il change_seq su cui si basa
+  (base_seq). Se la riga nel frattempo è cambiata o è stata cancellata sul server la
+  modifica non si applica e torna come conflitto: la versione del server arriva al
+  client col successivo changes().
+
+I numeri sono assegnati in before_flush per ogni scrittura ORM; insert e delete Core
+(creazione e cancellazione esami e pazienti, import massivo) usano next_seqs e
+record_deletions. L'UPDATE sul contatore tiene il lock
+sulla riga fino al commit, quindi i numeri diventano visibili in ordine crescente
+e un client non salta modifiche di transazioni ancora aperte.
+"""
+from __future__ import annotations
+
+from datetime import datetime
+from typing import Iterable
+
+from sqlalchemy import bindparam, event, func, insert, select, update
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from .. import models
+
+
+CHUNK_SIZE = 1000
+
+ENTITIES = {models.Patient: "patient", models.Exam: "exam"}
+
+
+def next_seqs(db: Session | Connection, n: int) -> int:
+    """Prenota n numeri consecutivi; restituisce il primo."""
+    state = models.SyncState.__table__
+    last = db.execute(
+        update(state).where(state.c.id == 1).values(last_seq=state.c.last_seq + n).returning(state.c.last_seq)
+    ).scalar()
+    if last is None:
+        db.execute(insert(state).values(id=1, last_seq=n))
+        last = n
+    return last - n + 1
+
+
+@event.listens_for(Session, "before_flush")
+def _assign_change_seqs(session, flush_context, instances):
+    changed = [o for o in session.new if type(o) in ENTITIES]
+    changed += [
+        o
+        for o in session.dirty
+        if type(o) in ENTITIES and o not in session.deleted and session.is_modified(o, include_collections=False)
+    ]
+    deleted = [o for o in session.deleted if type(o) in ENTITIES]
+    if not changed and not deleted:
+        return
+    conn = session.connection()
+    if changed:
+        seq = next_seqs(conn, len(changed))
+        for obj in changed:
+            obj.uid = obj.uid or models._new_uid()
+            obj.change_seq = seq
+            seq += 1
+    for model, entity in ENTITIES.items():
+        record_deletions(conn, entity, [o.uid for o in deleted if type(o) is model])
+
+
+def record_deletions(db: Session | Connection, entity: str, uids: Iterable[str | None]) -> None:
+    """Tombstone per le righe cancellate (uid NULL: righe mai numerate, ignorate)."""
+    uids = [u for u in uids if u]
+    if not uids:
+        return
+    seq = next_seqs(db, len(uids))
+    now = datetime.utcnow()
+    db.execute(
+        insert(models.SyncTombstone.__table__),
+        [{"seq": seq + i, "entity": entity, "uid": uid, "deleted_at": now} for i, uid in enumerate(uids)],
+    )
+
+
+def install(conn: Connection) -> None:
+    """Migrazione: uid e change_seq per le righe già presenti, nell'ordine di id."""
+    if conn.execute(select(models.SyncState.id)).first() is None:
+        conn.execute(insert(models.SyncState.__table__).values(id=1, last_seq=0))
+    for table in (models.Patient.__table__, models.Exam.__table__):
+        ids = conn.execute(select(table.c.id).where(table.c.change_seq.is_(None)).order_by(table.c.id)).scalars().all()
+        if not ids:
+            continue
+        seq = next_seqs(conn, len(ids))
+        stmt = (
+            update(table)
+            .where(table.c.id == bindparam("_id"))
+            .values(uid=func.coalesce(table.c.uid, bindparam("_uid")), change_seq=bindparam("_seq"))
+        )
+        for start in range(0, len(ids), CHUNK_SIZE):
+            chunk = ids[start : start + CHUNK_SIZE]
+            conn.execute(stmt, [{"_id": i, "_uid": models._new_uid(), "_seq": seq + start + k} for k, i in enumerate(chunk)])
+
+
@@ -0,0 +1,167 @@
+"""
+Benchmark: costo per esame dell'interpretazione, scalare (interpret_exam, anteprima e
+creazione) e vettoriale (interpret_exams_batch, import e reinterpretazione), e latenza
+dell'anteprima di un singolo esame (POST /api/exams/preview).
+
+    cd backend && python -m bench.interpretation [--exams 5000] [--repeat 5] [--requests 2000]
+
+Gli esami sono sintetici ma realistici (curve a 3-6 tempi, range ereditati dal profilo,
+~30% in gravidanza, ~40% combinati). Ogni misura è il minimo su --repeat ripetizioni,
+con il rule set di default, con un criterio aggiuntivo (OMS 1 ora, glicemia a 60' >= 155)
+e, per confronto, compilando il rule set a ogni esame. L'anteprima gira in un processo
+separato su un DB SQLite temporaneo (come bench.json_responses), client TestClient compreso.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from app.services.batch_interpretation import interpret_exams_batch
+from app.services.interpretation import interpret_exam
+from app.services.interpretation_rules import DEFAULT_PLAN, compile_rules
+from app.services.reference_profiles import DEFAULT_GLYC_REFS, DEFAULT_INS_REFS, PREGNANT_GLYC_REFS
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+
+WHO_1H = {
+    "criteria": [
+        {
+            "code": "who_1h_155",
+            "series": "glyc",
+            "time": 60,
+            "op": ">=",
+            "value": 155,
+            "pregnant": False,
+            "severity": "warning",
+            "message": "Glicemia a 60' >= 155 mg/dL (criterio OMS a 1 ora).",
+        }
+    ]
+}
+
+
+def make_payloads(n: int, seed: int = 1) -> list[dict]:
+    rnd = random.Random(seed)
+    out = []
+    for _ in range(n):
+        times = sorted(rnd.sample([0, 30, 60, 90, 120, 180], rnd.randint(3, 6)) + [0, 120])
+        times = sorted(set(times))
+        pregnant = rnd.random() < 0.3
+        combined = rnd.random() < 0.4
+        glyc_refs = PREGNANT_GLYC_REFS if pregnant else DEFAULT_GLYC_REFS
+        out.append(
+            {
+                "curve_mode": "combined" if combined else "glyc",
+                "pregnant_mode": pregnant,
+                "glyc_times": times,
+                "glyc_values": [round(rnd.uniform(70, 240), 1) for _ in times],
+                "glyc_refs": {str(t): dict(glyc_refs[str(t)]) for t in times},
+                "ins_times": times if combined else [],
+                "ins_values": [round(rnd.uniform(3, 150), 1) for _ in times] if combined else [],
+                "ins_refs": {str(t): dict(DEFAULT_INS_REFS[str(t)]) for t in times} if combined else {},
+            }
+        )
+    return out
+
+
+def _best(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def measure(payloads: list[dict], repeat: int) -> dict:
+    who = compile_rules(WHO_1H)
+    cases = {
+        "scalar": lambda: [interpret_exam(p) for p in payloads],
+        "scalar+who_1h": lambda: [interpret_exam(p, who) for p in payloads],
+        # Confronto: rule set dichiarativo letto a ogni esame invece che compilato una volta
+        "scalar+compile": lambda: [interpret_exam(p, compile_rules(WHO_1H)) for p in payloads],
+        "batch": lambda: interpret_exams_batch(payloads, DEFAULT_PLAN),
+        "batch+who_1h": lambda: interpret_exams_batch(payloads, who),
+    }
+    for fn in cases.values():
+        fn()  # riscaldamento
+    return {name: round(_best(fn, repeat) * 1e6 / len(payloads), 2) for name, fn in cases.items()}
+
+
+def measure_preview(requests: int) -> dict:
+    from fastapi.testclient import TestClient
+
+    from app.main import app
+
+    client = TestClient(app)
+    payloads = [
+        {**p, "patient_id": 1, "exam_date": "2024-01-10", "glyc_refs": {}, "ins_refs": {}}
+        for p in make_payloads(200, seed=2)
+    ]
+    for p in payloads[:20]:  # riscaldamento (profilo in cache)
+        client.post("/api/exams/preview", json=p)
+    latencies = []
+    cpu0 = time.process_time()
+    for i in range(requests):
+        t0 = time.perf_counter()
+        client.post("/api/exams/preview", json=payloads[i % len(payloads)])
+        latencies.append(time.perf_counter() - t0)
+    cpu = time.process_time() - cpu0
+    latencies.sort()
+    return {
+        "cpu_us_per_request": round(cpu * 1e6 / requests, 1),
+        "p50_us": round(latencies[len(latencies) // 2] * 1e6, 1),
+        "p90_us": round(latencies[int(len(latencies) * 0.9)] * 1e6, 1),
+    }
+
+
+def _run_preview(args) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {
+            **os.environ,
+            "DATABASE_URL": f"sqlite:///{Path(tmp) / 'bench.db'}",
+            "REINTERPRET_ON_STARTUP": "false",
+        }
+        cmd = [sys.executable, "-m", "bench.interpretation", "--step", "preview", "--requests", str(args.requests)]
+        out = subprocess.run(cmd, cwd=BACKEND_DIR, env=env, check=True, capture_output=True, text=True).stdout
+    return json.loads(out)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--exams", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--requests", type=int, default=2000, help="anteprime singole (0 = non misurare)")
+    parser.add_argument("--out", help="file JSON con i risultati")
+    parser.add_argument("--step", choices=["preview"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.step == "preview":
+        print(json.dumps(measure_preview(args.requests)))
+        return
+
+    results = measure(make_payloads(args.exams), args.repeat)
+    preview = _run_preview(args) if args.requests else None
+
+    print(f"{'caso':<18}{'µs/esame':>10}")
+    for name, us in results.items():
+        print(f"{name:<18}{us:>10}")
+    if preview:
+        print(
+            f"\nanteprima singola: CPU {preview['cpu_us_per_request']} µs/richiesta, "
+            f"p50 {preview['p50_us']} µs, p90 {preview['p90_us']} µs"
+        )
+    if args.out:
+        Path(args.out).write_text(
+            json.dumps({"params": vars(args), "results": results, "preview": preview}, indent=2)
+        )
+
+
+if __name__ == "__main__":
+    main()
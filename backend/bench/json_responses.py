@@ -0,0 +1,139 @@
+"""
+Benchmark: CPU per richiesta di dettaglio esame e lista pazienti, prima e dopo il
+percorso veloce (FAST_JSON) e con la compressione (COMPRESS_RESPONSES).
+
+    cd backend && python -m bench.json_responses [--patients 500] [--exams 300] [--requests 400]
+
+Ogni configurazione gira in un processo separato (le impostazioni si leggono
+all'avvio) sullo stesso DB SQLite temporaneo. Si misura il tempo CPU del processo
+per richiesta, client TestClient compreso: il costo del client è uguale in tutte
+le configurazioni, quindi le differenze sono tutte lato server.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+
+CONFIGS = {
+    "baseline": {"FAST_JSON": "false", "COMPRESS_RESPONSES": "false"},
+    "fast_json": {"FAST_JSON": "true", "COMPRESS_RESPONSES": "false"},
+    "fast_json+compress": {"FAST_JSON": "true", "COMPRESS_RESPONSES": "true"},
+}
+
+
+def _client():
+    from fastapi.testclient import TestClient
+
+    from app.main import app
+
+    return TestClient(app)
+
+
+def seed(patients: int, exams: int) -> None:
+    client = _client()
+    ids = []
+    for i in range(patients):
+        r = client.post(
+            "/api/patients",
+            json={"surname": f"Cognome{i:05d}", "name": f"Nome{i}", "birth_date": "1970-01-01", "sex": "F" if i % 2 else "M"},
+        )
+        ids.append(r.json()["id"])
+    rows = [
+        json.dumps(
+            {
+                "patient_id": ids[i % len(ids)],
+                "exam_date": "2024-01-10",
+                "curve_mode": "combined",
+                "methodology": "Glicemia: Esochinasi | Insulina: CLIA",
+                "glyc_times": [0, 30, 60, 90, 120, 180],
+                "glyc_values": [90 + i % 20, 160, 150 + i % 60, 140, 120 + i % 50, 95],
+                "ins_times": [0, 30, 60, 90, 120, 180],
+                "ins_values": [6, 40, 60 + i % 30, 35, 20, 8],
+            }
+        )
+        for i in range(exams)
+    ]
+    client.post("/api/exams/import", content="\n".join(rows))
+
+
+def measure(requests: int) -> dict:
+    client = _client()
+    exam_ids = [e["id"] for e in client.get("/api/exams?limit=500").json()]
+    endpoints = {
+        "exam_detail": lambda i: f"/api/exams/{exam_ids[i % len(exam_ids)]}",
+        "patient_list": lambda i: "/api/patients?limit=200",
+    }
+    headers = {"Accept-Encoding": "br, gzip"}
+    out = {}
+    for name, url in endpoints.items():
+        for i in range(20):  # riscaldamento (connessioni, cache del profilo)
+            client.get(url(i), headers=headers)
+        size = 0
+        cpu0, wall0 = time.process_time(), time.perf_counter()
+        for i in range(requests):
+            r = client.get(url(i), headers=headers)
+            size += int(r.headers.get("content-length") or len(r.content))
+        cpu, wall = time.process_time() - cpu0, time.perf_counter() - wall0
+        out[name] = {
+            "cpu_ms_per_request": round(cpu * 1000 / requests, 3),
+            "wall_ms_per_request": round(wall * 1000 / requests, 3),
+            "bytes_per_response": size // requests,
+            "content_encoding": r.headers.get("content-encoding", "identity"),
+        }
+    return out
+
+
+def _run(step: str, db_path: Path, env_overrides: dict, args) -> str:
+    env = {
+        **os.environ,
+        **env_overrides,
+        "DATABASE_URL": f"sqlite:///{db_path}",
+        "REINTERPRET_ON_STARTUP": "false",
+    }
+    cmd = [sys.executable, "-m", "bench.json_responses", "--step", step, "--patients", str(args.patients),
+           "--exams", str(args.exams), "--requests", str(args.requests)]
+    return subprocess.run(cmd, cwd=BACKEND_DIR, env=env, check=True, capture_output=True, text=True).stdout
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--patients", type=int, default=500)
+    parser.add_argument("--exams", type=int, default=300)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--out", help="file JSON con i risultati")
+    parser.add_argument("--step", choices=["seed", "measure"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.step == "seed":
+        seed(args.patients, args.exams)
+        return
+    if args.step == "measure":
+        print(json.dumps(measure(args.requests)))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / "bench.db"
+        _run("seed", db_path, CONFIGS["baseline"], args)
+        results = {name: json.loads(_run("measure", db_path, env, args)) for name, env in CONFIGS.items()}
+
+    print(f"{'configurazione':<22}{'endpoint':<15}{'CPU ms/req':>12}{'wall ms/req':>13}{'byte':>9}  encoding")
+    for name, endpoints in results.items():
+        for endpoint, r in endpoints.items():
+            print(
+                f"{name:<22}{endpoint:<15}{r['cpu_ms_per_request']:>12}{r['wall_ms_per_request']:>13}"
+                f"{r['bytes_per_response']:>9}  {r['content_encoding']}"
+            )
+    if args.out:
+        Path(args.out).write_text(json.dumps({"params": vars(args), "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Fixture comuni: l'app su un database SQLite temporaneo, con migrazioni applicate.
+
+Le variabili d'ambiente sono impostate prima di importare app.main (settings e engine
+sono creati all'import). Le cache verificano la versione nel DB una volta per ora: i
+conteggi di query delle richieste non dipendono da quando scade l'intervallo.
+"""
+from __future__ import annotations
+
+import os
+import shutil
+import tempfile
+
+import pytest
+
+_TMP = tempfile.mkdtemp(prefix="curvelab-tests-")
+os.environ.update(
+    DATABASE_URL=f"sqlite:///{_TMP}/curve_lab.db",
+    RUN_MIGRATIONS_ON_STARTUP="true",
+    REINTERPRET_ON_STARTUP="false",
+    METRICS_ENABLED="true",
+    SLOW_REQUEST_MS="0",
+    CACHE_CHECK_INTERVAL_MS="3600000",
+    REPORT_OUTPUT_DIR=f"{_TMP}/reports",
+    REPORT_CACHE_DIR=f"{_TMP}/cache",
+)
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+from app.main import app  # noqa: E402
+
+
+def pytest_addoption(parser):
+    parser.addoption("--run-perf", action="store_true", help="esegue anche i test di prestazioni (marker perf)")
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "perf: confronti di tempi, saltati senza --run-perf (rumorosi su CI condivisa)")
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption("--run-perf"):
+        return
+    skip = pytest.mark.skip(reason="test di prestazioni: usare --run-perf")
+    for item in items:
+        if "perf" in item.keywords:
+            item.add_marker(skip)
+
+
+@pytest.fixture(scope="session")
+def client():
+    with TestClient(app) as c:
+        # Cache del profilo attivo e versione registrata al primo salvataggio: costi una tantum
+        assert c.get("/api/presets").status_code == 200
+        warm = c.post("/api/patients", json={"surname": "Warmup", "name": "Test"}).json()
+        for _ in range(2):
+            assert c.post("/api/exams", json=_exam_payload(warm["id"])).status_code == 201
+        yield c
+    shutil.rmtree(_TMP, ignore_errors=True)
+
+
+@pytest.fixture
+def patient_id(client) -> int:
+    r = client.post("/api/patients", json={"surname": "Rossi", "name": "Maria", "sex": "F"})
+    assert r.status_code == 201
+    return r.json()["id"]
+
+
+def _exam_payload(patient_id: int, times=(0, 60, 120), combined: bool = False) -> dict:
+    glyc = [90 + 30 * i for i in range(len(times))]
+    data = {
+        "patient_id": patient_id,
+        "exam_date": "2026-01-15",
+        "curve_mode": "combined" if combined else "glyc",
+        "glyc_times": list(times),
+        "glyc_values": glyc,
+    }
+    if combined:
+        data.update(ins_times=list(times), ins_values=[5 + 10 * i for i in range(len(times))])
+    return data
+
+
+@pytest.fixture
+def exam_payload():
+    """Payload di POST /api/exams: exam_payload(patient_id, times=(0, 60, 120), combined=False)."""
+    return _exam_payload
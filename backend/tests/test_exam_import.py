@@ -0,0 +1,31 @@
+"""
+Import NDJSON (POST /api/exams/import): ogni esame del blocco riceve i propri punti.
+Gli id restituiti dall'INSERT sono ricondotti alle righe tramite l'uid, non per posizione.
+"""
+from __future__ import annotations
+
+import json
+
+
+def test_import_attaches_points_to_their_exam(client, patient_id):
+    records = [
+        {
+            "patient_id": patient_id,
+            "exam_date": f"2026-02-{day:02d}",
+            "curve_mode": "glyc",
+            "glyc_times": [0, 60, 120][: 2 + day % 2],
+            "glyc_values": [80 + day, 140 + day, 120 + day][: 2 + day % 2],
+        }
+        for day in range(1, 8)
+    ]
+    body = "\n".join(json.dumps(r) for r in records)
+    r = client.post("/api/exams/import", content=body, headers={"content-type": "application/x-ndjson"})
+    assert r.status_code == 200, r.text
+    assert r.json()["imported"] == len(records)
+
+    listed = client.get("/api/exams", params={"patient_id": patient_id}).json()
+    assert len(listed) == len(records)
+    expected = {r["exam_date"]: (r["glyc_times"], r["glyc_values"]) for r in records}
+    for item in listed:
+        exam = client.get(f"/api/exams/{item['id']}").json()
+        assert (exam["glyc_times"], exam["glyc_values"]) == expected[exam["exam_date"]]
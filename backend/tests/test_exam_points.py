@@ -0,0 +1,35 @@
+"""
+Curve salvate in exam_points: i payload con tempi ripetuti o valori senza tempo sono
+normalizzati come gli esami storici, e i range con un solo estremo tornano in lettura.
+"""
+from __future__ import annotations
+
+from sqlalchemy import update
+
+from app import models
+from app.database import SessionLocal
+
+
+def test_create_normalizes_repeated_times(client, patient_id, exam_payload):
+    payload = {**exam_payload(patient_id), "glyc_times": [0, 60, 60, 120], "glyc_values": [90, 150, 999, 120, 77]}
+    r = client.post("/api/exams", json=payload)
+    assert r.status_code == 201, r.text
+    created = r.json()
+    assert (created["glyc_times"], created["glyc_values"]) == ([0, 60, 120], [90, 150, 120])
+
+    stored = client.get(f"/api/exams/{created['id']}").json()
+    assert (stored["glyc_times"], stored["glyc_values"]) == ([0, 60, 120], [90, 150, 120])
+
+
+def test_half_open_refs_are_returned(client, patient_id, exam_payload):
+    exam_id = client.post("/api/exams", json=exam_payload(patient_id)).json()["id"]
+    P = models.ExamPoint
+    with SessionLocal() as db:
+        glyc = (P.exam_id == exam_id) & (P.series == "glyc")
+        db.execute(update(P).where(glyc, P.time_min == 60).values(ref_max=None))
+        db.execute(update(P).where(glyc, P.time_min == 120).values(ref_min=None))
+        db.commit()
+
+    refs = client.get(f"/api/exams/{exam_id}").json()["glyc_refs"]
+    assert refs["60"]["max"] is None and refs["60"]["min"] is not None
+    assert refs["120"]["min"] is None and refs["120"]["max"] is not None
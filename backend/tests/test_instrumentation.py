@@ -0,0 +1,22 @@
+"""Hook di conteggio delle query (app/instrumentation.py) con statement che falliscono."""
+from __future__ import annotations
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from app import instrumentation
+from app.database import engine
+
+
+def test_failed_statements_leave_no_start_time(client):
+    with engine.connect() as conn:
+        for _ in range(3):
+            with pytest.raises(OperationalError):
+                conn.execute(text("SELECT * FROM tabella_inesistente"))
+        assert "curvelab_query_start" not in conn.info
+
+        before = instrumentation._queries[instrumentation.BACKGROUND]
+        assert conn.execute(text("SELECT 1")).scalar() == 1
+        assert "curvelab_query_start" not in conn.info
+        assert instrumentation._queries[instrumentation.BACKGROUND] == before + 1
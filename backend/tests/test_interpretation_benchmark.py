@@ -0,0 +1,91 @@
+"""
+Benchmark dell'anteprima di un singolo esame (pytest-benchmark): l'implementazione
+attuale (ExamSeries) contro quella originale del repository (baseline_interpretation.py),
+a parità di payload e con il rule set di default. Ogni gruppo contiene le due varianti,
+confrontabili nella tabella. Marker perf: girano solo con --run-perf.
+
+    cd backend && python -m pytest tests/test_interpretation_benchmark.py --run-perf --benchmark-only
+    python -m pytest tests/test_interpretation_benchmark.py --run-perf --benchmark-only --benchmark-autosave
+    python -m pytest tests/test_interpretation_benchmark.py --run-perf --benchmark-only --benchmark-compare
+
+- interpret_exam: solo l'interpretazione, su 200 esami per round;
+- preview: il lavoro della route (validazione, range del profilo, interpretazione, risposta);
+- preview-http: POST /api/exams/preview con TestClient, HTTP e database compresi.
+Nei due gruppi dell'anteprima l'interpretazione è una piccola parte del tempo: il
+guadagno di interpret_exam vi appare diluito, spesso sotto il rumore della macchina.
+"""
+from __future__ import annotations
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from app import schemas  # noqa: E402
+from app.database import SessionLocal  # noqa: E402
+from app.instrumentation import timed  # noqa: E402
+from app.routers import exams as exams_router  # noqa: E402
+from app.services import interpretation  # noqa: E402
+from app.services.interpretation_rules import DEFAULT_PLAN  # noqa: E402
+from app.services.reference_profiles import apply_default_refs, get_active_snapshot  # noqa: E402
+from baseline_interpretation import interpret_exam as original_interpret_exam  # noqa: E402
+from bench.interpretation import make_payloads  # noqa: E402
+
+pytestmark = pytest.mark.perf
+
+
+@timed("interpret_exam")
+def _original(payload: dict, plan=DEFAULT_PLAN) -> dict:
+    # Regole fisse: confrontabile solo con il rule set di default (quello del profilo di test).
+    # Stesso decoratore della versione attuale: il confronto misura solo l'interpretazione.
+    return original_interpret_exam(payload)
+
+
+IMPLEMENTATIONS = {"current": interpretation.interpret_exam, "original": _original}
+
+
+@pytest.fixture(scope="module")
+def payloads() -> list[dict]:
+    return make_payloads(200, seed=2)
+
+
+@pytest.fixture(scope="module")
+def preview_payloads() -> list[dict]:
+    # Range vuoti: li completa il profilo attivo, come per un'anteprima dal frontend
+    return [
+        {**p, "patient_id": 1, "exam_date": "2024-01-10", "glyc_refs": {}, "ins_refs": {}}
+        for p in make_payloads(200, seed=2)
+    ]
+
+
+@pytest.mark.parametrize("impl", IMPLEMENTATIONS)
+def test_interpret_exam(benchmark, payloads, impl):
+    benchmark.group = "interpret_exam"
+    fn = IMPLEMENTATIONS[impl]
+    results = benchmark(lambda: [fn(p) for p in payloads])
+    assert len(results) == len(payloads)
+
+
+@pytest.mark.parametrize("impl", IMPLEMENTATIONS)
+def test_preview(benchmark, client, preview_payloads, impl):
+    benchmark.group = "preview"
+    fn = IMPLEMENTATIONS[impl]
+    with SessionLocal() as db:
+        snap = get_active_snapshot(db)
+    raw = iter(preview_payloads * 10_000)
+
+    def preview():
+        payload = schemas.ExamPayload.model_validate(next(raw))
+        interp = fn(apply_default_refs(payload.model_dump(), snap.payload), snap.rules)
+        return schemas.InterpretationOut(**interp)
+
+    assert benchmark(preview).overall_status
+
+
+@pytest.mark.parametrize("impl", IMPLEMENTATIONS)
+def test_preview_http(benchmark, client, preview_payloads, monkeypatch, impl):
+    benchmark.group = "preview-http"
+    monkeypatch.setattr(exams_router, "interpret_exam", IMPLEMENTATIONS[impl])
+    raw = iter(preview_payloads * 10_000)
+    response = benchmark(lambda: client.post("/api/exams/preview", json=next(raw)))
+    assert response.status_code == 200
+
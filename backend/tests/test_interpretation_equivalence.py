@@ -0,0 +1,158 @@
+"""
+Equivalenza delle vie di interpretazione su esami casuali con casi limite (valori
+mancanti, NaN, stringhe, serie troncate, tempi non ordinati o ripetuti, range parziali o
+non numerici): interpret_exam (ExamSeries) e interpret_exams_batch (numpy) tra loro con
+ogni rule set, e con l'implementazione originale (baseline_interpretation.py) sul rule set
+di default, per le chiavi che quella restituiva.
+"""
+from __future__ import annotations
+
+import math
+import random
+
+import pytest
+
+from app.services.batch_interpretation import interpret_exams_batch
+from app.services.interpretation import interpret_exam
+from app.services.interpretation_rules import DEFAULT_PLAN, compile_rules
+from baseline_interpretation import interpret_exam as original_interpret_exam
+from bench.interpretation import WHO_1H, make_payloads
+
+CUSTOM_RULES = {
+    "criteria": WHO_1H["criteria"]
+    + [
+        {
+            "code": "ins_120_high",
+            "series": "ins",
+            "time": 120,
+            "op": ">",
+            "value": 150,
+            "severity": "danger",
+            "message": "Insulina a 120' > 150 µU/mL.",
+        }
+    ],
+    "glycemic": {
+        "bands": [
+            {"below": 130, "code": "ngt", "severity": "normal", "message": "Sotto 130 mg/dL."},
+            {"code": "dm", "severity": "danger", "message": "Da 130 mg/dL."},
+        ]
+    },
+    "insulin": {"peak_max_time": 30},
+}
+
+PLANS = {"default": DEFAULT_PLAN, "custom": compile_rules(CUSTOM_RULES)}
+
+
+def _value(rnd: random.Random):
+    r = rnd.random()
+    if r < 0.04:
+        return None
+    if r < 0.07:
+        return float("nan")
+    if r < 0.10:
+        return rnd.choice(["abc", "120", "95,5", ""])
+    return round(rnd.uniform(0, 320), 1)
+
+
+def _ref(rnd: random.Random):
+    r = rnd.random()
+    if r < 0.03:
+        return {"min": rnd.uniform(0, 80)}
+    if r < 0.05:
+        return {"min": None, "max": rnd.choice(["140", "140,5", "", "n/d"])}
+    if r < 0.06:
+        return "n/d"
+    return {"min": rnd.uniform(0, 80), "max": rnd.uniform(80, 200)}
+
+
+def _series(rnd: random.Random):
+    times = rnd.sample([0, 30, 60, 90, 120, 180], rnd.randint(0, 6))
+    if times and rnd.random() < 0.1:
+        times.append(rnd.choice(times))
+    if rnd.random() < 0.5:
+        times.sort()
+    values = [_value(rnd) for _ in times]
+    if rnd.random() < 0.2:
+        values = values[: rnd.randint(0, len(values))]
+    refs = {str(t): _ref(rnd) for t in times if rnd.random() < 0.8}
+    return times, values, refs
+
+
+def edge_payloads(n: int, seed: int = 7) -> list[dict]:
+    rnd = random.Random(seed)
+    out = []
+    for _ in range(n):
+        glyc_times, glyc_values, glyc_refs = _series(rnd)
+        ins_times, ins_values, ins_refs = _series(rnd)
+        out.append(
+            {
+                "glyc_times": glyc_times,
+                "glyc_values": glyc_values,
+                "glyc_refs": glyc_refs,
+                "ins_times": ins_times,
+                "ins_values": ins_values,
+                "ins_refs": ins_refs,
+                "pregnant_mode": rnd.random() < 0.3,
+                "curve_mode": rnd.choice(["glyc", "ins", "combined"]),
+                "include_insulin": rnd.random() < 0.2,
+            }
+        )
+    return out
+
+
+def norm(x):
+    """NaN non è uguale a se stesso: lo confrontiamo come testo."""
+    if isinstance(x, float) and math.isnan(x):
+        return "nan"
+    if isinstance(x, dict):
+        return {k: norm(v) for k, v in x.items()}
+    if isinstance(x, list):
+        return [norm(v) for v in x]
+    return x
+
+
+def as_original(result: dict) -> dict:
+    """Solo le chiavi dell'implementazione originale (senza codici strutturati e criteri)."""
+    details = result["details"]
+    return {
+        "overall_status": result["overall_status"],
+        "summary": result["summary"],
+        "details": {
+            key: details[key]
+            for key in ("glycemic_rows", "insulin_rows", "glycemic_interpretation", "insulin_interpretation")
+        },
+    }
+
+
+PAYLOADS = [pytest.param(edge_payloads(3000), id="edge"), pytest.param(make_payloads(1000), id="realistic")]
+
+
+@pytest.mark.parametrize("payloads", PAYLOADS)
+def test_default_plan_matches_original(payloads):
+    batch = interpret_exams_batch(payloads, DEFAULT_PLAN)
+    assert len(batch) == len(payloads)
+    for payload, from_batch in zip(payloads, batch):
+        expected = norm(original_interpret_exam(payload))
+        assert norm(as_original(interpret_exam(payload))) == expected, payload
+        assert norm(as_original(from_batch)) == expected, payload
+
+
+@pytest.mark.parametrize("plan", PLANS.values(), ids=PLANS.keys())
+@pytest.mark.parametrize("payloads", PAYLOADS)
+def test_scalar_and_batch_agree(payloads, plan):
+    batch = interpret_exams_batch(payloads, plan)
+    assert len(batch) == len(payloads)
+    for payload, from_batch in zip(payloads, batch):
+        assert norm(from_batch) == norm(interpret_exam(payload, plan)), payload
+
+
+def test_custom_plan_is_exercised():
+    # Il confronto sul rule set personalizzato ha senso solo se criteri e fasce scattano davvero
+    results = [interpret_exam(p, PLANS["custom"]) for p in edge_payloads(3000)]
+    assert any(r["details"]["criteria"] for r in results)
+    assert {r["glycemic_class"] for r in results} >= {"ngt", "dm"}
+    assert any(r["insulin_pattern"] == "delayed" for r in results)
+
+
+def test_empty_batch():
+    assert interpret_exams_batch([], DEFAULT_PLAN) == []
@@ -0,0 +1,23 @@
+"""
+Ricerca pazienti con termini più corti di TRIGRAM_MIN: niente sottostringa su search_text,
+solo prefissi (del cognome su surname_key, di parola per gli altri termini).
+"""
+from __future__ import annotations
+
+
+def test_short_terms_match_prefixes(client):
+    ids = {}
+    for surname, name in (("Zubiani", "Olga"), ("Pezzuba", "Olivia")):
+        r = client.post("/api/patients", json={"surname": surname, "name": name})
+        assert r.status_code == 201
+        ids[surname] = r.json()["id"]
+
+    listed = client.get("/api/patients", params={"search": "zu"}).json()
+    assert [p["id"] for p in listed] == [ids["Zubiani"]]
+
+    found = client.get("/api/patients/search", params={"q": "zubi ol"}).json()
+    assert [p["id"] for p in found] == [ids["Zubiani"]]
+    found = client.get("/api/patients/search", params={"q": "pezz ol"}).json()
+    assert [p["id"] for p in found] == [ids["Pezzuba"]]
+    found = client.get("/api/patients/search", params={"q": "zubiani li"}).json()
+    assert found == []
@@ -0,0 +1,67 @@
+"""
+Confronti di tempi (marker perf: girano solo con --run-perf, rumorosi su CI condivisa).
+
+Ogni confronto alterna le due varianti per molti round e usa la mediana dei rapporti
+round per round: un carico variabile della macchina pesa su entrambe allo stesso modo.
+"""
+from __future__ import annotations
+
+import gc
+import statistics
+import time
+
+import pytest
+
+from app.services.batch_interpretation import interpret_exams_batch
+from app.services.exam_import import CHUNK_SIZE
+from app.services.interpretation import interpret_exam
+from app.services.interpretation_rules import DEFAULT_PLAN
+from baseline_interpretation import interpret_exam as original_interpret_exam
+from bench.interpretation import make_payloads
+
+pytestmark = pytest.mark.perf
+
+
+def paired_ratio(candidate, reference, rounds: int = 200) -> float:
+    """Mediana di tempo(candidate) / tempo(reference) su round alternati."""
+    ratios = []
+    gc.disable()
+    try:
+        for _ in range(rounds):
+            t0 = time.perf_counter()
+            candidate()
+            t1 = time.perf_counter()
+            reference()
+            ratios.append((t1 - t0) / (time.perf_counter() - t1))
+    finally:
+        gc.enable()
+    return statistics.median(ratios)
+
+
+@pytest.fixture(scope="module")
+def payloads() -> list[dict]:
+    return make_payloads(200, seed=2)
+
+
+def test_scalar_faster_than_original(payloads):
+    # Senza il decoratore timed: l'originale non lo aveva
+    current = getattr(interpret_exam, "__wrapped__", interpret_exam)
+    ratio = paired_ratio(
+        lambda: [current(p) for p in payloads],
+        lambda: [original_interpret_exam(p) for p in payloads],
+    )
+    assert ratio < 0.95, f"interpret_exam / originale = {ratio:.2f}"
+
+
+def test_batch_faster_than_scalar():
+    # Un blocco dell'import (CHUNK_SIZE esami): la via vettoriale contro il ciclo su interpret_exam.
+    # Le righe di output sono le stesse nelle due vie e ne limitano il margine.
+    payloads = make_payloads(CHUNK_SIZE, seed=3)
+    batch = getattr(interpret_exams_batch, "__wrapped__", interpret_exams_batch)
+    scalar = getattr(interpret_exam, "__wrapped__", interpret_exam)
+    ratio = paired_ratio(
+        lambda: batch(payloads, DEFAULT_PLAN),
+        lambda: [scalar(p, DEFAULT_PLAN) for p in payloads],
+        rounds=60,
+    )
+    assert ratio < 0.95, f"interpret_exams_batch / ciclo scalare = {ratio:.2f}"
@@ -0,0 +1,77 @@
+"""
+Numero di statement SQL per le scritture di esami e pazienti (header Server-Timing,
+contato dagli hook di app/instrumentation.py). Il numero non deve crescere con i punti
+della curva o con gli esami del paziente: una query per riga è una regressione N+1.
+Conteggi su SQLite (indice FTS dei pazienti); su PostgreSQL alcuni statement differiscono.
+"""
+from __future__ import annotations
+
+import re
+
+import pytest
+
+
+def queries(response) -> int:
+    match = re.search(r'db;[^,]*desc="(\d+) query"', response.headers["server-timing"])
+    assert match, response.headers["server-timing"]
+    return int(match.group(1))
+
+
+@pytest.fixture
+def create_exam(client, exam_payload):
+    def create(patient_id: int, **kwargs):
+        r = client.post("/api/exams", json=exam_payload(patient_id, **kwargs))
+        assert r.status_code == 201, r.text
+        return r
+
+    return create
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [{"times": (0, 120)}, {"times": (0, 30, 60, 90, 120, 180)}, {"times": (0, 30, 60, 90, 120, 180), "combined": True}],
+)
+def test_create_exam(create_exam, patient_id, kwargs):
+    # sequenza sync, INSERT esame RETURNING, INSERT punti (executemany), riepiloghi giornaliero e mensile
+    assert queries(create_exam(patient_id, **kwargs)) == 5
+
+
+def test_create_exam_missing_patient(client, exam_payload):
+    r = client.post("/api/exams", json=exam_payload(10**9))
+    assert r.status_code == 404
+    assert queries(r) == 1
+
+
+def test_get_exam(client, create_exam, patient_id):
+    exam_id = create_exam(patient_id, combined=True).json()["id"]
+    r = client.get(f"/api/exams/{exam_id}")
+    assert r.status_code == 200
+    assert len(r.json()["ins_values"]) == 3
+    assert queries(r) == 1  # esame e punti in un'unica SELECT
+
+
+@pytest.mark.parametrize("times", [(0, 120), (0, 30, 60, 90, 120, 180)])
+def test_delete_exam(client, create_exam, patient_id, times):
+    exam_id = create_exam(patient_id, times=times).json()["id"]
+    r = client.delete(f"/api/exams/{exam_id}")
+    assert r.status_code == 204
+    # DELETE RETURNING (punti in cascata nel DB), riepiloghi, sequenza e tombstone
+    assert queries(r) == 7
+    assert client.get(f"/api/exams/{exam_id}").status_code == 404
+
+
+def test_delete_missing_exam(client):
+    r = client.delete(f"/api/exams/{10**9}")
+    assert r.status_code == 404
+    assert queries(r) == 1
+
+
+@pytest.mark.parametrize("n_exams", [1, 5])
+def test_delete_patient(client, create_exam, patient_id, n_exams):
+    exam_ids = [create_exam(patient_id).json()["id"] for _ in range(n_exams)]
+    r = client.delete(f"/api/patients/{patient_id}")
+    assert r.status_code == 204
+    # Esami cancellati con un solo DELETE RETURNING e tombstone in executemany: costante in n_exams
+    assert queries(r) == 11
+    for exam_id in exam_ids:
+        assert client.get(f"/api/exams/{exam_id}").status_code == 404
@@ -0,0 +1,39 @@
+"""
+Regole di interpretazione personalizzate del profilo: un rule set non valido è rifiutato
+al salvataggio e, se arriva comunque al caricamento, il ripiego sulle regole predefinite
+è registrato nel log con il motivo.
+"""
+from __future__ import annotations
+
+import json
+import logging
+
+import pytest
+
+from app import models
+from app.database import SessionLocal
+from app.services.interpretation_rules import DEFAULT_PLAN
+from app.services.reference_profiles import _build_snapshot, get_active_profile
+
+INVALID_RULES = json.dumps({"glycemic": {"bands": []}})
+
+
+def test_invalid_rules_rejected_on_save(client):
+    with SessionLocal() as db:
+        get_active_profile(db).rules_json = INVALID_RULES
+        with pytest.raises(ValueError, match="glycemic.bands"):
+            db.commit()
+        db.rollback()
+        assert get_active_profile(db).rules_json is None
+
+
+def test_invalid_rules_fallback_is_logged(client, caplog):
+    with SessionLocal() as db:
+        row = get_active_profile(db)
+        detached = models.ReferenceProfile(
+            id=row.id, profile_key=row.profile_key, updated_on=row.updated_on, rules_json=INVALID_RULES
+        )
+    with caplog.at_level(logging.WARNING, logger="curvelab.profiles"):
+        snap = _build_snapshot(detached)
+    assert snap.rules is DEFAULT_PLAN
+    assert "glycemic.bands" in caplog.text
@@ -0,0 +1,58 @@
+"""
+Job di reinterpretazione e cambi di profilo: una modifica arrivata mentre il job girava
+(enqueue restituisce il job in corso) non lascia esami con la versione precedente.
+"""
+from __future__ import annotations
+
+from sqlalchemy import delete
+
+from app import models
+from app.database import SessionLocal
+from app.services import reinterpretation
+from app.services.reference_profiles import get_active_profile, get_active_snapshot
+
+
+def _set_notes(notes: str) -> None:
+    with SessionLocal() as db:
+        get_active_profile(db).notes = notes
+        db.commit()
+
+
+def test_profile_change_during_job_requeues(client, patient_id, exam_payload, monkeypatch):
+    assert client.post("/api/exams", json=exam_payload(patient_id)).status_code == 201
+    monkeypatch.setattr(reinterpretation, "start_worker", lambda: None)
+    renew = reinterpretation._renew
+
+    def change_profile_first(db, job):
+        # Prima del primo blocco, fuori dalla sua transazione (SQLite: un solo writer)
+        monkeypatch.setattr(reinterpretation, "_renew", renew)
+        _set_notes("Note modificate durante il job")
+        return renew(db, job)
+
+    with SessionLocal() as db:
+        original_notes = get_active_profile(db).notes
+        old_version = get_active_snapshot(db).version
+        db.add(models.ReinterpretationJob(target_version=old_version, total=0, include_legacy=0))
+        db.commit()
+    created = []
+    try:
+        with SessionLocal() as db:
+            job = reinterpretation._next_job(db)
+            assert reinterpretation._claim(db, job)
+            monkeypatch.setattr(reinterpretation, "_renew", change_profile_first)
+            reinterpretation.run_job(db, job)
+            assert (job.status, job.target_version) == ("done", old_version), job.error
+
+            reinterpretation._requeue_if_changed(db, job)
+            follow_up = reinterpretation._next_job(db)
+            assert follow_up is not None and follow_up.id != job.id
+            created.append(follow_up.id)
+            new_version = get_active_snapshot(db).version
+            assert new_version != old_version
+            assert follow_up.target_version == new_version
+            assert follow_up.total == reinterpretation.count_stale(db, new_version) > 0
+    finally:
+        _set_notes(original_notes)
+        with SessionLocal() as db:
+            db.execute(delete(models.ReinterpretationJob).where(models.ReinterpretationJob.id.in_(created)))
+            db.commit()
@@ -0,0 +1,64 @@
+"""
+Stampa massiva (services/report_jobs.py): un job che fallisce durante il rendering non
+lascia nella cartella di output il file report-job-{id} scritto in parte.
+"""
+from __future__ import annotations
+
+import io
+import json
+from concurrent.futures import Future
+from pathlib import Path
+
+import pytest
+
+from app import models
+from app.config import settings
+from app.database import SessionLocal
+from app.services import report_jobs
+
+
+def _blank_pdf() -> bytes:
+    from pypdf import PdfWriter
+
+    writer = PdfWriter()
+    writer.add_blank_page(width=595, height=842)
+    out = io.BytesIO()
+    writer.write(out)
+    return out.getvalue()
+
+
+class _FailingPool:
+    """Primo blocco renderizzato, poi un errore del processo di rendering."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def submit(self, fn, settings_payload, reports):
+        self.calls += 1
+        future = Future()
+        if self.calls == 1:
+            future.set_result([_blank_pdf() for _ in reports])
+        else:
+            future.set_exception(RuntimeError("rendering interrotto"))
+        return future
+
+
+@pytest.mark.parametrize("fmt", ["zip", "pdf"])
+def test_failed_job_leaves_no_partial_output(client, patient_id, exam_payload, monkeypatch, fmt):
+    pytest.importorskip("pypdf")
+    exam_ids = [client.post("/api/exams", json=exam_payload(patient_id)).json()["id"] for _ in range(3)]
+    monkeypatch.setattr(report_jobs, "get_pool", _FailingPool)
+    monkeypatch.setattr(report_jobs, "MAX_TASK_REPORTS", 1)
+    with SessionLocal() as db:
+        job = models.ReportJob(format=fmt, exam_ids_json=json.dumps(exam_ids), options_json="{}", total=len(exam_ids))
+        db.add(job)
+        db.commit()
+        job_id = job.id
+
+    report_jobs.run_job(job_id)
+
+    with SessionLocal() as db:
+        job = db.get(models.ReportJob, job_id)
+        assert job.status == "failed"
+        assert "rendering interrotto" in job.error
+    assert not list(Path(settings.report_output_dir).glob(f"report-job-{job_id}.*"))
@@ -0,0 +1,23 @@
+"""
+Logo del referto (PUT /api/report-settings, GET /api/report-settings/logo): un'immagine
+che Pillow non decodifica (SVG) è servita con il tipo dichiarato nel data URL.
+"""
+from __future__ import annotations
+
+import base64
+
+SVG = b'<svg xmlns="http://www.w3.org/2000/svg" width="10" height="10"><rect width="10" height="10"/></svg>'
+
+
+def test_svg_logo_keeps_declared_media_type(client):
+    data_url = "data:image/svg+xml;base64," + base64.b64encode(SVG).decode()
+    r = client.put("/api/report-settings", json={"header_logo_data_url": data_url})
+    assert r.status_code == 200, r.text
+    try:
+        logo = client.get("/api/report-settings/logo")
+        assert logo.status_code == 200
+        assert logo.headers["content-type"] == "image/svg+xml"
+        assert logo.headers["x-content-type-options"] == "nosniff"
+        assert logo.content == SVG
+    finally:
+        assert client.put("/api/report-settings", json={"header_logo_data_url": None}).status_code == 200
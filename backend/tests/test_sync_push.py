@@ -0,0 +1,39 @@
+"""
+Push dei client offline (POST /api/sync/push): righe con lo stesso uid nello stesso push
+non arrivano al vincolo UNIQUE; la prima è applicata, le ripetizioni sono conflitti "invalid".
+"""
+from __future__ import annotations
+
+import uuid
+
+
+def test_push_repeated_uids(client):
+    patient_uid, exam_uid = str(uuid.uuid4()), str(uuid.uuid4())
+    patient = {"uid": patient_uid, "surname": "Bianchi", "name": "Anna"}
+    exam = {
+        "uid": exam_uid,
+        "patient_uid": patient_uid,
+        "exam_date": "2026-03-01",
+        "curve_mode": "glyc",
+        "glyc_times": [0, 120],
+        "glyc_values": [85, 130],
+    }
+    r = client.post(
+        "/api/sync/push",
+        json={
+            "patients": [patient, {**patient, "name": "Anna Maria"}],
+            "exams": [exam, {**exam, "glyc_values": [90, 150]}],
+        },
+    )
+    assert r.status_code == 200, r.text
+    body = r.json()
+    assert [(a["entity"], a["uid"], a["action"]) for a in body["applied"]] == [
+        ("patient", patient_uid, "created"),
+        ("exam", exam_uid, "created"),
+    ]
+    assert sorted((c["entity"], c["uid"], c["reason"]) for c in body["conflicts"]) == [
+        ("exam", exam_uid, "invalid"),
+        ("patient", patient_uid, "invalid"),
+    ]
+    exam_id = body["applied"][1]["id"]
+    assert client.get(f"/api/exams/{exam_id}").json()["glyc_values"] == [85, 130]
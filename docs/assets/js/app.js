@@ -2,6 +2,7 @@ import { api, getApiMode } from "./api.js";
 import { bindPatientUI, refreshPatients } from "./ui/patients-ui.js";
 import { bindExamUI, initPresetsAndRefs } from "./ui/exams-ui.js";
 import { bindReportUI } from "./ui/report-ui.js";
+import { syncLocalDatabase } from "./local-api.js";
 
 function renderRuntimeMode() {
   const el = document.getElementById("runtimeMode");
@@ -14,10 +15,29 @@ function renderRuntimeMode() {
   }
 }
 
+async function syncLocal() {
+  const base = (window.APP_CONFIG || {}).SYNC_API_BASE_URL;
+  if (getApiMode() !== "local" || !base) return;
+  try {
+    const res = await syncLocalDatabase(base);
+    if (res.conflicts) console.warn(`[CurveLab] Sincronizzazione: ${res.conflicts} conflitti risolti con la versione del server.`);
+    res.invalid.forEach((c) => {
+      console.warn(`[CurveLab] Sincronizzazione: ${c.entity === "exam" ? "esame" : "paziente"} ${c.uid} non inviato (${c.error}).`);
+    });
+    if (res.invalid.length) {
+      alert(`Sincronizzazione: ${res.invalid.length} record con dati non validi restano solo in locale. Dettagli nella console.`);
+    }
+  } catch (e) {
+    // Offline o server non raggiungibile: si lavora sull'archivio locale e si riprova al prossimo avvio
+    console.warn("[CurveLab] Sincronizzazione non riuscita:", e.message);
+  }
+}
+
 async function boot() {
   try {
     await api.health();
     renderRuntimeMode();
+    await syncLocal();
 
     const presets = await api.getPresets();
     initPresetsAndRefs(presets);
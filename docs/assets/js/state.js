@@ -23,5 +23,7 @@ export const state = {
     include_interpretation_pdf: true,
     merge_charts_pdf: true,
     header_logo_data_url: null,
+    header_logo_url: null,
+    header_logo_hash: null,
   },
 };